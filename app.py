@@ -1,7 +1,8 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, g, send_file
+import re
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, g, send_file, send_from_directory
 from sqlalchemy.exc import IntegrityError, OperationalError
-from sqlalchemy import func, distinct
+from sqlalchemy.orm import selectinload
 from waitress import serve
 from datetime import datetime, time, timedelta
 from dateutil.relativedelta import relativedelta
@@ -17,24 +18,33 @@ from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from io import BytesIO
 
-<<<<<<< Updated upstream
-from database import db, Config, MonitoredGroup, Keyword, MatchedMessage, DB_URI, User, Session, ExportTask
-from telegram_monitor import start_monitoring, stop_monitoring, is_running
+from database import db, Config, MonitoredGroup, Keyword, MatchedMessage, MatchedMessageKeyword, DB_URI, POOL_OPTIONS, User, Session, get_pool_stats, bump_keyword_version, ExportTask
+from telegram_monitor import start_monitoring, stop_monitoring, is_running, register_group, unregister_group, invalidate_keyword_matcher, get_event_filter_stats, get_ocr_stats
 from telegram_utils import get_group_details, get_my_groups, batch_join_groups, run_export_task
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s: %(message)s')
-logger = logging.getLogger(__name__)
-=======
-from database import db, Config, MonitoredGroup, Keyword, MatchedMessage, DB_URI, User, Session, auto_upgrade_database
-from telegram_monitor import start_monitoring, stop_monitoring, is_running, keyword_automatons, automatons_lock
-from telegram_utils import get_group_details, get_my_groups, batch_join_groups
->>>>>>> Stashed changes
+from message_writer import message_writer
+from keyword_matcher import keyword_matcher_store, MATCH_TYPES, compile_keyword_pattern, extract_anchor
+from config_cache import config_cache
+from text_normalizer import removes_punctuation
+from entity_cache import get_entity_cache_stats
+from notifier import notification_dispatcher, notification_coalescer
+from message_queries import (
+    MESSAGES_PER_PAGE, count_messages_query, active_groups_query, hot_keywords_query, group_activity_query,
+    daily_trend_query, monthly_trend_query, messages_query, message_group_names_query
+)
+from metrics import registry as metrics_registry
+from log_manager import get_logger, log_manager
+from migrations import run_migrations
+
+logger = get_logger('app')
+websocket_logger = get_logger('websocket')
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = DB_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(POOL_OPTIONS)
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'your_very_secret_key_here_please_change_me')
+# Prometheus 抓取 /metrics 使用的令牌（Authorization: Bearer <令牌>），未设置时只允许已登录用户访问
+METRICS_TOKEN = os.environ.get('TELSCAN_METRICS_TOKEN')
 
 # 初始化 SocketIO
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
@@ -42,12 +52,10 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 batch_join_tasks = {}
 tasks_lock = Lock()
 
-db.init_app(app)
+# 会话续期写库的最小间隔（秒）
+SESSION_RENEW_INTERVAL = 60
 
-with app.app_context():
-    db.create_all()
-    # 自动检查并升级数据库结构
-    auto_upgrade_database()
+db.init_app(app)
 
 
 # 用于检查用户会话，并实现60分钟过期和自动续期
@@ -67,8 +75,11 @@ def check_session_and_renew():
         return None
 
     # 会话未过期，自动续期60分钟
-    user_session.expiration_time = datetime.now() + timedelta(minutes=60)
-    db.session.commit()
+    # 性能优化: 距上次续期超过1分钟才写库，避免每个请求都执行一次 UPDATE + commit
+    new_expiration = datetime.now() + timedelta(minutes=60)
+    if new_expiration - user_session.expiration_time >= timedelta(seconds=SESSION_RENEW_INTERVAL):
+        user_session.expiration_time = new_expiration
+        db.session.commit()
 
     return db.session.get(User, user_session.user_id)
 
@@ -152,35 +163,26 @@ def dashboard_stats():
         month_start = datetime(now.year, now.month, 1)
         
         # 今日统计
-        today_count = MatchedMessage.query.filter(
-            MatchedMessage.message_date >= today_start
-        ).count()
+        today_count = count_messages_query(db.session, today_start).scalar()
         
         # 本周统计
-        week_count = MatchedMessage.query.filter(
-            MatchedMessage.message_date >= week_start
-        ).count()
+        week_count = count_messages_query(db.session, week_start).scalar()
         
         # 本月统计
-        month_count = MatchedMessage.query.filter(
-            MatchedMessage.message_date >= month_start
-        ).count()
+        month_count = count_messages_query(db.session, month_start).scalar()
         
         # 总计
-        total_count = MatchedMessage.query.count()
+        total_count = count_messages_query(db.session).scalar()
         
         # 活跃群组数（处理 None 情况）
-        active_groups = db.session.query(func.count(distinct(MatchedMessage.group_name))).scalar() or 0
+        active_groups = active_groups_query(db.session).scalar() or 0
         
         # 总群组数
         total_groups = MonitoredGroup.query.count()
         
         # 计算环比（与上一周期对比）- 优化逻辑
         yesterday_start = today_start - timedelta(days=1)
-        yesterday_count = MatchedMessage.query.filter(
-            MatchedMessage.message_date >= yesterday_start,
-            MatchedMessage.message_date < today_start
-        ).count()
+        yesterday_count = count_messages_query(db.session, yesterday_start, today_start).scalar()
         
         if yesterday_count > 0:
             today_change = ((today_count - yesterday_count) / yesterday_count * 100)
@@ -190,10 +192,7 @@ def dashboard_stats():
             today_change = 0
         
         last_week_start = week_start - timedelta(days=7)
-        last_week_count = MatchedMessage.query.filter(
-            MatchedMessage.message_date >= last_week_start,
-            MatchedMessage.message_date < week_start
-        ).count()
+        last_week_count = count_messages_query(db.session, last_week_start, week_start).scalar()
         
         if last_week_count > 0:
             week_change = ((week_count - last_week_count) / last_week_count * 100)
@@ -203,10 +202,7 @@ def dashboard_stats():
             week_change = 0
         
         last_month_start = month_start - relativedelta(months=1)
-        last_month_count = MatchedMessage.query.filter(
-            MatchedMessage.message_date >= last_month_start,
-            MatchedMessage.message_date < month_start
-        ).count()
+        last_month_count = count_messages_query(db.session, last_month_start, month_start).scalar()
         
         if last_month_count > 0:
             month_change = ((month_count - last_month_count) / last_month_count * 100)
@@ -259,17 +255,8 @@ def dashboard_hot_keywords():
         else:  # all
             start_date = datetime(2000, 1, 1)
         
-        # 统计关键词频率
-        keyword_stats = db.session.query(
-            MatchedMessage.matched_keyword,
-            func.count(MatchedMessage.matched_keyword).label('count')
-        ).filter(
-            MatchedMessage.message_date >= start_date
-        ).group_by(
-            MatchedMessage.matched_keyword
-        ).order_by(
-            func.count(MatchedMessage.matched_keyword).desc()
-        ).limit(limit).all()
+        # 统计关键词频率（基于关联表，一条消息命中的每个关键词都计数）
+        keyword_stats = hot_keywords_query(db.session, start_date, limit).all()
         
         result = [{'keyword': kw, 'count': cnt} for kw, cnt in keyword_stats]
         
@@ -302,16 +289,7 @@ def dashboard_group_activity():
             start_date = datetime(2000, 1, 1)
         
         # 统计群组活跃度
-        group_stats = db.session.query(
-            MatchedMessage.group_name,
-            func.count(MatchedMessage.id).label('count')
-        ).filter(
-            MatchedMessage.message_date >= start_date
-        ).group_by(
-            MatchedMessage.group_name
-        ).order_by(
-            func.count(MatchedMessage.id).desc()
-        ).limit(limit).all()
+        group_stats = group_activity_query(db.session, start_date, limit).all()
         
         result = [{'group_name': gn, 'count': cnt} for gn, cnt in group_stats]
         
@@ -337,14 +315,7 @@ def dashboard_trends():
             start_date = datetime.combine(now.date(), time.min) - timedelta(days=6)
             
             # 一次性查询所有数据并按日期分组
-            results = db.session.query(
-                func.date(MatchedMessage.message_date).label('date'),
-                func.count(MatchedMessage.id).label('count')
-            ).filter(
-                MatchedMessage.message_date >= start_date
-            ).group_by(
-                func.date(MatchedMessage.message_date)
-            ).all()
+            results = daily_trend_query(db.session, start_date).all()
             
             # 创建日期到数量的映射
             date_count_map = {str(r.date): r.count for r in results}
@@ -364,14 +335,7 @@ def dashboard_trends():
             # 最近30天，按天统计（优化：一次查询）
             start_date = datetime.combine(now.date(), time.min) - timedelta(days=29)
             
-            results = db.session.query(
-                func.date(MatchedMessage.message_date).label('date'),
-                func.count(MatchedMessage.id).label('count')
-            ).filter(
-                MatchedMessage.message_date >= start_date
-            ).group_by(
-                func.date(MatchedMessage.message_date)
-            ).all()
+            results = daily_trend_query(db.session, start_date).all()
             
             date_count_map = {str(r.date): r.count for r in results}
             
@@ -390,14 +354,7 @@ def dashboard_trends():
             start_month = current_month_start - relativedelta(months=11)
             
             # 一次性查询所有数据并按月分组
-            results = db.session.query(
-                func.date_format(MatchedMessage.message_date, '%Y-%m').label('month'),
-                func.count(MatchedMessage.id).label('count')
-            ).filter(
-                MatchedMessage.message_date >= start_month
-            ).group_by(
-                func.date_format(MatchedMessage.message_date, '%Y-%m')
-            ).all()
+            results = monthly_trend_query(db.session, start_month).all()
             
             month_count_map = {r.month: r.count for r in results}
             
@@ -429,6 +386,12 @@ def config():
         dingtalk_webhook = request.form.get('dingtalk_webhook')
         dingtalk_secret = request.form.get('dingtalk_secret')
         wecom_webhook = request.form.get('wecom_webhook')
+        digest_window = request.form.get('notification_digest_window', 0, type=int)
+        digest_group_by = request.form.get('notification_digest_group_by', 'keyword')
+        if digest_window < 0:
+            digest_window = 0
+        if digest_group_by not in ['keyword', 'group']:
+            digest_group_by = 'keyword'
 
         if config_item:
             config_item.api_id = api_id
@@ -438,6 +401,10 @@ def config():
             config_item.dingtalk_webhook = dingtalk_webhook
             config_item.dingtalk_secret = dingtalk_secret
             config_item.wecom_webhook = wecom_webhook
+            config_item.notification_digest_window = digest_window
+            config_item.notification_digest_group_by = digest_group_by
+            # 版本号自增，其他进程据此发现配置变更
+            config_item.version = (config_item.version or 0) + 1
         else:
             config_item = Config(
                 api_id=api_id,
@@ -446,11 +413,15 @@ def config():
                 notification_type=notification_type,
                 dingtalk_webhook=dingtalk_webhook,
                 dingtalk_secret=dingtalk_secret,
-                wecom_webhook=wecom_webhook
+                wecom_webhook=wecom_webhook,
+                notification_digest_window=digest_window,
+                notification_digest_group_by=digest_group_by
             )
             db.session.add(config_item)
         
         db.session.commit()
+        # 本进程立即重新加载配置缓存
+        config_cache.reload()
         flash('配置已成功保存！', 'success')
         return redirect(url_for('config'))
 
@@ -462,7 +433,9 @@ def config():
             'notification_type': 'none',
             'dingtalk_webhook': '',
             'dingtalk_secret': '',
-            'wecom_webhook': ''
+            'wecom_webhook': '',
+            'notification_digest_window': 0,
+            'notification_digest_group_by': 'keyword'
         }
 
     return render_template('config.html', config=config_item, is_running=is_running)
@@ -532,6 +505,77 @@ def status():
     is_alive = client_thread is not None and client_thread.is_alive()
     return jsonify({'is_running': is_alive})
 
+@app.route('/api/db_pool_stats')
+@login_required
+def db_pool_stats():
+    """获取监控线程共享数据库连接池的统计信息"""
+    return jsonify(get_pool_stats())
+
+@app.route('/api/message_writer_stats')
+@login_required
+def message_writer_stats():
+    """获取匹配消息批量写入队列的统计信息"""
+    return jsonify(message_writer.get_stats())
+
+@app.route('/api/keyword_matcher_stats')
+@login_required
+def keyword_matcher_stats():
+    """获取全局关键词匹配器的代数与后台重建统计"""
+    return jsonify(keyword_matcher_store.get_stats())
+
+@app.route('/api/notification_stats')
+@login_required
+def notification_stats():
+    """获取通知分发队列和汇总层的统计信息"""
+    stats = notification_dispatcher.get_stats()
+    stats['digest'] = notification_coalescer.get_stats()
+    stats['config_cache'] = config_cache.get_stats()
+    return jsonify(stats)
+
+@app.route('/api/entity_cache_stats')
+@login_required
+def entity_cache_stats():
+    """获取群组/发送人实体缓存的命中率统计"""
+    return jsonify(get_entity_cache_stats())
+
+@app.route('/api/event_filter_stats')
+@login_required
+def event_filter_stats():
+    """获取消息事件过滤统计（丢弃/处理数）"""
+    return jsonify(get_event_filter_stats())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 文本格式的监控指标（已登录用户或携带 Bearer 令牌访问）"""
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and secrets.compare_digest(authorization, f'Bearer {METRICS_TOKEN}')
+    if g.user is None and not token_ok:
+        return make_response('unauthorized\n', 401, {'WWW-Authenticate': 'Bearer'})
+    return make_response(metrics_registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+@app.route('/api/ocr_stats')
+@login_required
+def ocr_stats():
+    """获取OCR待处理任务、内存预算和识别结果缓存命中率统计"""
+    return jsonify(get_ocr_stats())
+
+@app.route('/api/log_config', methods=['GET', 'POST'])
+@login_required
+def log_config():
+    """
+    查看/修改各分类日志级别和调试日志采样间隔（立即生效，无需重启）
+    POST: {"levels": {"message": "DEBUG"}, "sample_rates": {"message_unmatched": 50}}
+    """
+    if request.method == 'GET':
+        return jsonify(log_manager.get_config())
+    data = request.get_json(silent=True) or {}
+    try:
+        result = log_manager.update_config(data.get('levels'), data.get('sample_rates'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    logger.info(f"日志配置已更新: {result}")
+    return jsonify(result)
+
 @app.route('/control/test_dingtalk', methods=['POST'])
 @login_required # 添加鉴权装饰器
 def test_dingtalk():
@@ -588,6 +632,7 @@ def groups():
                     db.session.add(new_group)
                     try:
                         db.session.commit()
+                        register_group(new_group)
                         flash(f"群组 '{details['name']}' 添加成功！", 'success')
                     except IntegrityError:
                         db.session.rollback()
@@ -612,11 +657,6 @@ def groups():
     query = MonitoredGroup.query
     if search_query:
         query = query.filter(MonitoredGroup.group_name.ilike(f'%{search_query}%'))
-<<<<<<< Updated upstream
-        
-    all_groups = query.order_by(MonitoredGroup.group_name).all()
-    return render_template('groups.html', groups=all_groups, search_query=search_query)
-=======
     
     # 使用分页
     pagination = query.order_by(MonitoredGroup.group_name).paginate(
@@ -631,7 +671,6 @@ def groups():
         pagination=pagination,     # 分页对象
         search_query=search_query
     )
->>>>>>> Stashed changes
 
 @app.route('/add_my_groups', methods=['GET'])
 @login_required # 添加鉴权装饰器
@@ -662,6 +701,7 @@ def batch_add_groups():
     groups_to_add = request.form.getlist('groups')
     added_count = 0
     skipped_count = 0
+    new_groups = []
     for group_data in groups_to_add:
         parts = group_data.split('|||')
         if len(parts) != 3: continue
@@ -676,12 +716,15 @@ def batch_add_groups():
                 logo_path=logo_path if logo_path != 'None' else None
             )
             db.session.add(new_group)
+            new_groups.append(new_group)
             added_count += 1
         else:
             skipped_count += 1
     
     if added_count > 0:
         db.session.commit()
+        for new_group in new_groups:
+            register_group(new_group)
         flash(f'成功添加 {added_count} 个新群组！', 'success')
     if skipped_count > 0:
         flash(f'跳过 {skipped_count} 个已存在的群组。', 'info')
@@ -695,6 +738,7 @@ def delete_group(group_id):
     group_to_delete = MonitoredGroup.query.get_or_404(group_id)
     db.session.delete(group_to_delete)
     db.session.commit()
+    unregister_group(group_id)
     flash('群组已删除。', 'info')
     return redirect(url_for('groups'))
 
@@ -709,10 +753,13 @@ def batch_delete_groups():
     groups_to_delete = MonitoredGroup.query.filter(MonitoredGroup.id.in_(group_ids)).all()
     
     deleted_count = len(groups_to_delete)
+    deleted_ids = [group.id for group in groups_to_delete]
     for group in groups_to_delete:
         db.session.delete(group)
 
     db.session.commit()
+    for deleted_id in deleted_ids:
+        unregister_group(deleted_id)
     flash(f'成功删除 {deleted_count} 个群组!', 'success')
     return redirect(url_for('groups'))
 
@@ -722,6 +769,10 @@ def keywords():
     if request.method == 'POST':
         keywords_text = request.form.get('keywords_text', '').strip()
         group_ids = request.form.getlist('groups')
+        is_urgent = request.form.get('is_urgent') == 'on'
+        match_type = request.form.get('match_type', 'literal')
+        if match_type not in MATCH_TYPES:
+            match_type = 'literal'
 
         if not keywords_text:
             flash('关键词列表不能为空。', 'danger')
@@ -731,50 +782,67 @@ def keywords():
             keywords_list = [kw.strip() for kw in keywords_text.splitlines() if kw.strip()]
             added_count = 0
             skipped_count = 0
+            invalid_patterns = []
+            unanchored_patterns = []
+            exact_keywords = []
             groups = MonitoredGroup.query.filter(MonitoredGroup.id.in_(group_ids)).all()
 
             for keyword_text in keywords_list:
+                anchor = None
+                if match_type != 'literal':
+                    # 正则/通配符关键词: 保存时校验语法并提取锚点
+                    try:
+                        compile_keyword_pattern(keyword_text, match_type)
+                        anchor = extract_anchor(keyword_text, match_type) or None
+                    except re.error as e:
+                        invalid_patterns.append(f"{keyword_text}（{e}）")
+                        continue
+                    if anchor is None:
+                        unanchored_patterns.append(keyword_text)
+                elif removes_punctuation(keyword_text):
+                    exact_keywords.append(keyword_text)
+
                 existing_keyword = Keyword.query.filter_by(text=keyword_text).first()
                 if existing_keyword:
                     skipped_count += 1
                 else:
-                    new_keyword = Keyword(text=keyword_text)
+                    new_keyword = Keyword(text=keyword_text, is_urgent=is_urgent, match_type=match_type, anchor=anchor)
                     new_keyword.groups.extend(groups)
                     db.session.add(new_keyword)
                     added_count += 1
             
             if added_count > 0:
+                bump_keyword_version(db.session)
                 db.session.commit()
                 
-                # 性能优化: 清空相关群组的AC自动机缓存
-                with automatons_lock:
-                    for group in groups:
-                        keyword_automatons.pop(group.id, None)
+                # 性能优化: 关键词变更，重建全局AC自动机
+                invalidate_keyword_matcher()
                 
                 flash(f'成功添加 {added_count} 个新关键词！', 'success')
             
             if skipped_count > 0:
                 flash(f'跳过了 {skipped_count} 个已存在的关键词。', 'info')
 
+            if invalid_patterns:
+                flash(f'以下表达式语法错误，未添加: {"; ".join(invalid_patterns)}', 'danger')
+
+            if unanchored_patterns:
+                flash(f'以下表达式没有可用的固定文字作为锚点，将对每条消息执行，可能影响性能: {", ".join(unanchored_patterns)}', 'warning')
+
+            if exact_keywords:
+                flash(f'以下关键词包含标点，标点须在消息中原样出现（仍识别大小写、全角、繁体及插入的空格，但不识别插入的其他标点）: {", ".join(exact_keywords)}', 'warning')
+
         return redirect(url_for('keywords'))
 
     # 处理GET请求
     search_query = request.args.get('q', '').strip()
-<<<<<<< Updated upstream
-=======
     page = request.args.get('page', 1, type=int)  # 获取当前页码，默认第1页
     per_page = 50  # 每页显示50条
->>>>>>> Stashed changes
     
     query = Keyword.query
     if search_query:
         query = query.filter(Keyword.text.ilike(f'%{search_query}%'))
 
-<<<<<<< Updated upstream
-    all_keywords = query.order_by(Keyword.id.desc()).all()
-    all_groups = MonitoredGroup.query.all()
-    return render_template('keywords.html', keywords=all_keywords, groups=all_groups, search_query=search_query)
-=======
     # 使用分页：paginate(page, per_page, error_out=False)
     pagination = query.order_by(Keyword.id.desc()).paginate(
         page=page, 
@@ -790,7 +858,6 @@ def keywords():
         groups=all_groups, 
         search_query=search_query
     )
->>>>>>> Stashed changes
 
 @app.route('/keywords/edit/<int:keyword_id>', methods=['GET', 'POST'])
 @login_required # 添加鉴权装饰器
@@ -801,19 +868,18 @@ def edit_keyword(keyword_id):
         if not group_ids:
             flash('必须至少选择一个群组。', 'danger')
         else:
-            # 性能优化: 保存旧的群组列表
-            old_groups = list(keyword_to_edit.groups)
-            
             groups = MonitoredGroup.query.filter(MonitoredGroup.id.in_(group_ids)).all()
             keyword_to_edit.groups = groups 
+            keyword_to_edit.is_urgent = request.form.get('is_urgent') == 'on'
+            if keyword_to_edit.match_type != 'literal':
+                # 锚点留空时重新自动提取
+                anchor = request.form.get('anchor', '').strip()
+                keyword_to_edit.anchor = anchor or extract_anchor(keyword_to_edit.text, keyword_to_edit.match_type) or None
+            bump_keyword_version(db.session)
             db.session.commit()
             
-            # 性能优化: 清空旧的和新的群组的AC自动机缓存
-            with automatons_lock:
-                for group in old_groups:
-                    keyword_automatons.pop(group.id, None)
-                for group in groups:
-                    keyword_automatons.pop(group.id, None)
+            # 性能优化: 群组关联变更，重建全局AC自动机
+            invalidate_keyword_matcher()
             
             flash('关键词关联已更新！', 'success')
         return redirect(url_for('keywords'))
@@ -821,26 +887,19 @@ def edit_keyword(keyword_id):
     all_groups = MonitoredGroup.query.all()
     linked_group_ids = {group.id for group in keyword_to_edit.groups}
     return render_template('edit_keyword.html', keyword=keyword_to_edit, groups=all_groups, linked_group_ids=linked_group_ids)
-<<<<<<< Updated upstream
-=======
 
->>>>>>> Stashed changes
 
 @app.route('/keywords/delete/<int:keyword_id>')
 @login_required # 添加鉴权装饰器
 def delete_keyword(keyword_id):
     keyword_to_delete = Keyword.query.get_or_404(keyword_id)
     
-    # 性能优化: 清空相关群组的AC自动机缓存
-    affected_groups = list(keyword_to_delete.groups)
-    
     db.session.delete(keyword_to_delete)
+    bump_keyword_version(db.session)
     db.session.commit()
     
-    # 删除后清空缓存
-    with automatons_lock:
-        for group in affected_groups:
-            keyword_automatons.pop(group.id, None)
+    # 删除后重建全局AC自动机
+    invalidate_keyword_matcher()
     
     flash('关键词已删除。', 'info')
     return redirect(url_for('keywords'))
@@ -855,22 +914,15 @@ def batch_delete_keywords():
         
     keywords_to_delete = Keyword.query.filter(Keyword.id.in_(keyword_ids)).all()
     
-    # 性能优化: 收集所有受影响的群组
-    affected_groups = set()
-    for keyword in keywords_to_delete:
-        for group in keyword.groups:
-            affected_groups.add(group.id)
-    
     deleted_count = len(keywords_to_delete)
     for keyword in keywords_to_delete:
         db.session.delete(keyword)
     
+    bump_keyword_version(db.session)
     db.session.commit()
     
-    # 清空所有受影响群组的AC自动机缓存
-    with automatons_lock:
-        for group_id in affected_groups:
-            keyword_automatons.pop(group_id, None)
+    # 重建全局AC自动机
+    invalidate_keyword_matcher()
     
     flash(f'成功删除 {deleted_count} 个关键词！', 'success')
     return redirect(url_for('keywords'))
@@ -882,55 +934,33 @@ def messages():
     group_filter = request.args.get('group_name', '')
     start_date_filter = request.args.get('start_date', '')
     end_date_filter = request.args.get('end_date', '')
-<<<<<<< Updated upstream
     keyword_filter = request.args.get('keyword', '')
-=======
     page = request.args.get('page', 1, type=int)  # 获取当前页码，默认第1页
-    per_page = 100  # 每页显示100条
->>>>>>> Stashed changes
-
-    query = MatchedMessage.query
-
-    if group_filter:
-        query = query.filter(MatchedMessage.group_name == group_filter)
-<<<<<<< Updated upstream
-    if keyword_filter:
-        query = query.filter(MatchedMessage.message_content.ilike(f'%{keyword_filter}%'))
-=======
->>>>>>> Stashed changes
+
+    start_date = None
+    end_of_day = None
     if start_date_filter:
         try:
             start_date = datetime.strptime(start_date_filter, '%Y-%m-%d').date()
-            query = query.filter(MatchedMessage.message_date >= start_date)
         except ValueError:
             flash('无效的开始日期格式，请使用 YYYY-MM-DD。', 'danger')
     if end_date_filter:
         try:
             end_date = datetime.strptime(end_date_filter, '%Y-%m-%d')
             end_of_day = datetime.combine(end_date, time.max)
-            query = query.filter(MatchedMessage.message_date <= end_of_day)
         except ValueError:
             flash('无效的结束日期格式，请使用 YYYY-MM-DD。', 'danger')
 
-<<<<<<< Updated upstream
-    try:
-        matched_messages = query.order_by(MatchedMessage.message_date.desc()).all()
-    except Exception as e:
-        logger.error(f"Error querying messages: {str(e)}")
-        flash(f'查询消息时发生错误: {str(e)}', 'danger')
-        return render_template('messages.html', messages=[], group_logo_map={}, unique_group_names=[], filter_values={})
+    query = messages_query(db.session, group_filter, start_date, end_of_day, keyword_filter)
 
-    all_message_groups = db.session.query(MatchedMessage.group_name).distinct().order_by(MatchedMessage.group_name).all()
-=======
     # 使用分页
-    pagination = query.order_by(MatchedMessage.message_date.desc()).paginate(
+    pagination = query.options(selectinload(MatchedMessage.keywords)).paginate(
         page=page, 
-        per_page=per_page, 
+        per_page=MESSAGES_PER_PAGE, 
         error_out=False
     )
     
-    all_message_groups = db.session.query(MatchedMessage.group_name).distinct().order_by('group_name').all()
->>>>>>> Stashed changes
+    all_message_groups = message_group_names_query(db.session).all()
     unique_group_names = [name for name, in all_message_groups]
 
     all_groups = MonitoredGroup.query.all()
@@ -939,12 +969,8 @@ def messages():
     filter_values = {
         'group_name': group_filter,
         'start_date': start_date_filter,
-<<<<<<< Updated upstream
         'end_date': end_date_filter,
         'keyword': keyword_filter
-=======
-        'end_date': end_date_filter
->>>>>>> Stashed changes
     }
     
     return render_template(
@@ -960,66 +986,32 @@ def messages():
 @app.route('/messages/export')
 @login_required
 def export_messages():
-<<<<<<< Updated upstream
-    group_filter = request.args.get('group_name', '')
-    start_date_filter = request.args.get('start_date', '')
-    end_date_filter = request.args.get('end_date', '')
-    keyword_filter = request.args.get('keyword', '')
-
-    query = MatchedMessage.query
-
-    if group_filter:
-        query = query.filter(MatchedMessage.group_name == group_filter)
-    if keyword_filter:
-        query = query.filter(MatchedMessage.message_content.ilike(f'%{keyword_filter}%'))
-    if start_date_filter:
-        try:
-            start_date = datetime.strptime(start_date_filter, '%Y-%m-%d').date()
-            query = query.filter(MatchedMessage.message_date >= start_date)
-        except ValueError:
-            flash('无效的开始日期格式，请使用 YYYY-MM-DD。', 'danger')
-            logger.error(f"Invalid start_date format: {start_date_filter}")
-            return redirect(url_for('messages'))
-    if end_date_filter:
-        try:
-            end_date = datetime.strptime(end_date_filter, '%Y-%m-%d').date()
-            end_of_day = datetime.combine(end_date, time.max)
-            query = query.filter(MatchedMessage.message_date <= end_of_day)
-        except ValueError:
-            flash('无效的结束日期格式，请使用 YYYY-MM-DD。', 'danger')
-            logger.error(f"Invalid end_date format: {end_date_filter}")
-            return redirect(url_for('messages'))
-
-=======
     """导出消息为Excel文件，支持中文和特殊字符"""
->>>>>>> Stashed changes
     try:
         # 获取筛选条件（与messages路由相同）
         group_filter = request.args.get('group_name', '')
         start_date_filter = request.args.get('start_date', '')
         end_date_filter = request.args.get('end_date', '')
+        keyword_filter = request.args.get('keyword', '')
         
         # 构建查询（与messages路由相同）
-        query = MatchedMessage.query
-        
-        if group_filter:
-            query = query.filter(MatchedMessage.group_name == group_filter)
+        start_date = None
+        end_of_day = None
         if start_date_filter:
             try:
                 start_date = datetime.strptime(start_date_filter, '%Y-%m-%d').date()
-                query = query.filter(MatchedMessage.message_date >= start_date)
             except ValueError:
                 pass
         if end_date_filter:
             try:
                 end_date = datetime.strptime(end_date_filter, '%Y-%m-%d')
                 end_of_day = datetime.combine(end_date, time.max)
-                query = query.filter(MatchedMessage.message_date <= end_of_day)
             except ValueError:
                 pass
+        query = messages_query(db.session, group_filter, start_date, end_of_day, keyword_filter)
         
         # 获取所有符合条件的消息（不分页）
-        messages = query.order_by(MatchedMessage.message_date.desc()).all()
+        messages = query.options(selectinload(MatchedMessage.keywords)).all()
         
         # 创建Excel工作簿
         wb = Workbook()
@@ -1063,7 +1055,7 @@ def export_messages():
             row_data = [
                 idx,
                 msg.group_name or '',
-                msg.matched_keyword or '',
+                ', '.join(msg.all_keywords),
                 msg.sender or '未知',
                 msg.message_content or '',
                 msg.message_date.strftime('%Y-%m-%d %H:%M:%S') if msg.message_date else ''
@@ -1125,6 +1117,7 @@ def delete_message(message_id):
 @login_required # 添加鉴权装饰器
 def clear_all_messages():
     try:
+        db.session.query(MatchedMessageKeyword).delete()
         num_rows_deleted = db.session.query(MatchedMessage).delete()
         db.session.commit()
         flash(f'已清空 {num_rows_deleted} 条消息。', 'success')
@@ -1133,44 +1126,51 @@ def clear_all_messages():
         flash(f'清空消息时出错: {e}', 'danger')
     return redirect(url_for('messages'))
 
-<<<<<<< Updated upstream
 @app.route('/export')
 @login_required
 def export_page():
     groups = MonitoredGroup.query.order_by(MonitoredGroup.group_name).all()
     tasks = ExportTask.query.order_by(ExportTask.created_at.desc()).all()
     return render_template('export.html', groups=groups, tasks=tasks)
-=======
->>>>>>> Stashed changes
 
-# WebSocket 事件处理
-@socketio.on('connect')
-def handle_connect():
-    """客户端连接事件"""
-    print(f"[WebSocket] 客户端已连接")
-
-@socketio.on('disconnect')
-def handle_disconnect():
-    """客户端断开连接事件"""
-    print(f"[WebSocket] 客户端已断开")
-
-# 广播新消息到所有连接的客户端
-def broadcast_new_message(message_data):
+def update_export_task_in_db(task_id, status, file_path=None, log_message=None):
     """
-    广播新消息到所有WebSocket客户端
-    message_data: {
-        'group_name': str,
-        'sender': str,
-        'matched_keyword': str,
-        'message_content': str,
-        'message_date': str
-    }
+    在导出线程中更新任务状态，日志逐行追加
     """
+    with app.app_context():
+        try:
+            task = db.session.get(ExportTask, task_id)
+            if not task:
+                return
+            task.status = status
+            if file_path:
+                task.file_path = file_path
+            if log_message:
+                line = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {log_message}"
+                task.log = f"{task.log}\n{line}" if task.log else line
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error updating export task {task_id}: {e}", exc_info=True)
+
+@app.route('/start_export', methods=['POST'])
+@login_required
+def start_export():
+    group_identifier = request.form.get('group_identifier', '').strip()
+    file_format = request.form.get('file_format', 'json')
+    if not group_identifier:
+        return jsonify({'success': False, 'error': '请选择要导出的群组'})
+
+    group = MonitoredGroup.query.filter_by(group_identifier=group_identifier).first()
     try:
-        socketio.emit('new_message', message_data, namespace='/')
-        print(f"[WebSocket] 广播新消息: {message_data.get('matched_keyword')}")
+        new_task = ExportTask(
+            group_identifier=group_identifier,
+            group_name=group.group_name if group else group_identifier,
+            status='pending'
+        )
+        db.session.add(new_task)
+        db.session.commit()
     except Exception as e:
-<<<<<<< Updated upstream
         logger.error(f"Error creating export task in database: {e}", exc_info=True)
         db.session.rollback()
         return jsonify({'success': False, 'error': f'数据库错误: {e}'})
@@ -1229,11 +1229,44 @@ def delete_task(task_id):
         db.session.commit()
         return jsonify({'success': True})
     return jsonify({'success': False, 'error': '任务未找到'})
-=======
-        print(f"[WebSocket] 广播失败: {e}")
->>>>>>> Stashed changes
+
+
+# WebSocket 事件处理
+@socketio.on('connect')
+def handle_connect():
+    """客户端连接事件"""
+    websocket_logger.info("[WebSocket] 客户端已连接")
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    """客户端断开连接事件"""
+    websocket_logger.info("[WebSocket] 客户端已断开")
+
+# 广播新消息到所有连接的客户端
+def broadcast_new_message(message_data):
+    """
+    广播新消息到所有WebSocket客户端
+    message_data: {
+        'group_name': str,
+        'sender': str,
+        'matched_keyword': str,
+        'message_content': str,
+        'message_date': str
+    }
+    """
+    try:
+        socketio.emit('new_message', message_data, namespace='/')
+        websocket_logger.debug("[WebSocket] 广播新消息: %s", message_data.get('matched_keyword'))
+    except Exception as e:
+        websocket_logger.warning(f"[WebSocket] 广播失败: {e}")
 
 if __name__ == '__main__':
+    # 建表和迁移只在启动脚本中执行: OCR工作进程（forkserver/spawn）会以 __mp_main__ 重新导入本文件
+    with app.app_context():
+        db.create_all()
+        # 执行尚未执行的数据库结构迁移（字段、索引等）
+        run_migrations()
+
     with app.app_context():
         config = Config.query.first()
         if not config:
@@ -1260,7 +1293,7 @@ if __name__ == '__main__':
             print("请重新启动程序以加载新配置并完成Telegram登录。")
             exit() 
 
-    print("检测到配置，正在启动Telegram监控服务，请稍候...")
+    logger.info("检测到配置，正在启动Telegram监控服务，请稍候...")
     
     # 设置 WebSocket 回调函数
     import telegram_monitor
@@ -1269,13 +1302,12 @@ if __name__ == '__main__':
     start_monitoring()
     
     from telegram_monitor import client_ready
-    print("等待客户端完全连接成功...")
+    logger.info("等待客户端完全连接成功...")
     ready = client_ready.wait(timeout=60) 
     if not ready:
-        print("\n错误：监控服务在60秒内未能成功连接。")
-        print("请检查您的网络连接、Telegram API凭据是否正确，然后重启程序。")
+        logger.error("监控服务在60秒内未能成功连接。请检查您的网络连接、Telegram API凭据是否正确，然后重启程序。")
         exit() 
-    print("监控服务已就绪！")
+    logger.info("监控服务已就绪！")
 
     WEB_PORT = 8033 # 定义端口变量，方便统一管理
 
@@ -1304,8 +1336,7 @@ if __name__ == '__main__':
             print("   请务必妥善保管此密码。下次登录时将使用此密码。")
             print("------------------------------------------------------")
 
-    print("\n启动Web服务器...")
-    print(f"请在浏览器中打开 http://服务器IP:{WEB_PORT}")
+    logger.info(f"启动Web服务器，请在浏览器中打开 http://服务器IP:{WEB_PORT}")
     
     # 使用 socketio.run 代替 serve (在生产环境中可以使用 eventlet 或 gevent)
     socketio.run(app, host='0.0.0.0', port=WEB_PORT, debug=False, allow_unsafe_werkzeug=True)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库写入基准测试 - 每条消息新建引擎 vs 全局共享连接池
+
+模拟消息处理器保存 MatchedMessage 的路径，分别测量:
+  per_engine: 旧实现，每条消息 create_engine() + 新连接
+  pooled:     新实现，所有线程共用一个带连接池的引擎
+
+用法:
+    python benchmarks/bench_db_pool.py --messages 2000 --threads 4
+    python benchmarks/bench_db_pool.py --db-uri sqlite:///bench.sqlite
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+from database import MatchedMessage, POOL_OPTIONS, InstrumentedQueuePool
+
+BENCH_GROUP_NAME = '__benchmark__'
+
+def save_message(session, index):
+    session.add(MatchedMessage(
+        group_name=BENCH_GROUP_NAME,
+        message_content=f"基准测试消息 #{index} USDT 代理",
+        sender='bench',
+        message_date=datetime.now(),
+        matched_keyword='USDT'
+    ))
+    session.commit()
+
+def run_per_engine(db_uri, index):
+    # 与旧版 get_db_session() 相同: 每次调用都创建新引擎
+    engine = create_engine(db_uri)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        save_message(session, index)
+    finally:
+        session.close()
+
+def make_pooled_runner(db_uri):
+    engine = create_engine(db_uri, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
+    Session = sessionmaker(bind=engine)
+
+    def run_pooled(_db_uri, index):
+        session = Session()
+        try:
+            save_message(session, index)
+        finally:
+            session.close()
+
+    return run_pooled, engine
+
+def run_benchmark(name, runner, db_uri, messages, threads):
+    counter = iter(range(messages))
+    counter_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            runner(db_uri, index)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    rate = messages / elapsed if elapsed else 0.0
+    print(f"{name:<12} {messages} 条消息, 耗时 {elapsed:.2f}s, 吞吐 {rate:.1f} 条/秒")
+    return rate
+
+def cleanup(db_uri):
+    engine = create_engine(db_uri)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        session.query(MatchedMessage).filter_by(group_name=BENCH_GROUP_NAME).delete()
+        session.commit()
+    finally:
+        session.close()
+        engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库写入基准测试（每消息引擎 vs 共享连接池）')
+    parser.add_argument('--db-uri', default=database.DB_URI, help='数据库连接串，默认读取 mysql.json')
+    parser.add_argument('--messages', type=int, default=1000, help='每种模式写入的消息数')
+    parser.add_argument('--threads', type=int, default=4, help='并发写入线程数（模拟监控线程和OCR回调）')
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_uri)
+    database.db.metadata.create_all(engine, tables=[MatchedMessage.__table__])
+    engine.dispose()
+
+    try:
+        before = run_benchmark('per_engine', run_per_engine, args.db_uri, args.messages, args.threads)
+
+        database.pool_stats.reset()
+        run_pooled, pooled_engine = make_pooled_runner(args.db_uri)
+        after = run_benchmark('pooled', run_pooled, args.db_uri, args.messages, args.threads)
+
+        stats = database.pool_stats
+        print()
+        print(f"提升: {after / before:.1f}x" if before else "提升: N/A")
+        print(f"连接池: {pooled_engine.pool.status()}")
+        print(f"借出 {stats.checkouts} 次, 超时 {stats.timeouts} 次, "
+              f"平均等待 {stats.wait_total * 1000 / max(stats.checkouts, 1):.3f}ms, "
+              f"最大等待 {stats.wait_max * 1000:.3f}ms")
+        pooled_engine.dispose()
+    finally:
+        cleanup(args.db_uri)
+
+if __name__ == '__main__':
+    main()
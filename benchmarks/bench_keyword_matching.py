@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+关键词匹配基准测试套件 - 构建 / 归一化 / 匹配 / 数据库写入分阶段计时
+
+按关键词规模（默认 1k/10k/100k）生成合成语料（中英文混合、长短不一的消息，
+部分消息带有全角、空格等变形的关键词），分别测量:
+  build:     构建全局 KeywordMatcher（AC自动机 + 群组位图）
+  normalize: 单条消息归一化（text_normalizer.normalize_message）
+  match:     单条消息匹配（KeywordMatcher.find_all，含位置映射）
+  db_write:  批量写入 MatchedMessage（与 message_writer 相同的批量提交方式），
+             循环使用命中的消息写满 --db-batches 批，延迟按每批统计，吞吐为每秒写入行数
+
+也可以用 --corpus 指定录制的真实消息（每行一条），代替合成消息。
+输出吞吐、p50/p99 延迟，并可用 --output 保存为 JSON 以便比较不同版本。
+
+用法:
+    python benchmarks/bench_keyword_matching.py
+    python benchmarks/bench_keyword_matching.py --sizes 1000,10000 --messages 20000 --output before.json
+    python benchmarks/bench_keyword_matching.py --corpus messages.txt --db-uri sqlite:///bench.sqlite
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+from database import MatchedMessage, MatchedMessageKeyword
+from keyword_matcher import KeywordMatcher
+from message_writer import BATCH_SIZE
+from telegram_monitor import make_matched_message
+from text_normalizer import normalize_message
+
+BENCH_GROUP_NAME = '__benchmark__'
+
+# 常用汉字池（合成中文词和消息正文）
+CJK_POOL = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+    "十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严"
+)
+EN_WORDS = [
+    "price", "group", "market", "token", "wallet", "exchange", "support", "daily", "profit", "channel",
+    "admin", "airdrop", "listing", "pump", "signal", "trade", "free", "bonus", "account", "verify",
+]
+
+# ---------------------------------------------------------------- 语料生成
+
+def make_keywords(count, rng):
+    keywords = set()
+    while len(keywords) < count:
+        kind = rng.random()
+        if kind < 0.6:
+            keywords.add(''.join(rng.choices(CJK_POOL, k=rng.randint(2, 4))))
+        elif kind < 0.85:
+            keywords.add(rng.choice(EN_WORDS) + str(rng.randint(0, 99999)))
+        else:
+            keywords.add(''.join(rng.choices(CJK_POOL, k=2)) + ''.join(rng.choices(string.ascii_uppercase, k=3)))
+    return list(keywords)
+
+def assign_groups(keyword_count, group_count, overlap, rng):
+    """
+    overlap 比例的关键词被所有群组共享，其余关键词只属于一个群组
+    """
+    pairs = []
+    for keyword_id in range(keyword_count):
+        if rng.random() < overlap:
+            pairs.extend((group_id, keyword_id) for group_id in range(group_count))
+        else:
+            pairs.append((rng.randrange(group_count), keyword_id))
+    return pairs
+
+def obfuscate(keyword, rng):
+    # 模拟常见的绕过手法: 全角、插入空格/标点/零宽字符
+    choice = rng.random()
+    if choice < 0.25:
+        return ''.join(chr(ord(c) + 0xFEE0) if '!' <= c <= '~' else c for c in keyword)
+    if choice < 0.5:
+        return rng.choice([' ', '.', '\u200b', '*']).join(keyword)
+    return keyword
+
+def make_message(keywords, hit_ratio, rng):
+    length = rng.choice([rng.randint(5, 30), rng.randint(30, 200), rng.randint(200, 1000)])
+    parts = []
+    size = 0
+    while size < length:
+        if rng.random() < 0.7:
+            chunk = ''.join(rng.choices(CJK_POOL, k=rng.randint(3, 12)))
+        else:
+            chunk = ' '.join(rng.choices(EN_WORDS, k=rng.randint(1, 4)))
+        parts.append(chunk)
+        size += len(chunk)
+    if rng.random() < hit_ratio:
+        parts.insert(rng.randrange(len(parts) + 1), obfuscate(rng.choice(keywords), rng))
+    return '，'.join(parts)
+
+def load_corpus(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+# ---------------------------------------------------------------- 统计
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(latencies, items=None):
+    """
+    latencies: 每次操作的耗时（秒）; items: 处理的条目数（默认等于操作次数）
+    """
+    values = sorted(latencies)
+    total = sum(values)
+    items = len(values) if items is None else items
+    return {
+        'count': len(values),
+        'items': items,
+        'total_s': round(total, 6),
+        'throughput_per_s': round(items / total, 1) if total else 0.0,
+        'mean_us': round(total * 1e6 / len(values), 3) if values else 0.0,
+        'p50_us': round(percentile(values, 50) * 1e6, 3),
+        'p99_us': round(percentile(values, 99) * 1e6, 3),
+        'max_us': round(values[-1] * 1e6, 3) if values else 0.0,
+    }
+
+# ---------------------------------------------------------------- 各阶段
+
+def bench_build(keywords, pairs, repeat):
+    keyword_rows = list(enumerate(keywords))
+    latencies = []
+    matcher = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matcher = KeywordMatcher(keyword_rows, pairs)
+        latencies.append(time.perf_counter() - start)
+    return matcher, summarize(latencies)
+
+def bench_normalize(messages):
+    latencies = []
+    normalized = []
+    for message in messages:
+        start = time.perf_counter()
+        result = normalize_message(message)
+        latencies.append(time.perf_counter() - start)
+        normalized.append(result)
+    return normalized, summarize(latencies)
+
+def bench_match(matcher, normalized, group_count, rng):
+    latencies = []
+    matched = []
+    for item in normalized:
+        group_id = rng.randrange(group_count)
+        start = time.perf_counter()
+        matches = matcher.find_all(item, group_id)
+        latencies.append(time.perf_counter() - start)
+        if matches:
+            matched.append((item.original, matches))
+    return matched, summarize(latencies)
+
+def bench_db_write(db_uri, matched, batch_size, batch_count):
+    engine = create_engine(db_uri)
+    database.db.metadata.create_all(engine, tables=[MatchedMessage.__table__, MatchedMessageKeyword.__table__])
+    Session = sessionmaker(bind=engine)
+    latencies = []
+    try:
+        # 命中的消息通常只够写一两批: 循环复用，保证延迟分位数来自足够多的批次
+        for batch_index in range(batch_count):
+            offset = batch_index * batch_size
+            batch = [
+                make_matched_message(BENCH_GROUP_NAME, text, 'bench', matches)
+                for text, matches in (matched[(offset + i) % len(matched)] for i in range(batch_size))
+            ]
+            session = Session()
+            start = time.perf_counter()
+            try:
+                session.add_all(batch)
+                session.commit()
+            finally:
+                session.close()
+            latencies.append(time.perf_counter() - start)
+        result = summarize(latencies, items=batch_count * batch_size)
+        result['batch_size'] = batch_size
+        return result
+    finally:
+        session = Session()
+        try:
+            message_ids = session.query(MatchedMessage.id).filter_by(group_name=BENCH_GROUP_NAME)
+            session.query(MatchedMessageKeyword).filter(MatchedMessageKeyword.message_id.in_(message_ids)).delete(synchronize_session=False)
+            session.query(MatchedMessage).filter_by(group_name=BENCH_GROUP_NAME).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+            engine.dispose()
+
+# ---------------------------------------------------------------- 主流程
+
+def print_row(size, stage, result):
+    print(f"{size:>8} {stage:<10} {result['count']:>8} {result['throughput_per_s']:>14.1f} "
+          f"{result['mean_us']:>12.1f} {result['p50_us']:>12.1f} {result['p99_us']:>12.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000', help='关键词规模，逗号分隔')
+    parser.add_argument('--groups', type=int, default=50, help='群组数量')
+    parser.add_argument('--overlap', type=float, default=0.1, help='被所有群组共享的关键词比例')
+    parser.add_argument('--messages', type=int, default=10000, help='合成消息数量（使用 --corpus 时忽略）')
+    parser.add_argument('--hit-ratio', type=float, default=0.05, help='合成消息中包含关键词的比例')
+    parser.add_argument('--corpus', help='录制的消息文件（UTF-8，每行一条），代替合成消息')
+    parser.add_argument('--build-repeat', type=int, default=3, help='每个规模重复构建的次数')
+    parser.add_argument('--db-uri', default='sqlite://', help='数据库写入阶段使用的连接串，默认内存 SQLite；传 none 跳过')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='数据库写入批大小（默认与 message_writer 相同）')
+    parser.add_argument('--db-batches', type=int, default=50, help='数据库写入阶段计时的批数')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='把结果保存为 JSON 文件')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    corpus = load_corpus(args.corpus) if args.corpus else None
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': vars(args),
+        'results': [],
+    }
+
+    print(f"{'关键词数':>8} {'阶段':<10} {'次数':>8} {'吞吐(次/s)':>14} {'平均(us)':>12} {'p50(us)':>12} {'p99(us)':>12}")
+    for size in sizes:
+        rng = random.Random(args.seed)
+        keywords = make_keywords(size, rng)
+        pairs = assign_groups(size, args.groups, args.overlap, rng)
+        messages = corpus or [make_message(keywords, args.hit_ratio, rng) for _ in range(args.messages)]
+
+        matcher, build = bench_build(keywords, pairs, args.build_repeat)
+        normalized, normalize = bench_normalize(messages)
+        matched, match = bench_match(matcher, normalized, args.groups, rng)
+        stages = {'build': build, 'normalize': normalize, 'match': match}
+        if args.db_uri.lower() != 'none' and matched:
+            stages['db_write'] = bench_db_write(args.db_uri, matched, args.batch_size, args.db_batches)
+
+        for stage, result in stages.items():
+            print_row(size, stage, result)
+        report['results'].append({
+            'keywords': size,
+            'messages': len(messages),
+            'matched_messages': len(matched),
+            'avg_message_length': round(sum(len(m) for m in messages) / len(messages), 1),
+            'stages': stages,
+        })
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+if __name__ == '__main__':
+    main()
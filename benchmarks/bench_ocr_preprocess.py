@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OCR预处理基准测试 - 比较原图识别与预处理快速路径的耗时和召回
+
+对本地图片目录（如导出的群组图片）中的每张图片分别运行:
+  baseline: 原图直接交给 tesseract（预处理之前的行为）
+  fast:     ocr_worker.recognize_image 的快速路径（转灰度、缩小到 --max-side、
+            边缘密度低于 --min-edge-density 时判定为无文字并跳过）
+可用 --download-side 模拟只下载 Telegram 较小尺寸的图片（按该长边缩小并重新编码为JPEG）。
+
+召回以 baseline 的识别结果为准:
+  char_recall:    归一化后 fast 结果保留的字符比例（按字符计数取交集）
+  keyword_recall: 指定 --keywords 时，baseline 命中的关键词中 fast 仍然命中的比例
+  lost_images:    baseline 识别出文字（归一化后不少于 --min-chars 个字符）但被判定为无文字而跳过的图片
+
+用法:
+    python benchmarks/bench_ocr_preprocess.py images/
+    python benchmarks/bench_ocr_preprocess.py images/ --max-side 1280 --min-edge-density 0.001 --keywords keywords.txt
+    python benchmarks/bench_ocr_preprocess.py images/ --download-side 1280 --output after.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image
+
+from ocr_worker import OCR_LANG, OCR_MAX_SIDE, OCR_MIN_EDGE_DENSITY, recognize_image
+from text_normalizer import normalize_message
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif')
+
+# ---------------------------------------------------------------- 语料
+
+def load_images(directory, limit=None):
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+def load_keywords(path):
+    with open(path, encoding='utf-8') as f:
+        return [normalize_message(line.strip()).text for line in f if line.strip()]
+
+def shrink_for_download(photo_bytes, side):
+    """
+    模拟下载 Telegram 较小尺寸: 长边缩小到 side 并重新编码为JPEG
+    """
+    image = Image.open(io.BytesIO(photo_bytes)).convert('RGB')
+    if max(image.size) > side:
+        image.thumbnail((side, side), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=87)
+    return output.getvalue()
+
+# ---------------------------------------------------------------- 召回
+
+def normalized(text):
+    return ''.join((normalize_message(text or '').text).split())
+
+def char_overlap(baseline, fast):
+    base_counts = Counter(baseline)
+    fast_counts = Counter(fast)
+    return sum(min(count, fast_counts[char]) for char, count in base_counts.items())
+
+def keyword_hits(text, keywords):
+    return {keyword for keyword in keywords if keyword and keyword in text}
+
+# ---------------------------------------------------------------- 主流程
+
+def run_ocr(photo_bytes, **kwargs):
+    start = time.perf_counter()
+    try:
+        text, skipped = recognize_image(photo_bytes, **kwargs)
+    except RuntimeError as e:
+        print(f"  识别失败: {e}", file=sys.stderr)
+        text, skipped = '', False
+    return text, skipped, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus', help='图片目录（递归查找 jpg/png/webp 等）')
+    parser.add_argument('--max-side', type=int, default=OCR_MAX_SIDE, help='快速路径缩小后的长边像素，0 表示不缩放')
+    parser.add_argument('--min-edge-density', type=float, default=OCR_MIN_EDGE_DENSITY, help='文字检测阈值，0 表示不检测')
+    parser.add_argument('--download-side', type=int, default=0, help='模拟只下载长边为该值的图片尺寸，0 表示使用原图')
+    parser.add_argument('--keywords', help='关键词文件（UTF-8，每行一个），用于计算关键词召回')
+    parser.add_argument('--min-chars', type=int, default=4, help='识别结果至少这么多个字符才算"有文字"')
+    parser.add_argument('--lang', default=OCR_LANG)
+    parser.add_argument('--limit', type=int, help='最多测试的图片数')
+    parser.add_argument('--verbose', action='store_true', help='逐张输出结果')
+    parser.add_argument('--output', help='把结果保存为 JSON 文件')
+    args = parser.parse_args()
+
+    paths = load_images(args.corpus, args.limit)
+    if not paths:
+        parser.error(f"目录中没有图片: {args.corpus}")
+    keywords = load_keywords(args.keywords) if args.keywords else []
+
+    baseline_seconds = fast_seconds = 0.0
+    base_chars = kept_chars = 0
+    base_keywords = kept_keywords = 0
+    skipped_images = lost_images = text_images = 0
+    lost_paths = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            photo_bytes = f.read()
+        base_text, _, base_elapsed = run_ocr(photo_bytes, lang=args.lang, preprocess=False)
+        fast_input = shrink_for_download(photo_bytes, args.download_side) if args.download_side else photo_bytes
+        fast_text, skipped, fast_elapsed = run_ocr(
+            fast_input, lang=args.lang, max_side=args.max_side, min_edge_density=args.min_edge_density)
+        baseline_seconds += base_elapsed
+        fast_seconds += fast_elapsed
+
+        base_norm, fast_norm = normalized(base_text), normalized(fast_text)
+        base_chars += len(base_norm)
+        kept_chars += char_overlap(base_norm, fast_norm)
+        if keywords:
+            base_hits = keyword_hits(base_norm, keywords)
+            base_keywords += len(base_hits)
+            kept_keywords += len(base_hits & keyword_hits(fast_norm, keywords))
+        has_text = len(base_norm) >= args.min_chars
+        text_images += has_text
+        skipped_images += skipped
+        if skipped and has_text:
+            lost_images += 1
+            lost_paths.append(path)
+        if args.verbose:
+            print(f"{os.path.basename(path):<40} baseline {base_elapsed:7.3f}s {len(base_norm):>5}字  "
+                  f"fast {fast_elapsed:7.3f}s {len(fast_norm):>5}字{'  (跳过)' if skipped else ''}")
+
+    saved = baseline_seconds - fast_seconds
+    results = {
+        'images': len(paths),
+        'text_images': text_images,
+        'baseline_s': round(baseline_seconds, 3),
+        'fast_s': round(fast_seconds, 3),
+        'saved_s': round(saved, 3),
+        'saved_ratio': round(saved / baseline_seconds, 4) if baseline_seconds else 0.0,
+        'skipped_images': skipped_images,
+        'lost_images': lost_images,
+        'char_recall': round(kept_chars / base_chars, 4) if base_chars else 1.0,
+        'keyword_recall': round(kept_keywords / base_keywords, 4) if base_keywords else None,
+        'lost_paths': lost_paths,
+    }
+
+    print(f"\n图片 {results['images']} 张（baseline 识别出文字 {text_images} 张）")
+    print(f"OCR耗时: baseline {results['baseline_s']:.2f}s  fast {results['fast_s']:.2f}s  "
+          f"节省 {results['saved_s']:.2f}s ({results['saved_ratio']:.1%})")
+    print(f"判定无文字跳过 {skipped_images} 张，其中 baseline 有文字 {lost_images} 张")
+    print(f"字符召回 {results['char_recall']:.2%}" + (
+        f"  关键词召回 {results['keyword_recall']:.2%}" if results['keyword_recall'] is not None else ''))
+
+    if args.output:
+        report = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+if __name__ == '__main__':
+    main()
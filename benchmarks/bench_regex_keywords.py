@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+正则关键词基准测试 - AC自动机锚点预筛选 vs 逐条正则扫描
+
+对同一批正则/通配符关键词和消息，分别测量:
+  naive:  旧思路，每条消息依次执行全部正则
+  hybrid: 新实现，锚点进入AC自动机，只有锚点命中的正则才执行
+
+两种方式的命中结果会逐条比对，确保预筛选不漏匹配。
+
+用法:
+    python benchmarks/bench_regex_keywords.py --patterns 500 --messages 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from keyword_matcher import KeywordMatcher, compile_keyword_pattern
+from text_normalizer import normalize_message
+
+GROUP_ID = 1
+
+FILLER = [
+    "今天行情怎么样", "有人在吗", "明天见", "大家晚上好", "这个项目靠谱吗",
+    "hello everyone", "check the pinned message", "价格又涨了", "欢迎新朋友", "群规请看公告",
+]
+
+def make_patterns(count, rng):
+    # 混合几种常见写法: 字面量+数字、字面量+间隔字符、通配符
+    # 编号后加"号"，避免 "币种1" 成为 "币种12" 的前缀而产生重叠命中
+    patterns = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            patterns.append((f"币种{i}号\\s*\\d+", 'regex'))
+        elif kind == 1:
+            patterns.append((f"招.{{0,3}}代理{i}号", 'regex'))
+        else:
+            patterns.append((f"兼职{i}号*日结", 'wildcard'))
+    rng.shuffle(patterns)
+    return patterns
+
+def make_messages(count, pattern_count, hit_ratio, rng):
+    messages = []
+    for _ in range(count):
+        parts = rng.sample(FILLER, 3)
+        if rng.random() < hit_ratio:
+            i = rng.randrange(pattern_count)
+            kind = i % 3
+            if kind == 0:
+                parts.append(f"币种{i}号 {rng.randint(1, 9999)}")
+            elif kind == 1:
+                parts.append(f"招聘代理{i}号")
+            else:
+                parts.append(f"兼职{i}号今天日结")
+        rng.shuffle(parts)
+        messages.append("，".join(parts))
+    return messages
+
+def run_naive(regexes, normalized_messages):
+    # 与匹配器一致: 正则在原文上执行，通配符在归一化文本上执行
+    results = []
+    for item in normalized_messages:
+        results.append({
+            keyword_text for keyword_text, match_type, regex in regexes
+            if regex.search(item.original if match_type == 'regex' else item.text)
+        })
+    return results
+
+def run_hybrid(matcher, normalized_messages):
+    return [set(matcher.find_all(item, GROUP_ID)) for item in normalized_messages]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patterns', type=int, default=500, help='正则/通配符关键词数量')
+    parser.add_argument('--messages', type=int, default=20000, help='消息数量')
+    parser.add_argument('--hit-ratio', type=float, default=0.05, help='命中关键词的消息比例')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    patterns = make_patterns(args.patterns, rng)
+    messages = make_messages(args.messages, args.patterns, args.hit_ratio, rng)
+    normalized_messages = [normalize_message(message) for message in messages]
+
+    keywords = [(keyword_id, text) for keyword_id, (text, match_type) in enumerate(patterns)]
+    pattern_keywords = {keyword_id: (match_type, None) for keyword_id, (text, match_type) in enumerate(patterns)}
+    pairs = [(GROUP_ID, keyword_id) for keyword_id in range(len(patterns))]
+
+    start = time.perf_counter()
+    matcher = KeywordMatcher(keywords, pairs, (), pattern_keywords)
+    build_time = time.perf_counter() - start
+    regexes = [(text, match_type, compile_keyword_pattern(text, match_type)) for text, match_type in patterns]
+
+    print(f"关键词: {args.patterns}（无锚点 {len(matcher.unanchored_ids)} 个），消息: {args.messages}，命中比例: {args.hit_ratio}")
+    print(f"构建混合匹配器: {build_time * 1000:.1f}ms")
+
+    start = time.perf_counter()
+    naive_results = run_naive(regexes, normalized_messages)
+    naive_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hybrid_results = run_hybrid(matcher, normalized_messages)
+    hybrid_time = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(naive_results, hybrid_results) if a != b)
+    hits = sum(1 for result in hybrid_results if result)
+
+    print(f"{'方式':<8}{'耗时(s)':>10}{'吞吐(msg/s)':>16}{'单条(us)':>12}")
+    for name, elapsed in (('naive', naive_time), ('hybrid', hybrid_time)):
+        print(f"{name:<8}{elapsed:>10.3f}{args.messages / elapsed:>16.0f}{elapsed * 1e6 / args.messages:>12.1f}")
+    print(f"加速比: {naive_time / hybrid_time:.1f}x，命中消息: {hits}，结果不一致: {mismatches}")
+
+if __name__ == '__main__':
+    main()
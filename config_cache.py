@@ -0,0 +1,138 @@
+import threading
+
+from database import Config, get_session
+from log_manager import get_logger
+
+logger = get_logger('config')
+
+# 跨进程版本检查间隔（秒）: 后台线程轮询，其他进程（如 Web 后台）保存配置后，最多延迟这么久生效
+VERSION_CHECK_INTERVAL = 5.0
+
+# 快照中保存的配置字段
+CONFIG_FIELDS = (
+    'id',
+    'api_id',
+    'api_hash',
+    'phone_number',
+    'dingtalk_webhook',
+    'dingtalk_secret',
+    'notification_type',
+    'wecom_webhook',
+    'notification_digest_window',
+    'notification_digest_group_by',
+    'version',
+)
+
+
+class ConfigSnapshot:
+    """
+    Config 表的只读快照（与 ORM 对象脱离，可在任意线程中安全读取）
+    """
+    __slots__ = CONFIG_FIELDS
+
+    def __init__(self, config):
+        for field in CONFIG_FIELDS:
+            object.__setattr__(self, field, getattr(config, field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigSnapshot 为只读对象")
+
+
+class ConfigCache:
+    """
+    带版本号的配置缓存
+    性能优化: 消息处理热路径不再每次匹配都查询 Config 表，get() 只读内存；
+    本进程保存配置时立即重载，后台线程定期用一条极轻量的 SELECT version 发现其他进程的修改
+    """
+
+    def __init__(self, check_interval=VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.reloads = 0
+        self.version_checks = 0
+
+    def start(self):
+        """
+        启动后台版本轮询线程
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ConfigVersionPoller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join(timeout=timeout)
+        self._thread = None
+
+    def get(self):
+        """
+        返回当前配置快照（无配置时返回None），只在尚未加载过时查询数据库
+        """
+        if not self._loaded:
+            return self.reload()
+        return self._snapshot
+
+    def reload(self):
+        """
+        从数据库重新加载配置（保存配置后调用）
+        """
+        with self._lock:
+            session = get_session()
+            try:
+                config = session.query(Config).first()
+                snapshot = ConfigSnapshot(config) if config else None
+            finally:
+                session.close()
+            # 整体替换引用，读取方无需加锁
+            self._snapshot = snapshot
+            self._loaded = True
+            self.reloads += 1
+        return snapshot
+
+    def _version_changed(self):
+        self.version_checks += 1
+        session = get_session()
+        try:
+            row = session.query(Config.id, Config.version).first()
+        except Exception as e:
+            logger.warning(f"[配置缓存] 版本检查失败，继续使用缓存配置: {e}")
+            return False
+        finally:
+            session.close()
+
+        current = self._snapshot
+        if row is None:
+            return current is not None
+        return current is None or (row.id, row.version or 0) != (current.id, current.version or 0)
+
+    def _run(self):
+        while not self._stop_event.wait(self.check_interval):
+            if self._version_changed():
+                logger.info("[配置缓存] 检测到配置已变更，重新加载")
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.warning(f"[配置缓存] 重新加载配置失败，继续使用缓存配置: {e}")
+
+    def get_stats(self):
+        snapshot = self._snapshot
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'loaded': self._loaded,
+            'version': snapshot.version if snapshot else None,
+            'reloads': self.reloads,
+            'version_checks': self.version_checks,
+            'check_interval': self.check_interval,
+        }
+
+
+config_cache = ConfigCache()
@@ -1,10 +1,14 @@
 import os
 import json
 import uuid
+import time
+import threading
 from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 db_config = None
 config_path = os.path.join(os.path.dirname(__file__), 'mysql.json')
@@ -31,12 +35,87 @@ instance_path = os.path.join(basedir, 'instance')
 os.makedirs(instance_path, exist_ok=True)
 db_path = os.path.join(instance_path, 'monitoring.sqlite')
 
+# 连接池配置（可在 mysql.json 中用同名字段覆盖）
+POOL_OPTIONS = {
+    'pool_size': db_config.get('pool_size', 10),
+    'max_overflow': db_config.get('max_overflow', 20),
+    'pool_timeout': db_config.get('pool_timeout', 30),
+    'pool_recycle': db_config.get('pool_recycle', 3600),
+    'pool_pre_ping': db_config.get('pool_pre_ping', True),
+}
+
 db = SQLAlchemy()
 
+class PoolStats:
+    """
+    连接池借出统计（借出次数、等待时间、超时次数），用于调整连接池大小
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            if wait > self.wait_max:
+                self.wait_max = wait
+
+pool_stats = PoolStats()
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    记录每次从连接池获取连接所花费时间的 QueuePool
+    """
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - start)
+        return connection
+
+# 全局共享的数据库引擎：监控线程、OCR回调和Logo更新共用同一个连接池
+engine = create_engine(DB_URI, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
+SessionFactory = sessionmaker(bind=engine)
+
 def get_session():
-    engine = create_engine(DB_URI)
-    Session = sessionmaker(bind=engine)
-    return Session()
+    return SessionFactory()
+
+def get_pool_stats():
+    """
+    返回共享连接池的当前状态和累计借出统计
+    """
+    pool = engine.pool
+    with pool_stats._lock:
+        checkouts = pool_stats.checkouts
+        timeouts = pool_stats.timeouts
+        wait_total = pool_stats.wait_total
+        wait_max = pool_stats.wait_max
+    return {
+        'pool_size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'max_overflow': POOL_OPTIONS['max_overflow'],
+        'checkouts': checkouts,
+        'timeouts': timeouts,
+        'wait_total_ms': round(wait_total * 1000, 3),
+        'wait_avg_ms': round(wait_total * 1000 / checkouts, 3) if checkouts else 0.0,
+        'wait_max_ms': round(wait_max * 1000, 3),
+    }
 
 class Config(db.Model):
     __tablename__ = 'config'
@@ -48,6 +127,9 @@ class Config(db.Model):
     dingtalk_secret = db.Column(db.String(100), nullable=True)
     notification_type = db.Column(db.String(20), default='none')  # none/dingtalk/wecom
     wecom_webhook = db.Column(db.String(255), nullable=True)
+    notification_digest_window = db.Column(db.Integer, default=0)  # 通知汇总窗口（秒），0表示逐条立即发送
+    notification_digest_group_by = db.Column(db.String(20), default='keyword')  # keyword/group
+    version = db.Column(db.Integer, nullable=False, default=0)  # 每次保存配置自增，供其他进程判断配置是否变更
 
     __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
 
@@ -56,6 +138,28 @@ group_keyword_association = db.Table('group_keyword_association',
     db.Column('keyword_id', db.Integer, db.ForeignKey('keyword.id'), primary_key=True)
 )
 
+# 关键词集合版本号（单行表）: 关键词或群组关联变更时自增，
+# 监控进程定期轮询，发现变化即重建匹配器（支持 Web 多进程、脚本及直接SQL导入）
+class KeywordVersion(db.Model):
+    __tablename__ = 'keyword_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
+
+def bump_keyword_version(session):
+    """
+    关键词版本号加1（在调用方的事务中执行，随关键词修改一起提交）
+    """
+    updated = session.query(KeywordVersion).filter_by(id=1).update(
+        {KeywordVersion.version: KeywordVersion.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        session.add(KeywordVersion(id=1, version=1))
+
+def get_keyword_version(session):
+    return session.query(KeywordVersion.version).filter_by(id=1).scalar() or 0
+
 class MonitoredGroup(db.Model):
     __tablename__ = 'monitored_group'
     id = db.Column(db.Integer, primary_key=True)
@@ -70,6 +174,9 @@ class Keyword(db.Model):
     __tablename__ = 'keyword'
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.String(191), unique=True, nullable=False)
+    is_urgent = db.Column(db.Boolean, default=False, nullable=False)  # 紧急关键词: 立即通知，不参与汇总
+    match_type = db.Column(db.String(20), default='literal', nullable=False)  # literal/regex/wildcard
+    anchor = db.Column(db.String(191), nullable=True)  # 正则/通配符关键词的预筛选字面量（AC自动机命中后才执行正则）
     groups = db.relationship('MonitoredGroup', secondary=group_keyword_association, back_populates='keywords')
 
     __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
@@ -81,9 +188,35 @@ class MatchedMessage(db.Model):
     message_content = db.Column(db.Text, nullable=False)
     sender = db.Column(db.String(255), nullable=True)
     message_date = db.Column(db.DateTime, nullable=False)
-    matched_keyword = db.Column(db.String(100), nullable=False)
+    matched_keyword = db.Column(db.String(100), nullable=False)  # 首个命中的关键词
+    keyword_generation = db.Column(db.Integer, nullable=True)  # 命中时匹配器对应的关键词集合版本号
+    keywords = db.relationship('MatchedMessageKeyword', backref='message', lazy=True,
+                               cascade='all, delete-orphan', passive_deletes=True)
+
+    # 与 app.py 的查询方式对应的组合索引（已有的库由 migrations.py 创建）
+    __table_args__ = (
+        db.Index('ix_matched_message_date_group', 'message_date', 'group_name'),
+        db.Index('ix_matched_message_group_date', 'group_name', 'message_date'),
+        {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'},
+    )
+
+    @property
+    def all_keywords(self):
+        """该消息命中的全部关键词（旧数据没有关联记录时退回 matched_keyword）"""
+        return [k.keyword for k in self.keywords] or [self.matched_keyword]
+
+# 消息与命中关键词的关联表: 一条消息命中多个关键词时只存一行消息内容
+class MatchedMessageKeyword(db.Model):
+    __tablename__ = 'matched_message_keyword'
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('matched_message.id', ondelete='CASCADE'), nullable=False, index=True)
+    keyword = db.Column(db.String(191), nullable=False, index=True)
+    positions = db.Column(db.Text, nullable=True)  # JSON: [[开始, 结束], ...]
 
-    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
+    __table_args__ = (
+        db.Index('ix_matched_message_keyword_message_keyword', 'message_id', 'keyword'),
+        {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'},
+    )
 
 
 # 新增User模型，用于存储用户信息
@@ -107,7 +240,6 @@ class Session(db.Model):
 
     __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_unicode_ci'}
 
-<<<<<<< Updated upstream
 class ExportTask(db.Model):
     __tablename__ = 'export_task'
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -117,67 +249,3 @@ class ExportTask(db.Model):
     file_path = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     log = db.Column(db.Text, nullable=True)
-=======
->>>>>>> Stashed changes
-
-def auto_upgrade_database():
-    """
-    自动升级数据库结构
-    检查并添加缺失的字段，确保数据库结构与模型定义一致
-    """
-    import pymysql
-    
-    try:
-        # 连接数据库
-        connection = pymysql.connect(
-            host=db_config['host'],
-            port=db_config['port'],
-            user=db_config['user'],
-            password=db_config['password'],
-            database=db_config['database'],
-            charset='utf8mb4'
-        )
-        
-        print("[数据库] 开始检查数据库结构...")
-        
-        with connection.cursor() as cursor:
-            # 检查 notification_type 字段是否存在
-            cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'config' AND COLUMN_NAME = 'notification_type'", (db_config['database'],))
-            
-            notification_type_exists = cursor.fetchone()[0] > 0
-            
-            # 检查 wecom_webhook 字段是否存在
-            cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'config' AND COLUMN_NAME = 'wecom_webhook'", (db_config['database'],))
-            
-            wecom_webhook_exists = cursor.fetchone()[0] > 0
-            
-            # 添加 notification_type 字段
-            if not notification_type_exists:
-                print("[数据库] → 添加字段: notification_type")
-                cursor.execute("ALTER TABLE config ADD COLUMN notification_type VARCHAR(20) DEFAULT 'none' AFTER dingtalk_secret")
-                print("[数据库] ✓ 字段 notification_type 添加成功")
-            
-            # 添加 wecom_webhook 字段
-            if not wecom_webhook_exists:
-                print("[数据库] → 添加字段: wecom_webhook")
-                cursor.execute("ALTER TABLE config ADD COLUMN wecom_webhook VARCHAR(255) NULL AFTER notification_type")
-                print("[数据库] ✓ 字段 wecom_webhook 添加成功")
-            
-            # 提交更改
-            connection.commit()
-            
-            if not notification_type_exists or not wecom_webhook_exists:
-                print("[数据库] ✓ 数据库结构升级完成")
-            else:
-                print("[数据库] ✓ 数据库结构已是最新版本")
-            
-    except pymysql.Error as e:
-        print(f"[数据库] ✗ 升级失败: {e}")
-        print(f"[数据库] 提示: 请检查数据库权限或手动运行 upgrade_db.py")
-    
-    except Exception as e:
-        print(f"[数据库] ✗ 发生错误: {e}")
-    
-    finally:
-        if 'connection' in locals():
-            connection.close()
\ No newline at end of file
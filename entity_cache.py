@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+
+# 缓存配置
+CHAT_CACHE_SIZE = 5000  # 最多缓存的群组/频道数
+SENDER_CACHE_SIZE = 50000  # 最多缓存的发送人数
+ENTITY_TTL = 3600  # 秒，超时后重新获取，兜底覆盖未收到更新事件的改名
+
+# 缓存值可以是None（例如没有发送人），用哨兵对象表示未命中
+MISSING = object()
+
+
+class ChatInfo:
+    """
+    群组的轻量级缓存记录（只保留消息处理需要的字段）
+    """
+    __slots__ = ('id', 'title', 'username')
+
+    def __init__(self, id, title, username):
+        self.id = id
+        self.title = title
+        self.username = username
+
+
+def make_chat_info(chat):
+    return ChatInfo(chat.id, getattr(chat, 'title', None), getattr(chat, 'username', None))
+
+
+def format_sender_name(sender):
+    """
+    发送人显示名: 优先用户名，其次 "名 姓"；没有发送人时返回None
+    """
+    if not sender:
+        return None
+    sender_name = getattr(sender, 'username', None)
+    if not sender_name:
+        first_name = getattr(sender, 'first_name', '') or ''
+        last_name = getattr(sender, 'last_name', '') or ''
+        sender_name = f"{first_name} {last_name}".strip()
+    return sender_name
+
+
+class EntityCache:
+    """
+    按 peer ID 缓存已格式化的实体信息（LRU + TTL）
+    性能优化: 活跃群组中同一批群组/发送人反复出现，
+    命中缓存时跳过 get_chat()/get_sender() 及可能的 RPC 请求和名称拼接
+    """
+
+    def __init__(self, max_size, ttl=ENTITY_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {peer_id: (过期时间, 值)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, peer_id):
+        """
+        返回缓存值，未命中或已过期返回 MISSING
+        """
+        with self._lock:
+            entry = self._entries.get(peer_id)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[peer_id]
+                self.expired += 1
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(peer_id)
+            self.hits += 1
+            return value
+
+    def put(self, peer_id, value):
+        with self._lock:
+            self._entries[peer_id] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(peer_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, peer_id):
+        with self._lock:
+            if self._entries.pop(peer_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+chat_cache = EntityCache(CHAT_CACHE_SIZE)  # {chat_id: ChatInfo}
+sender_cache = EntityCache(SENDER_CACHE_SIZE)  # {sender_id: 发送人显示名}
+
+
+def get_entity_cache_stats():
+    return {
+        'chats': chat_cache.get_stats(),
+        'senders': sender_cache.get_stats(),
+    }
@@ -0,0 +1,470 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+import ahocorasick
+
+from database import Keyword, group_keyword_association, get_keyword_version, get_session, instance_path
+from log_manager import get_logger
+from text_normalizer import NORMALIZER_FINGERPRINT, normalize_text, punctuation_keyword_pattern, removes_punctuation
+
+logger = get_logger('matcher')
+
+# 关键词连续变更时的合并等待时间（秒），批量编辑只触发一次重建
+REBUILD_DEBOUNCE = 0.5
+# 关键词版本号轮询间隔（秒）: 其他进程或直接SQL修改关键词后最多延迟这么久生效
+VERSION_POLL_INTERVAL = 5.0
+# 预编译匹配器快照: 重启时直接加载，关键词集合哈希不一致时后台重建
+SNAPSHOT_PATH = os.path.join(instance_path, 'keyword_matcher.pkl')
+SNAPSHOT_FORMAT = 6  # KeywordMatcher 结构变化时加1，旧快照自动失效
+
+# 关键词类型: 普通文本 / 正则表达式 / 通配符（* 任意个字符，? 单个字符）
+MATCH_TYPES = ('literal', 'regex', 'wildcard')
+
+
+def compile_keyword_pattern(keyword_text, match_type):
+    """
+    编译正则/通配符关键词（忽略大小写）
+    通配符在归一化后的消息文本上执行；正则在消息原文上执行（归一化会删除空格和标点，
+    含有空格、标点的正则如 \\d+\\.\\d+、@\\w+ 在归一化文本上永远无法命中）
+    正则语法错误时抛出 re.error
+    """
+    if match_type == 'wildcard':
+        parts = []
+        for token in re.split(r'([*?])', keyword_text):
+            if token == '*':
+                parts.append('.*?')
+            elif token == '?':
+                parts.append('.')
+            elif token:
+                parts.append(re.escape(normalize_text(token)))
+        return re.compile(''.join(parts), re.IGNORECASE)
+    return re.compile(keyword_text, re.IGNORECASE)
+
+
+def _required_literal_runs(parsed, runs):
+    # 收集正则中必须出现的连续字面量（只进入分组和至少重复一次的子模式）
+    current = []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(chr(av))
+            continue
+        if op is sre_parse.AT:
+            # ^、$、\b 等不消耗字符，不打断连续字面量
+            continue
+        if current:
+            runs.append(''.join(current))
+            current = []
+        if op is sre_parse.SUBPATTERN:
+            _required_literal_runs(av[-1], runs)
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            _required_literal_runs(av[2], runs)
+    if current:
+        runs.append(''.join(current))
+
+
+def extract_anchor(keyword_text, match_type):
+    """
+    提取正则/通配符关键词的锚点: 每次命中都必然包含的最长字面量（已归一化）
+    没有可用锚点时返回空字符串（该关键词将对每条消息执行正则）
+    """
+    if match_type == 'wildcard':
+        runs = re.split(r'[*?]', keyword_text)
+    else:
+        runs = []
+        _required_literal_runs(sre_parse.parse(keyword_text), runs)
+    return max((normalize_text(run) for run in runs), key=len, default='')
+
+
+class KeywordMatcher:
+    """
+    全局关键词匹配器
+    性能优化: 所有群组共用一个AC自动机（内存 O(关键词数)），
+    每个群组只保存一个关键词位图（bitset），匹配时按位过滤命中结果
+    """
+
+    def __init__(self, keywords, group_keyword_pairs, urgent_keyword_ids=(), pattern_keywords=None):
+        """
+        Args:
+            keywords: (关键词ID, 关键词文本) 列表
+            group_keyword_pairs: (群组ID, 关键词ID) 列表
+            urgent_keyword_ids: 紧急关键词ID集合（命中时立即通知）
+            pattern_keywords: 正则/通配符关键词 {关键词ID: (类型, 锚点)}，锚点为空时自动提取
+        """
+        pattern_keywords = pattern_keywords or {}
+        self.generation = 0  # 构建时的关键词集合版本号，发布时由 KeywordMatcherStore 设置
+        self.keyword_hash = None  # 关键词集合哈希，用于校验快照
+        # 紧凑关键词编号: 0..n-1，对应 keyword_texts 的下标
+        self.keyword_texts = []
+        self.pattern_lengths = []  # 归一化后的模式长度（可能与原文不同）
+        compact_ids = {}
+        patterns = {}  # {归一化文本: [紧凑编号, ...]}，归一化后相同的关键词共用一个模式
+        # 正则/通配符关键词: 锚点放入AC自动机做预筛选，锚点命中后才执行完整正则
+        self.pattern_regexes = {}  # {紧凑编号: 预编译正则}
+        self.original_text_ids = set()  # 在消息原文上执行的正则（其余在归一化文本上执行）
+        self.unanchored_ids = []  # 没有锚点的正则关键词，对每条消息执行
+
+        for keyword_id, keyword_text in keywords:
+            compact_id = len(self.keyword_texts)
+            compact_ids[keyword_id] = compact_id
+            self.keyword_texts.append(keyword_text)
+            pattern_info = pattern_keywords.get(keyword_id)
+            if pattern_info:
+                match_type, anchor = pattern_info
+                try:
+                    self.pattern_regexes[compact_id] = compile_keyword_pattern(keyword_text, match_type)
+                    pattern = normalize_text(anchor) if anchor else extract_anchor(keyword_text, match_type)
+                except re.error as e:
+                    logger.warning(f"[性能优化] 跳过无效的正则关键词 '{keyword_text}': {e}")
+                    self.pattern_lengths.append(0)
+                    continue
+                if match_type == 'regex':
+                    self.original_text_ids.add(compact_id)
+                if not pattern:
+                    self.unanchored_ids.append(compact_id)
+            elif removes_punctuation(keyword_text):
+                # 含标点的普通关键词（如 C++、!!!）归一化后会变成 "c" 或空字符串，改为在原文上匹配（标点必须出现，
+                # 仍忽略大小写、全角、繁体及插入的空白），归一化后的剩余部分作为锚点
+                self.pattern_regexes[compact_id] = re.compile(punctuation_keyword_pattern(keyword_text), re.IGNORECASE)
+                self.original_text_ids.add(compact_id)
+                pattern = normalize_text(keyword_text)
+                if not pattern:
+                    self.unanchored_ids.append(compact_id)
+            else:
+                # 与消息使用同一套归一化规则（全角、零宽字符、空格标点、繁简、大小写）
+                pattern = normalize_text(keyword_text)
+            self.pattern_lengths.append(len(pattern))
+            if pattern:
+                patterns.setdefault(pattern, []).append(compact_id)
+
+        urgent_keyword_ids = set(urgent_keyword_ids)
+        self.urgent_keywords = {text for keyword_id, text in keywords if keyword_id in urgent_keyword_ids}
+
+        self.automaton = ahocorasick.Automaton()
+        for pattern, ids in patterns.items():
+            self.automaton.add_word(pattern, tuple(ids))
+        # 构建失败指针,完成自动机
+        self.automaton.make_automaton()
+
+        # 每个群组的关键词位图: 第 i 位为1表示该群组监控紧凑编号为 i 的关键词
+        self.group_masks = {}
+        for group_id, keyword_id in group_keyword_pairs:
+            compact_id = compact_ids.get(keyword_id)
+            if compact_id is not None:
+                self.group_masks[group_id] = self.group_masks.get(group_id, 0) | (1 << compact_id)
+
+    def group_keyword_count(self, group_id):
+        return self.group_masks.get(group_id, 0).bit_count()
+
+    def _iter_hits(self, normalized_text, group_id):
+        mask = self.group_masks.get(group_id, 0)
+        if not mask or self.automaton.kind != ahocorasick.AHOCORASICK:
+            return
+        for end_index, compact_ids in self.automaton.iter(normalized_text):
+            for compact_id in compact_ids:
+                if mask >> compact_id & 1:
+                    yield end_index, compact_id
+
+    def find_all(self, normalized, group_id):
+        """
+        一次扫描收集该群组命中的全部不同关键词（不重叠、最长优先）
+
+        Args:
+            normalized: text_normalizer.normalize_message() 的结果（NormalizedText）
+
+        Returns:
+            dict: {关键词文本: [(开始位置, 结束位置), ...]}，按首次出现顺序排列，
+                  位置基于消息原文（用于高亮），结束位置为开区间；未命中返回空字典
+        """
+        hits = []
+        candidates = set()  # 锚点命中、需要执行完整正则的关键词
+        for end_index, compact_id in self._iter_hits(normalized.text, group_id):
+            if compact_id in self.pattern_regexes:
+                candidates.add(compact_id)
+                continue
+            start, end = normalized.map_span(end_index - self.pattern_lengths[compact_id] + 1, end_index + 1)
+            hits.append((start, -end, self.keyword_texts[compact_id]))
+
+        if self.unanchored_ids:
+            mask = self.group_masks.get(group_id, 0)
+            candidates.update(compact_id for compact_id in self.unanchored_ids if mask >> compact_id & 1)
+        for compact_id in sorted(candidates):
+            keyword_text = self.keyword_texts[compact_id]
+            # 锚点只用于预筛选: 正则在原文上执行，位置直接是原文位置
+            on_original = compact_id in self.original_text_ids
+            target = normalized.original if on_original else normalized.text
+            for match in self.pattern_regexes[compact_id].finditer(target):
+                if match.end() > match.start():
+                    start, end = (match.span() if on_original
+                                  else normalized.map_span(match.start(), match.end()))
+                    hits.append((start, -end, keyword_text))
+
+        if not hits:
+            return {}
+
+        # 从左到右，同一起点取最长，跳过与已选结果重叠的命中
+        hits.sort()
+        matches = {}
+        last_end = 0
+        for start, neg_end, keyword_text in hits:
+            if start < last_end:
+                continue
+            last_end = -neg_end
+            matches.setdefault(keyword_text, []).append((start, last_end))
+        return matches
+
+    def is_urgent(self, matches):
+        """命中的关键词中是否包含紧急关键词"""
+        return any(keyword_text in self.urgent_keywords for keyword_text in matches)
+
+
+def load_keyword_rows(session):
+    """
+    读取构建匹配器所需的全部数据: (关键词行, 群组关联)
+    """
+    rows = session.query(
+        Keyword.id, Keyword.text, Keyword.is_urgent, Keyword.match_type, Keyword.anchor
+    ).order_by(Keyword.id).all()
+    pairs = session.query(
+        group_keyword_association.c.group_id,
+        group_keyword_association.c.keyword_id
+    ).order_by(
+        group_keyword_association.c.group_id,
+        group_keyword_association.c.keyword_id
+    ).all()
+    return rows, pairs
+
+
+def keyword_set_hash(rows, pairs):
+    """
+    关键词集合哈希: 关键词、紧急标记、类型、锚点、群组关联或归一化规则任一变化都会改变哈希值
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{NORMALIZER_FINGERPRINT}\x1d".encode('utf-8'))
+    for keyword_id, text, is_urgent, match_type, anchor in rows:
+        digest.update(f"{keyword_id}\x1f{text}\x1f{int(bool(is_urgent))}\x1f{match_type}\x1f{anchor or ''}\x1e".encode('utf-8'))
+    digest.update(b"\x1d")
+    for group_id, keyword_id in pairs:
+        digest.update(f"{group_id}\x1f{keyword_id}\x1e".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_keyword_matcher(session, rows=None, pairs=None):
+    """
+    从数据库读取全部关键词和群组关联，构建全局匹配器
+    """
+    if rows is None or pairs is None:
+        rows, pairs = load_keyword_rows(session)
+    keywords = [(row.id, row.text) for row in rows]
+    urgent_ids = [row.id for row in rows if row.is_urgent]
+    pattern_keywords = {
+        row.id: (row.match_type, row.anchor)
+        for row in rows if row.match_type and row.match_type != 'literal'
+    }
+    matcher = KeywordMatcher(keywords, pairs, urgent_ids, pattern_keywords)
+    matcher.keyword_hash = keyword_set_hash(rows, pairs)
+    return matcher
+
+
+def save_matcher_snapshot(matcher, path=SNAPSHOT_PATH):
+    """
+    把编译好的匹配器写入磁盘（先写临时文件再替换，避免留下半个文件）
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'format': SNAPSHOT_FORMAT, 'normalizer': NORMALIZER_FINGERPRINT, 'matcher': matcher}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_matcher_snapshot(path=SNAPSHOT_PATH):
+    """
+    加载磁盘上的匹配器快照，不存在、格式不符或按旧的归一化规则构建时返回None
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except Exception as e:
+        logger.warning(f"[性能优化] 读取AC自动机快照失败，将重新构建: {e}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+        return None
+    if snapshot.get('normalizer') != NORMALIZER_FINGERPRINT:
+        logger.info("[性能优化] 归一化规则已变化，忽略AC自动机快照")
+        return None
+    return snapshot.get('matcher')
+
+
+class KeywordMatcherStore:
+    """
+    全局匹配器的后台重建与发布
+    性能优化: 关键词变更只通知后台线程重建，构建完成后整体替换 matcher 引用（原子操作），
+    消息处理器读取 matcher 无需加锁，热路径上也不会构建自动机；
+    后台线程同时轮询数据库中的关键词版本号，发现其他进程的修改；
+    每次构建后保存快照，重启时先加载快照，再在后台按关键词集合哈希校验
+    """
+
+    def __init__(self, debounce=REBUILD_DEBOUNCE, poll_interval=VERSION_POLL_INTERVAL, snapshot_path=SNAPSHOT_PATH):
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.snapshot_path = snapshot_path
+        self.matcher = None  # 当前发布的 KeywordMatcher，读取方直接访问
+        self.generation = 0  # 当前匹配器对应的关键词集合版本号
+        self._rebuild_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._build_lock = threading.Lock()  # 只串行化构建过程，不影响读取
+        self._thread = None
+        self.builds = 0
+        self.reuses = 0  # 关键词集合哈希未变化、跳过编译的次数
+        self.failures = 0
+        self.snapshot_loaded = False
+        self.snapshot_load_time = 0.0
+        self.version_checks = 0
+        self.external_changes = 0  # 由版本号轮询发现的变更次数
+        self.last_build_time = 0.0
+        self.last_built_at = None
+
+    def start(self):
+        """
+        启动后台重建线程；尚无匹配器时先加载磁盘快照，没有快照才同步构建（启动阶段，而非消息处理时）
+        """
+        if self.matcher is None:
+            start = time.perf_counter()
+            matcher = load_matcher_snapshot(self.snapshot_path)
+            if matcher is not None:
+                self.snapshot_load_time = time.perf_counter() - start
+                self.snapshot_loaded = True
+                self.generation = matcher.generation
+                self.matcher = matcher
+                logger.info(f"[性能优化] 已从快照加载AC自动机: 共 {len(matcher.keyword_texts)} 个关键词，耗时 {self.snapshot_load_time * 1000:.1f}ms")
+                # 后台校验关键词集合哈希，不一致时重建
+                self._rebuild_event.set()
+            else:
+                self.rebuild()
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="MatcherBuilder", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        self._rebuild_event.set()
+        thread.join(timeout=timeout)
+        self._thread = None
+
+    def request_rebuild(self):
+        """
+        关键词或群组关联变更后调用，立即返回
+        """
+        self._rebuild_event.set()
+
+    def rebuild(self):
+        """
+        同步构建新匹配器并发布，构建失败时继续使用旧匹配器；
+        关键词集合哈希与当前匹配器一致时只更新版本号，不重新编译
+        """
+        with self._build_lock:
+            start = time.perf_counter()
+            session = get_session()
+            try:
+                # 先读版本号再读关键词: 构建期间发生的修改会使版本号再次变化，下次轮询时补上
+                version = get_keyword_version(session)
+                rows, pairs = load_keyword_rows(session)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"[性能优化] 读取关键词失败，继续使用旧版本AC自动机: {e}")
+                return None
+            finally:
+                session.close()
+
+            keyword_hash = keyword_set_hash(rows, pairs)
+            current = self.matcher
+            if current is not None and current.keyword_hash == keyword_hash:
+                current.generation = version
+                self.generation = version
+                self.reuses += 1
+                return current
+
+            try:
+                matcher = build_keyword_matcher(None, rows, pairs)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"[性能优化] 重建AC自动机失败，继续使用旧版本: {e}")
+                return None
+            elapsed = time.perf_counter() - start
+
+            self.generation = version
+            matcher.generation = version
+            self.matcher = matcher
+            self.builds += 1
+            self.last_build_time = elapsed
+            self.last_built_at = time.time()
+            logger.info(f"[性能优化] 全局AC自动机已发布: 关键词版本 {matcher.generation}，共 {len(matcher.keyword_texts)} 个关键词，耗时 {elapsed * 1000:.1f}ms")
+
+            try:
+                save_matcher_snapshot(matcher, self.snapshot_path)
+            except Exception as e:
+                logger.warning(f"[性能优化] 保存AC自动机快照失败: {e}")
+        return matcher
+
+    def _version_changed(self):
+        self.version_checks += 1
+        session = get_session()
+        try:
+            version = get_keyword_version(session)
+        except Exception as e:
+            logger.warning(f"[性能优化] 读取关键词版本号失败: {e}")
+            return False
+        finally:
+            session.close()
+        return version != self.generation
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            requested = self._rebuild_event.wait(timeout=self.poll_interval)
+            if self._stop_event.is_set():
+                break
+            if requested:
+                # 合并短时间内的多次变更
+                time.sleep(self.debounce)
+                self._rebuild_event.clear()
+                self.rebuild()
+            elif self._version_changed():
+                self.external_changes += 1
+                logger.info("[性能优化] 检测到关键词版本号变化（来自其他进程或直接修改数据库），重建AC自动机")
+                self.rebuild()
+
+    def get_stats(self):
+        matcher = self.matcher
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'generation': self.generation,
+            'keyword_count': len(matcher.keyword_texts) if matcher else 0,
+            'rebuild_pending': self._rebuild_event.is_set(),
+            'builds': self.builds,
+            'reuses': self.reuses,
+            'snapshot_loaded': self.snapshot_loaded,
+            'snapshot_load_ms': round(self.snapshot_load_time * 1000, 3),
+            'failures': self.failures,
+            'version_checks': self.version_checks,
+            'external_changes': self.external_changes,
+            'poll_interval': self.poll_interval,
+            'last_build_ms': round(self.last_build_time * 1000, 3),
+            'last_built_at': self.last_built_at,
+        }
+
+
+keyword_matcher_store = KeywordMatcherStore()
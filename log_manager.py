@@ -0,0 +1,188 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+# 日志: 各模块通过 get_logger(分类) 取得 telscan.<分类> 日志器
+# 性能优化: 日志记录只放入内存队列（QueueHandler），由 QueueListener 后台线程写 stdout，
+# 终端或日志管道变慢时不会阻塞 Telegram 事件循环
+
+# 日志分类及默认级别
+LOG_CATEGORIES = {
+    'monitor': logging.INFO,  # 客户端连接、启动停止
+    'message': logging.INFO,  # 逐条消息处理（调试信息为DEBUG级别）
+    'event_filter': logging.INFO,  # 群组事件过滤、用户名解析
+    'ocr': logging.INFO,  # 图片下载与OCR
+    'notify': logging.INFO,  # 钉钉/企业微信通知
+    'websocket': logging.INFO,  # 实时推送
+    'writer': logging.INFO,  # 匹配记录批量写入
+    'matcher': logging.INFO,  # 关键词匹配器构建/重建
+    'config': logging.INFO,  # 配置缓存
+    'database': logging.INFO,  # 数据库结构迁移
+    'metrics': logging.INFO,  # 监控指标
+    'telegram_utils': logging.INFO,  # 群组详情、头像更新等工具函数
+    'app': logging.INFO,  # Web服务
+}
+
+# 调试日志采样: 每 N 条只输出1条（1 表示全部输出）
+DEFAULT_SAMPLE_RATES = {
+    'message_received': 1,  # 收到消息
+    'message_unmatched': 100,  # 消息未命中关键词
+}
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
+LOGGER_PREFIX = 'telscan'
+
+
+def parse_level(level):
+    """
+    'DEBUG' / 'info' / 10 → 日志级别数值，无效时抛出 ValueError
+    """
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).strip().upper())
+    if not isinstance(value, int):
+        raise ValueError(f"无效的日志级别: {level}")
+    return value
+
+
+def parse_level_overrides(spec):
+    """
+    解析环境变量 TELSCAN_LOG_LEVELS，例如 "message=DEBUG,ocr=WARNING"
+    """
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        category, level = item.split('=', 1)
+        levels[category.strip()] = parse_level(level)
+    return levels
+
+
+class LogSampler:
+    """
+    按键计数的调试日志采样器: sample(key) 每 N 次调用返回一次 True
+    """
+
+    def __init__(self, rates=None):
+        self._rates = dict(DEFAULT_SAMPLE_RATES if rates is None else rates)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def sample(self, key):
+        rate = self._rates.get(key, 1)
+        if rate <= 1:
+            return True
+        with self._lock:
+            count = self._counts.get(key, 0) + 1
+            self._counts[key] = count
+        return count % rate == 1
+
+    def set_rate(self, key, rate):
+        rate = int(rate)
+        if rate < 1:
+            raise ValueError(f"采样间隔必须 >= 1: {rate}")
+        with self._lock:
+            self._rates[key] = rate
+            self._counts.pop(key, None)
+
+    def get_rates(self):
+        with self._lock:
+            return dict(self._rates)
+
+
+class LogManager:
+    """
+    管理 QueueListener 和各分类日志级别，可在运行时调整（无需重启）
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.sampler = LogSampler()
+        self._queue = queue.SimpleQueue()
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._listener is not None:
+                return
+            stream_handler = logging.StreamHandler(self.stream)
+            stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            root = logging.getLogger(LOGGER_PREFIX)
+            root.addHandler(logging.handlers.QueueHandler(self._queue))
+            root.setLevel(logging.DEBUG)  # 由各分类日志器控制级别
+            root.propagate = False
+            overrides = parse_level_overrides(os.environ.get('TELSCAN_LOG_LEVELS'))
+            for category, level in LOG_CATEGORIES.items():
+                logging.getLogger(f"{LOGGER_PREFIX}.{category}").setLevel(overrides.get(category, level))
+            self._listener = logging.handlers.QueueListener(self._queue, stream_handler)
+            self._listener.start()
+
+    def stop(self):
+        """
+        停止后台线程，并输出队列中剩余的日志
+        """
+        with self._lock:
+            if self._listener is None:
+                return
+            self._listener.stop()
+            self._listener = None
+
+    def get_logger(self, category):
+        return logging.getLogger(f"{LOGGER_PREFIX}.{category}")
+
+    def set_level(self, category, level):
+        if category not in LOG_CATEGORIES:
+            raise ValueError(f"未知的日志分类: {category}")
+        self.get_logger(category).setLevel(parse_level(level))
+
+    def get_config(self):
+        return {
+            'levels': {
+                category: logging.getLevelName(self.get_logger(category).level)
+                for category in LOG_CATEGORIES
+            },
+            'sample_rates': self.sampler.get_rates(),
+        }
+
+    def update_config(self, levels=None, sample_rates=None):
+        """
+        运行时修改日志级别/采样间隔；先全部校验，任何一项无效都不做修改
+        """
+        levels = {category: parse_level(level) for category, level in (levels or {}).items()}
+        for category in levels:
+            if category not in LOG_CATEGORIES:
+                raise ValueError(f"未知的日志分类: {category}")
+        sample_rates = {key: int(rate) for key, rate in (sample_rates or {}).items()}
+        for key, rate in sample_rates.items():
+            if rate < 1:
+                raise ValueError(f"采样间隔必须 >= 1: {key}={rate}")
+        for category, level in levels.items():
+            self.set_level(category, level)
+        for key, rate in sample_rates.items():
+            self.sampler.set_rate(key, rate)
+        return self.get_config()
+
+
+log_manager = LogManager()
+log_manager.start()
+
+# 进程退出时输出队列中剩余的日志
+atexit.register(log_manager.stop)
+
+
+def get_logger(category):
+    return log_manager.get_logger(category)
+
+
+def debug_sampled(logger, key, msg, *args):
+    """
+    采样输出调试日志: 日志器未开启DEBUG时直接返回（不计数、不格式化），
+    开启时按 key 的采样间隔每 N 条输出1条
+    """
+    if logger.isEnabledFor(logging.DEBUG) and log_manager.sampler.sample(key):
+        logger.debug(msg, *args)
@@ -0,0 +1,104 @@
+from sqlalchemy import distinct, func
+
+from database import MatchedMessage, MatchedMessageKeyword
+
+# app.py 各页面/接口对 matched_message 的查询
+# app.py 传入 db.session 执行；migrations.py --explain 编译同一个查询做 EXPLAIN，两边不会不一致
+
+MESSAGES_PER_PAGE = 100  # 消息日志每页条数
+
+
+def count_messages_query(session, start=None, end=None):
+    """
+    时间范围 [start, end) 内的消息数，不传则不限
+    """
+    query = session.query(func.count(MatchedMessage.id))
+    if start is not None:
+        query = query.filter(MatchedMessage.message_date >= start)
+    if end is not None:
+        query = query.filter(MatchedMessage.message_date < end)
+    return query
+
+
+def active_groups_query(session):
+    return session.query(func.count(distinct(MatchedMessage.group_name)))
+
+
+def hot_keywords_query(session, start_date, limit):
+    """
+    热词统计（基于关联表，一条消息命中的每个关键词都计数）
+    """
+    return session.query(
+        MatchedMessageKeyword.keyword,
+        func.count(MatchedMessageKeyword.id).label('count')
+    ).join(
+        MatchedMessage, MatchedMessageKeyword.message_id == MatchedMessage.id
+    ).filter(
+        MatchedMessage.message_date >= start_date
+    ).group_by(
+        MatchedMessageKeyword.keyword
+    ).order_by(
+        func.count(MatchedMessageKeyword.id).desc()
+    ).limit(limit)
+
+
+def group_activity_query(session, start_date, limit):
+    return session.query(
+        MatchedMessage.group_name,
+        func.count(MatchedMessage.id).label('count')
+    ).filter(
+        MatchedMessage.message_date >= start_date
+    ).group_by(
+        MatchedMessage.group_name
+    ).order_by(
+        func.count(MatchedMessage.id).desc()
+    ).limit(limit)
+
+
+def daily_trend_query(session, start_date):
+    return session.query(
+        func.date(MatchedMessage.message_date).label('date'),
+        func.count(MatchedMessage.id).label('count')
+    ).filter(
+        MatchedMessage.message_date >= start_date
+    ).group_by(
+        func.date(MatchedMessage.message_date)
+    )
+
+
+def monthly_trend_query(session, start_month):
+    return session.query(
+        func.date_format(MatchedMessage.message_date, '%Y-%m').label('month'),
+        func.count(MatchedMessage.id).label('count')
+    ).filter(
+        MatchedMessage.message_date >= start_month
+    ).group_by(
+        func.date_format(MatchedMessage.message_date, '%Y-%m')
+    )
+
+
+def messages_query(session, group_name=None, start_date=None, end_date=None, keyword=None):
+    """
+    消息日志/导出的筛选查询，按消息时间倒序；end_date 为包含的上限
+    """
+    query = session.query(MatchedMessage)
+    if group_name:
+        query = query.filter(MatchedMessage.group_name == group_name)
+    if start_date is not None:
+        query = query.filter(MatchedMessage.message_date >= start_date)
+    if end_date is not None:
+        query = query.filter(MatchedMessage.message_date <= end_date)
+    if keyword:
+        query = query.filter(MatchedMessage.message_content.ilike(f'%{keyword}%'))
+    return query.order_by(MatchedMessage.message_date.desc())
+
+
+def message_group_names_query(session):
+    return session.query(MatchedMessage.group_name).distinct().order_by(MatchedMessage.group_name)
+
+
+def message_keywords_query(session, message_ids):
+    """
+    与 selectinload(MatchedMessage.keywords) 为一页消息加载命中关键词时发出的查询相同
+    """
+    return session.query(MatchedMessageKeyword).filter(MatchedMessageKeyword.message_id.in_(message_ids))
@@ -0,0 +1,259 @@
+import atexit
+import queue
+import threading
+import time
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.exc import DisconnectionError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from database import get_session
+from log_manager import get_logger
+from metrics import registry
+
+logger = get_logger('writer')
+
+# 写入批次配置
+BATCH_SIZE = 200  # 每批最多写入的行数
+FLUSH_INTERVAL = 0.5  # 秒，队列中最早的一行最多等待多久就写入
+MAX_QUEUE_SIZE = 20000  # 队列上限
+ENQUEUE_TIMEOUT = 0.05  # 秒，队列满时入队方最多等待的时间，超时丢弃该行并计数（不阻塞事件循环）
+RETRY_BACKOFF_INITIAL = 1.0  # 秒，数据库暂时不可用时第一次重试的等待时间，之后每次翻倍
+RETRY_BACKOFF_MAX = 30.0  # 秒，重试等待时间上限
+
+# 连接类错误（数据库重启、断线、连接池超时）: 整批保留并退避重试；其余错误视为数据问题，逐行隔离后丢弃出错的行
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError)
+
+
+class MatchedMessageWriter:
+    """
+    MatchedMessage 写后缓冲（write-behind）批量写入器
+    性能优化: 消息处理器只负责入队，后台线程把多行合并到一个事务中提交，
+    避免在 Telethon 事件循环里每行一次 commit/fsync
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_queue_size=MAX_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._accepting = False  # 是否由后台线程接收新行
+        self._state_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+        self.queue_full_waits = 0
+        self.dropped = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+        self.last_flush_time = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="MessageWriter", daemon=True)
+        self._thread.start()
+        with self._state_lock:
+            self._accepting = True
+        logger.info("[批量写入] 后台写入线程已启动")
+
+    def stop(self, timeout=30):
+        """
+        停止后台线程，并把队列中剩余的行全部写入数据库
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        with self._state_lock:
+            # 之后入队的行改为同步写入，保证停止过程中不丢数据
+            self._accepting = False
+        self._stop_event.set()
+        thread.join(timeout=timeout)
+        self._thread = None
+        # 兜底: 线程退出后仍在队列中的行同步写入
+        leftover = self._drain(self.batch_size)
+        while leftover:
+            self._flush(leftover, retry=False)
+            leftover = self._drain(self.batch_size)
+        logger.info("[批量写入] 后台写入线程已停止，队列已清空")
+
+    def enqueue(self, message):
+        """
+        提交一条待写入的 MatchedMessage（未运行时直接同步写入）
+        在事件循环线程中调用: 队列满时最多等待 ENQUEUE_TIMEOUT，仍满则丢弃该行，不在锁内阻塞
+        """
+        queued = False
+        with self._state_lock:
+            accepting = self._accepting
+            if accepting:
+                try:
+                    self._queue.put_nowait(message)
+                    queued = True
+                except queue.Full:
+                    pass
+        if not accepting:
+            self._flush([message], retry=False)
+            return
+        if not queued:
+            with self._stats_lock:
+                self.queue_full_waits += 1
+            try:
+                self._queue.put(message, timeout=ENQUEUE_TIMEOUT)
+            except queue.Full:
+                with self._stats_lock:
+                    self.dropped += 1
+                    dropped = self.dropped
+                if dropped == 1 or dropped % 1000 == 0:
+                    logger.error(f"[批量写入] 写入队列已满（数据库过慢或不可用），已丢弃 {dropped} 条匹配记录")
+                return
+            with self._state_lock:
+                # 等待期间 stop() 可能已清空队列，刚放入的行由这里同步写入
+                leftover = [] if self._accepting else self._drain(self.batch_size)
+            if leftover:
+                self._flush(leftover, retry=False)
+        with self._stats_lock:
+            self.enqueued += 1
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _collect(self):
+        # 等待第一行，之后最多再等 flush_interval 或凑满 batch_size
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch, retry=True):
+        """
+        写入一批；数据库暂时不可用时整批退避重试（停止过程中最多再试一次），不因短暂故障丢数据
+        """
+        start = time.perf_counter()
+        written = 0
+        failed = 0
+        backoff = RETRY_BACKOFF_INITIAL
+        while batch:
+            try:
+                batch_written, batch_failed = self._write(batch)
+                written += batch_written
+                failed += batch_failed
+                break
+            except TRANSIENT_ERRORS as e:
+                # 逐行写入途中断线时，已提交的行不再重复写入
+                pending = [message for message in batch if not sa_inspect(message).has_identity]
+                written += len(batch) - len(pending)
+                batch = pending
+                if not retry:
+                    failed += len(batch)
+                    logger.error(f"[批量写入] 数据库不可用，丢弃 {len(batch)} 行: {e}")
+                    break
+                with self._stats_lock:
+                    self.retries += 1
+                logger.warning(f"[批量写入] 数据库暂时不可用，{backoff:.0f} 秒后重试 {len(batch)} 行: {e}")
+                if self._stop_event.wait(backoff):
+                    retry = False
+                backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.written += written
+            self.failed += failed
+            self.flushes += 1
+            self.flush_time_total += elapsed
+            self.last_flush_time = elapsed
+            if elapsed > self.flush_time_max:
+                self.flush_time_max = elapsed
+
+    def _write(self, batch):
+        """
+        在一个事务中提交整批，返回 (写入行数, 丢弃行数)
+        数据错误时逐行写入隔离出有问题的行；连接类错误原样抛出，由 _flush 重试
+        """
+        written = 0
+        failed = 0
+        session = get_session()
+        try:
+            try:
+                session.add_all(batch)
+                session.commit()
+                return len(batch), 0
+            except TRANSIENT_ERRORS:
+                session.rollback()
+                raise
+            except Exception as e:
+                session.rollback()
+                logger.warning(f"[批量写入] 批量提交 {len(batch)} 行失败，改为逐行写入: {e}")
+            for message in batch:
+                try:
+                    session.add(message)
+                    session.commit()
+                    written += 1
+                except TRANSIENT_ERRORS:
+                    session.rollback()
+                    raise
+                except Exception as row_error:
+                    session.rollback()
+                    failed += 1
+                    logger.error(f"[批量写入] 丢弃无法写入的消息（群组 '{message.group_name}'）: {row_error}")
+            return written, failed
+        finally:
+            session.close()
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {
+                'running': bool(self._thread and self._thread.is_alive()),
+                'queue_depth': self._queue.qsize(),
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'failed': self.failed,
+                'retries': self.retries,
+                'flushes': self.flushes,
+                'queue_full_waits': self.queue_full_waits,
+                'dropped': self.dropped,
+                'avg_batch_size': round(self.written / self.flushes, 1) if self.flushes else 0.0,
+                'flush_latency_last_ms': round(self.last_flush_time * 1000, 3),
+                'flush_latency_avg_ms': round(self.flush_time_total * 1000 / self.flushes, 3) if self.flushes else 0.0,
+                'flush_latency_max_ms': round(self.flush_time_max * 1000, 3),
+            }
+
+
+message_writer = MatchedMessageWriter()
+
+# 进程退出时确保缓冲中的行全部落库
+atexit.register(message_writer.stop)
+
+# 监控指标: 抓取时读取写入线程统计
+registry.callback(
+    'telscan_matched_message_writes_total', '匹配记录写入结果计数',
+    lambda: {(name,): message_writer.get_stats()[name] for name in ('written', 'failed', 'dropped')},
+    labelnames=('result',), type_name='counter')
+registry.callback(
+    'telscan_matched_message_queue_depth', '等待写入数据库的匹配记录数',
+    lambda: message_writer.get_stats()['queue_depth'])
@@ -0,0 +1,166 @@
+import threading
+from bisect import bisect_left
+
+from log_manager import get_logger
+
+logger = get_logger('metrics')
+
+# 轻量级进程内指标（计数器 / 直方图 / 回调指标），以 Prometheus 文本格式输出
+# 性能优化: 热路径上只做一次字典查找 + 二分查找 + 加法，单次记录约 1 微秒
+
+# 各处理阶段耗时的直方图分桶（秒）
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 消息发出到通知发送成功的延迟分桶（秒，含汇总窗口）
+LAG_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+
+def _escape(value, quote=False):
+    value = str(value).replace('\\', '\\\\').replace('\n', '\\n')
+    if quote:
+        value = value.replace('"', '\\"')
+    return value
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = [f'{name}="{_escape(value, True)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增计数器，可带标签"""
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {} if labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, labels), value) for labels, value in items]
+
+
+class Histogram:
+    """固定分桶直方图，可带标签"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children = {}  # {标签值: [各分桶计数..., +Inf计数, 总和]}
+        if not self.labelnames:
+            self._children[()] = [0] * (len(self.buckets) + 1) + [0.0]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(labelvalues)
+            if child is None:
+                child = self._children[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            child[index] += 1
+            child[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(child)) for labels, child in self._children.items()]
+        samples = []
+        for labels, child in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                samples.append((f"{self.name}_bucket", _format_labels(self.labelnames, labels, le), cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.labelnames, labels), child[-1]))
+            samples.append((f"{self.name}_count", _format_labels(self.labelnames, labels), cumulative))
+        return samples
+
+
+class CallbackMetric:
+    """
+    抓取时才读取数值的指标（用于各模块已有的统计，热路径零开销）
+    callback 返回数值，或 {标签值元组: 数值}
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), type_name='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.type_name = type_name
+
+    def samples(self):
+        result = self.callback()
+        if isinstance(result, dict):
+            return [(self.name, _format_labels(self.labelnames, labels), value) for labels, value in result.items()]
+        return [(self.name, '', result)]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # 模块重复导入时返回已注册的同名指标
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, callback, labelnames=(), type_name='gauge'):
+        return self._register(CallbackMetric(name, documentation, callback, labelnames, type_name))
+
+    def render(self):
+        """
+        生成 Prometheus 文本格式（text/plain; version=0.0.4）
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.warning(f"[监控指标] 读取指标 {metric.name} 失败: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+# 消息处理流水线的公共指标
+messages_seen = registry.counter('telscan_messages_seen_total', '进入消息处理器的消息数（已通过群组过滤）')
+messages_matched = registry.counter('telscan_messages_matched_total', '命中关键词的消息数', ('source',))
+stage_seconds = registry.histogram('telscan_stage_duration_seconds', '消息处理各阶段耗时（秒）', ('stage',))
+alert_lag_seconds = registry.histogram('telscan_alert_lag_seconds', '消息发出到通知发送成功的延迟（秒，含汇总窗口）', buckets=LAG_BUCKETS)
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库结构迁移
+
+每个迁移有唯一递增的版本号，执行后记录到 schema_migrations 表，启动时只执行尚未执行的迁移。
+迁移内部先检查字段/索引/触发器是否已存在再修改: 旧版本（自动检查字段的方式）升级过的数据库
+没有迁移记录，首次运行时这些迁移会被直接记为已执行。
+
+用法:
+    python migrations.py            执行尚未执行的迁移并显示迁移记录
+    python migrations.py --status   只显示迁移记录
+    python migrations.py --explain  检查各页面/接口的查询是否使用索引（EXPLAIN），有全表扫描时返回非0
+"""
+
+import argparse
+import sys
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pymysql
+import pymysql.cursors
+from dateutil.relativedelta import relativedelta
+from sqlalchemy.dialects.mysql import pymysql as mysql_pymysql
+from sqlalchemy.orm import Session as OrmSession
+
+import message_queries
+from database import db_config
+from log_manager import get_logger
+
+logger = get_logger('database')
+
+MIGRATIONS_TABLE = 'schema_migrations'
+MIGRATION_LOCK_NAME = 'telscan_schema_migrations'  # 多个进程同时启动时用 MySQL 命名锁串行执行迁移
+MIGRATION_LOCK_TIMEOUT = 60  # 秒
+
+Migration = namedtuple('Migration', ['version', 'name', 'apply'])
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """
+    注册迁移: apply(cursor) 必须可重复执行（先检查再修改）
+    """
+    def register(apply):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"迁移版本号重复: {version}")
+        MIGRATIONS.append(Migration(version, name, apply))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return apply
+    return register
+
+
+def connect(**kwargs):
+    return pymysql.connect(
+        host=db_config['host'],
+        port=db_config['port'],
+        user=db_config['user'],
+        password=db_config['password'],
+        database=db_config['database'],
+        charset='utf8mb4',
+        **kwargs
+    )
+
+# ---------------------------------------------------------------- 结构检查/修改
+
+def column_exists(cursor, table_name, column_name):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table_name, column_name))
+    return cursor.fetchone()[0] > 0
+
+
+def index_exists(cursor, table_name, index_name):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+        (table_name, index_name))
+    return cursor.fetchone()[0] > 0
+
+
+def trigger_exists(cursor, trigger_name):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = %s",
+        (trigger_name,))
+    return cursor.fetchone()[0] > 0
+
+
+def add_column(cursor, table_name, column_name, column_definition):
+    if column_exists(cursor, table_name, column_name):
+        return
+    logger.info(f"[数据库] → 添加字段: {table_name}.{column_name}")
+    cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
+
+
+def create_index(cursor, table_name, index_name, columns):
+    if index_exists(cursor, table_name, index_name):
+        return
+    logger.info(f"[数据库] → 创建索引: {table_name}.{index_name} ({', '.join(columns)})，数据量大时需要一些时间")
+    cursor.execute(f"CREATE INDEX {index_name} ON {table_name} ({', '.join(columns)})")
+
+# ---------------------------------------------------------------- 迁移
+
+@migration(1, 'config_wecom_notification')
+def add_wecom_notification(cursor):
+    add_column(cursor, 'config', 'notification_type', "VARCHAR(20) DEFAULT 'none' AFTER dingtalk_secret")
+    add_column(cursor, 'config', 'wecom_webhook', "VARCHAR(255) NULL AFTER notification_type")
+
+
+@migration(2, 'config_notification_digest')
+def add_notification_digest(cursor):
+    add_column(cursor, 'config', 'notification_digest_window', "INT DEFAULT 0")
+    add_column(cursor, 'config', 'notification_digest_group_by', "VARCHAR(20) DEFAULT 'keyword'")
+
+
+@migration(3, 'config_version')
+def add_config_version(cursor):
+    add_column(cursor, 'config', 'version', "INT NOT NULL DEFAULT 0")
+
+
+@migration(4, 'keyword_match_options')
+def add_keyword_match_options(cursor):
+    add_column(cursor, 'keyword', 'is_urgent', "BOOLEAN NOT NULL DEFAULT FALSE")
+    add_column(cursor, 'keyword', 'match_type', "VARCHAR(20) NOT NULL DEFAULT 'literal'")
+    add_column(cursor, 'keyword', 'anchor', "VARCHAR(191) NULL")
+
+
+@migration(5, 'matched_message_keyword_generation')
+def add_keyword_generation(cursor):
+    add_column(cursor, 'matched_message', 'keyword_generation', "INT NULL")
+
+
+@migration(6, 'keyword_version_triggers')
+def add_keyword_version_triggers(cursor):
+    # 关键词版本号: 保证存在唯一一行，并用触发器覆盖绕过 Web 后台的修改（脚本、直接SQL导入）
+    cursor.execute("INSERT IGNORE INTO keyword_version (id, version) VALUES (1, 0)")
+    failed = 0
+    for trigger_name, table_name, trigger_event in [
+        ('keyword_version_after_keyword_insert', 'keyword', 'INSERT'),
+        ('keyword_version_after_keyword_update', 'keyword', 'UPDATE'),
+        ('keyword_version_after_keyword_delete', 'keyword', 'DELETE'),
+        ('keyword_version_after_association_insert', 'group_keyword_association', 'INSERT'),
+        ('keyword_version_after_association_update', 'group_keyword_association', 'UPDATE'),
+        ('keyword_version_after_association_delete', 'group_keyword_association', 'DELETE'),
+    ]:
+        if trigger_exists(cursor, trigger_name):
+            continue
+        try:
+            cursor.execute(
+                f"CREATE TRIGGER {trigger_name} AFTER {trigger_event} ON {table_name} "
+                f"FOR EACH ROW UPDATE keyword_version SET version = version + 1 WHERE id = 1"
+            )
+            logger.info(f"[数据库] ✓ 触发器 {trigger_name} 创建成功")
+        except pymysql.Error as e:
+            # 无 TRIGGER 权限时仍可工作，只是直接SQL修改关键词不会被监控进程发现
+            logger.warning(f"[数据库] ! 触发器 {trigger_name} 创建失败（直接修改数据库的关键词将不会自动生效）: {e}")
+            failed += 1
+    if failed:
+        logger.warning(f"[数据库] ! 授予 TRIGGER 权限后，删除 {MIGRATIONS_TABLE} 中 version=6 的记录并运行 python migrations.py 即可补建触发器")
+
+
+@migration(7, 'matched_message_keyword_backfill')
+def backfill_message_keywords(cursor):
+    # 为旧消息回填关键词关联记录（关联表为空时）
+    cursor.execute("SELECT 1 FROM matched_message_keyword LIMIT 1")
+    if cursor.fetchone() is None:
+        backfilled = cursor.execute(
+            "INSERT INTO matched_message_keyword (message_id, keyword) "
+            "SELECT id, matched_keyword FROM matched_message"
+        )
+        if backfilled:
+            logger.info(f"[数据库] ✓ 已为 {backfilled} 条历史消息回填关键词关联")
+
+
+@migration(8, 'matched_message_indexes')
+def add_matched_message_indexes(cursor):
+    # 与 database.py 中模型声明的索引一致（新建的库由 create_all 直接创建）
+    # (message_date, group_name): 仪表盘按时间范围计数/按日期和群组分组，索引覆盖查询不回表
+    create_index(cursor, 'matched_message', 'ix_matched_message_date_group', ('message_date', 'group_name'))
+    # (group_name, message_date): 消息列表/导出按群组筛选并按时间倒序、群组下拉列表 DISTINCT group_name
+    create_index(cursor, 'matched_message', 'ix_matched_message_group_date', ('group_name', 'message_date'))
+    # (message_id, keyword): 热词统计按时间范围关联消息后按关键词分组，索引覆盖查询不回表
+    create_index(cursor, 'matched_message_keyword', 'ix_matched_message_keyword_message_keyword', ('message_id', 'keyword'))
+
+# ---------------------------------------------------------------- 执行
+
+def ensure_migrations_table(cursor):
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ("
+        "version INT NOT NULL PRIMARY KEY, "
+        "name VARCHAR(191) NOT NULL, "
+        "applied_at DATETIME NOT NULL"
+        ") DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci"
+    )
+
+
+def get_applied_migrations(cursor):
+    """
+    返回 {版本号: (名称, 执行时间)}
+    """
+    cursor.execute(f"SELECT version, name, applied_at FROM {MIGRATIONS_TABLE} ORDER BY version")
+    return {version: (name, applied_at) for version, name, applied_at in cursor.fetchall()}
+
+
+def apply_migrations(connection):
+    """
+    依次执行尚未执行的迁移，每个迁移执行成功后立即记录版本号
+    某个迁移失败时停止（后续迁移可能依赖它），下次启动从失败的迁移继续
+
+    Returns:
+        bool: 是否全部执行成功
+    """
+    with connection.cursor() as cursor:
+        ensure_migrations_table(cursor)
+        applied = get_applied_migrations(cursor)
+        pending = [m for m in MIGRATIONS if m.version not in applied]
+        if not pending:
+            logger.info(f"[数据库] ✓ 数据库结构已是最新版本（第 {MIGRATIONS[-1].version} 版）")
+            return True
+        for m in pending:
+            logger.info(f"[数据库] → 执行迁移 {m.version}: {m.name}")
+            try:
+                m.apply(cursor)
+                cursor.execute(
+                    f"INSERT INTO {MIGRATIONS_TABLE} (version, name, applied_at) VALUES (%s, %s, %s)",
+                    (m.version, m.name, datetime.now()))
+                connection.commit()
+            except pymysql.Error as e:
+                connection.rollback()
+                logger.error(f"[数据库] ✗ 迁移 {m.version}（{m.name}）失败: {e}")
+                return False
+        logger.info(f"[数据库] ✓ 数据库结构升级完成（第 {MIGRATIONS[-1].version} 版）")
+        return True
+
+
+def run_migrations():
+    """
+    启动时调用（在 db.create_all() 之后）: 执行尚未执行的迁移
+    已是最新版本时只查询一次迁移记录表
+
+    Returns:
+        bool: 是否全部执行成功（失败时记录日志，不抛出异常，程序仍可启动）
+    """
+    connection = None
+    try:
+        connection = connect()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK_NAME, MIGRATION_LOCK_TIMEOUT))
+            if cursor.fetchone()[0] != 1:
+                logger.warning(f"[数据库] 等待迁移锁超过 {MIGRATION_LOCK_TIMEOUT} 秒（其他进程正在迁移），跳过本次检查")
+                return False
+        try:
+            return apply_migrations(connection)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+    except pymysql.Error as e:
+        logger.error(f"[数据库] ✗ 升级失败: {e}")
+        logger.error("[数据库] 提示: 请检查数据库权限或手动运行 python migrations.py")
+        return False
+    finally:
+        if connection is not None:
+            connection.close()
+
+# ---------------------------------------------------------------- 查询计划检查
+
+def compile_query(query):
+    """
+    把 SQLAlchemy 查询按 MySQL(PyMySQL) 方言编译为 (SQL, 参数)，IN 列表展开为逐个参数
+    """
+    compiled = query.statement.compile(dialect=mysql_pymysql.dialect(), compile_kwargs={'render_postcompile': True})
+    return str(compiled), tuple(compiled.params[name] for name in compiled.positiontup)
+
+
+def route_queries(now=None):
+    """
+    app.py 中各页面/接口对 matched_message 的查询，由 message_queries 中与 app.py 共用的查询编译而来，用于 EXPLAIN 检查
+    返回: [(页面/接口, 说明, SQL, 参数)]
+    """
+    now = now or datetime.now()
+    today_start = datetime.combine(now.date(), datetime.min.time())
+    week_start = today_start - timedelta(days=now.weekday())
+    month_start = datetime(now.year, now.month, 1)
+    session = OrmSession()  # 只用于构造查询，不连接数据库
+    queries = [
+        ('/api/dashboard/stats', '时间范围计数',
+         message_queries.count_messages_query(session, week_start - timedelta(days=7), week_start)),
+        ('/api/dashboard/stats', '总数', message_queries.count_messages_query(session)),
+        ('/api/dashboard/stats', '活跃群组数', message_queries.active_groups_query(session)),
+        ('/api/dashboard/hot_keywords', '热词统计', message_queries.hot_keywords_query(session, week_start, 50)),
+        ('/api/dashboard/group_activity', '群组活跃度', message_queries.group_activity_query(session, week_start, 10)),
+        ('/api/dashboard/trends', '按天统计', message_queries.daily_trend_query(session, today_start - timedelta(days=29))),
+        ('/api/dashboard/trends', '按月统计',
+         message_queries.monthly_trend_query(session, month_start - relativedelta(months=11))),
+        ('/messages', '消息列表',
+         message_queries.messages_query(session).limit(message_queries.MESSAGES_PER_PAGE)),
+        ('/messages', '按群组、日期和内容筛选',
+         message_queries.messages_query(session, '示例群组', today_start - timedelta(days=7), now, '关键词')
+         .limit(message_queries.MESSAGES_PER_PAGE)),
+        ('/messages', '群组下拉列表', message_queries.message_group_names_query(session)),
+        ('/messages', '加载命中关键词', message_queries.message_keywords_query(session, [1, 2, 3])),
+        ('/messages/export', '按日期导出',
+         message_queries.messages_query(session, start_date=today_start - timedelta(days=7), end_date=now)),
+    ]
+    return [(route, description, *compile_query(query)) for route, description, query in queries]
+
+
+def explain_query(cursor, sql, params=()):
+    """
+    返回 EXPLAIN 结果中 matched_message 相关表的访问方式，及是否全部使用了索引
+    """
+    cursor.execute("EXPLAIN " + sql, params)
+    plan = []
+    uses_index = True
+    for row in cursor.fetchall():
+        table = row.get('table')
+        if table not in ('matched_message', 'matched_message_keyword'):
+            continue  # 派生表、Select tables optimized away 等
+        plan.append({'table': table, 'type': row.get('type'), 'key': row.get('key'), 'rows': row.get('rows'), 'extra': row.get('Extra')})
+        if row.get('type') == 'ALL' or not row.get('key'):
+            uses_index = False
+    return plan, uses_index
+
+
+def check_query_plans():
+    """
+    对各页面/接口的查询执行 EXPLAIN
+    注意: 表中数据很少时优化器可能选择全表扫描，应在有真实数据量的库上检查
+
+    Returns:
+        list: [{'route', 'description', 'uses_index', 'plan'}]
+    """
+    connection = connect(cursorclass=pymysql.cursors.DictCursor)
+    try:
+        with connection.cursor() as cursor:
+            results = []
+            for route, description, sql, params in route_queries():
+                plan, uses_index = explain_query(cursor, sql, params)
+                results.append({'route': route, 'description': description, 'uses_index': uses_index, 'plan': plan})
+            return results
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--status', action='store_true', help='只显示迁移记录，不执行迁移')
+    parser.add_argument('--explain', action='store_true', help='检查各页面/接口的查询是否使用索引')
+    args = parser.parse_args()
+
+    if args.explain:
+        results = check_query_plans()
+        for result in results:
+            mark = '✓' if result['uses_index'] else '✗'
+            plan = '; '.join(f"{p['table']}: {p['type']} {p['key'] or '-'} ({p['rows']} 行)" for p in result['plan'])
+            print(f"{mark} {result['route']:<32} {result['description']:<12} {plan}")
+        return 0 if all(result['uses_index'] for result in results) else 1
+
+    ok = True if args.status else run_migrations()
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            ensure_migrations_table(cursor)
+            applied = get_applied_migrations(cursor)
+    finally:
+        connection.close()
+    for m in MIGRATIONS:
+        name, applied_at = applied.get(m.version, (m.name, None))
+        status = applied_at.strftime('%Y-%m-%d %H:%M:%S') if applied_at else '未执行'
+        print(f"{m.version:>4}  {m.name:<40} {status}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,500 @@
+import base64
+import hashlib
+import hmac
+import threading
+import time
+import urllib.parse
+from collections import Counter, deque
+from urllib.parse import urlparse
+
+import requests
+
+from log_manager import get_logger
+from metrics import alert_lag_seconds, registry
+
+logger = get_logger('notify')
+
+# 机器人官方域名白名单
+WEBHOOK_DOMAINS = {
+    'dingtalk': ['oapi.dingtalk.com'],
+    'wecom': ['qyapi.weixin.qq.com'],
+}
+
+# 钉钉/企业微信群机器人限制: 每个机器人每分钟最多发送20条消息
+RATE_LIMIT_COUNT = 20
+RATE_LIMIT_PERIOD = 60  # 秒
+
+# 发送队列和重试配置
+MAX_QUEUE_SIZE = 1000
+WORKER_COUNT = 2
+MAX_RETRIES = 3
+RETRY_BACKOFF = 2.0  # 秒，第n次重试前等待 RETRY_BACKOFF * 2^(n-1)
+REQUEST_TIMEOUT = 5  # 秒
+
+# 队列溢出策略: drop_oldest 丢弃最早的待发通知, drop_newest 丢弃新提交的通知
+OVERFLOW_POLICY = 'drop_oldest'
+
+# 汇总通知: 展示的消息摘录条数和每条摘录的最大长度
+DIGEST_TOP_N = 5
+DIGEST_EXCERPT_LENGTH = 80
+
+# 可重试的业务错误码: 钉钉 130101 发送太快, 企业微信 45009 接口调用超过限制
+RETRYABLE_ERRCODES = {130101, 45009}
+
+
+def is_allowed_webhook(channel, url):
+    try:
+        parsed_url = urlparse(url)
+        if parsed_url.scheme not in ['http', 'https']:
+            return False
+        return parsed_url.netloc in WEBHOOK_DOMAINS.get(channel, [])
+    except Exception:
+        return False
+
+
+def sign_dingtalk_url(webhook_url, secret):
+    """
+    钉钉加签: 在webhook地址后追加 timestamp 和 sign 参数（每次发送都需重新计算）
+    """
+    if not secret:
+        return webhook_url
+    timestamp = str(round(time.time() * 1000))
+    secret_enc = secret.encode('utf-8')
+    string_to_sign = '{}\n{}'.format(timestamp, secret)
+    string_to_sign_enc = string_to_sign.encode('utf-8')
+    hmac_code = hmac.new(secret_enc, string_to_sign_enc, digestmod=hashlib.sha256).digest()
+    sign = urllib.parse.quote_plus(base64.b64encode(hmac_code))
+    return f"{webhook_url}&timestamp={timestamp}&sign={sign}"
+
+
+def build_payload(channel, title, message):
+    if channel == 'dingtalk':
+        return {
+            "msgtype": "markdown",
+            "markdown": {
+                "title": title,
+                "text": message
+            }
+        }
+    return {
+        "msgtype": "markdown",
+        "markdown": {
+            "content": f"### {title}\n{message}"
+        }
+    }
+
+
+class RateLimiter:
+    """
+    滑动窗口限流器: period 秒内最多放行 count 次
+    """
+
+    def __init__(self, count=RATE_LIMIT_COUNT, period=RATE_LIMIT_PERIOD):
+        self.count = count
+        self.period = period
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop_event=None):
+        """
+        阻塞直到可以发送，返回等待的秒数
+        等待期间 stop_event 被设置时返回 None（不占用名额，调用方放弃发送），停止后也不会绕过限流
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= self.period:
+                    self._sent.popleft()
+                if len(self._sent) < self.count:
+                    self._sent.append(now)
+                    return waited
+                delay = self.period - (now - self._sent[0])
+            if stop_event is not None:
+                if stop_event.wait(delay):
+                    return None
+            else:
+                time.sleep(delay)
+            waited += delay
+
+
+class NotificationJob:
+    __slots__ = ('channel', 'webhook_url', 'secret', 'title', 'message', 'created_at', 'event_times')
+
+    def __init__(self, channel, webhook_url, secret, title, message, event_times=()):
+        self.channel = channel
+        self.webhook_url = webhook_url
+        self.secret = secret
+        self.title = title
+        self.message = message
+        self.created_at = time.monotonic()
+        self.event_times = event_times  # 触发本通知的各条消息的发送时间（Unix时间戳），用于统计端到端延迟
+
+
+class NotificationDispatcher:
+    """
+    非阻塞通知分发器
+    性能优化: 消息处理器只把通知放入有界队列，后台线程负责发送；
+    每个webhook地址复用一个 keep-alive 的 requests.Session，并按机器人限制限流，
+    失败时指数退避重试
+    """
+
+    def __init__(self, worker_count=WORKER_COUNT, max_queue_size=MAX_QUEUE_SIZE,
+                 overflow_policy=OVERFLOW_POLICY, max_retries=MAX_RETRIES,
+                 retry_backoff=RETRY_BACKOFF, timeout=REQUEST_TIMEOUT,
+                 rate_limit_count=RATE_LIMIT_COUNT, rate_limit_period=RATE_LIMIT_PERIOD,
+                 url_validator=is_allowed_webhook):
+        self.worker_count = worker_count
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.rate_limit_count = rate_limit_count
+        self.rate_limit_period = rate_limit_period
+        self.url_validator = url_validator  # 测试时可替换，指向本地HTTP服务
+
+        self._queue = deque()
+        self._in_flight = 0  # 正在发送（含重试等待）的通知数
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._workers = []
+        self._sessions = {}  # {webhook地址: requests.Session}
+        self._limiters = {}  # {webhook地址: RateLimiter}
+        self._endpoint_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def start(self):
+        with self._cond:
+            if any(w.is_alive() for w in self._workers):
+                return
+            self._stop_event.clear()
+            self._workers = [
+                threading.Thread(target=self._run, name=f"Notifier-{i}", daemon=True)
+                for i in range(self.worker_count)
+            ]
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self, timeout=10):
+        """
+        停止后台线程，最多等待 timeout 秒把队列中的通知发完（仍按限流发送），超时后剩余的通知丢弃并计数
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._queue or self._in_flight) and time.monotonic() < deadline:
+                self._cond.wait(timeout=0.1)
+            self._stop_event.set()
+            self._cond.notify_all()
+        # 设置停止标志后各线程放弃限流等待、丢弃剩余通知后立即退出，最多再等一次请求超时
+        for worker in self._workers:
+            worker.join(timeout=max(0.0, deadline - time.monotonic()) + self.timeout)
+        self._workers = []
+        with self._endpoint_lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def submit(self, channel, webhook_url, title, message, secret=None, event_times=()):
+        """
+        提交一条通知（立即返回，不做网络请求）
+        event_times: 触发本通知的消息发送时间，发送成功后计入 telscan_alert_lag_seconds
+
+        Returns:
+            bool: 是否已进入队列
+        """
+        if not webhook_url:
+            return False
+        if not self.url_validator(channel, webhook_url):
+            logger.warning(f"检测到不安全的Webhook URL: {webhook_url}")
+            self._count('rejected')
+            return False
+        if not any(w.is_alive() for w in self._workers):
+            self.start()
+
+        job = NotificationJob(channel, webhook_url, secret, title, message, event_times)
+        with self._cond:
+            if len(self._queue) >= self.max_queue_size:
+                self._count('dropped')
+                if self.overflow_policy == 'drop_newest':
+                    logger.warning(f"[通知] 发送队列已满，丢弃新通知: {title}")
+                    return False
+                oldest = self._queue.popleft()
+                logger.warning(f"[通知] 发送队列已满，丢弃最早的通知: {oldest.title}")
+            self._queue.append(job)
+            self._cond.notify()
+        self._count('submitted')
+        return True
+
+    def _get_endpoint(self, webhook_url):
+        with self._endpoint_lock:
+            session = self._sessions.get(webhook_url)
+            if session is None:
+                session = requests.Session()
+                session.headers.update({'Content-Type': 'application/json;charset=utf-8'})
+                self._sessions[webhook_url] = session
+                self._limiters[webhook_url] = RateLimiter(self.rate_limit_count, self.rate_limit_period)
+            return session, self._limiters[webhook_url]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop_event.is_set():
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                if self._stop_event.is_set():
+                    # 停止等待已超时: 剩余的通知不再发送，避免不限流地集中发出触发机器人限制
+                    remaining = len(self._queue)
+                    self._queue.clear()
+                    self._count('dropped', remaining)
+                    logger.warning(f"[通知] 停止时仍有 {remaining} 条通知未发送，已丢弃")
+                    return
+                job = self._queue.popleft()
+                self._in_flight += 1
+            try:
+                self._deliver(job)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _post(self, session, job):
+        """
+        发送一次请求，返回 (是否成功, 是否可重试, 说明)
+        """
+        url = job.webhook_url
+        if job.channel == 'dingtalk':
+            url = sign_dingtalk_url(url, job.secret)
+        try:
+            response = session.post(url, json=build_payload(job.channel, job.title, job.message), timeout=self.timeout)
+        except requests.RequestException as e:
+            return False, True, f"请求异常: {e}"
+        if response.status_code == 429 or response.status_code >= 500:
+            return False, True, f"HTTP状态码: {response.status_code}"
+        if response.status_code != 200:
+            return False, False, f"HTTP状态码: {response.status_code}"
+        try:
+            result = response.json()
+        except ValueError:
+            return False, False, response.text
+        errcode = result.get("errcode")
+        if errcode == 0:
+            return True, False, None
+        return False, errcode in RETRYABLE_ERRCODES, result.get('errmsg', response.text)
+
+    def _deliver(self, job):
+        session, limiter = self._get_endpoint(job.webhook_url)
+        channel_name = '钉钉' if job.channel == 'dingtalk' else '企业微信'
+        for attempt in range(self.max_retries + 1):
+            waited = limiter.acquire(self._stop_event)
+            if waited is None:
+                self._count('dropped')
+                logger.warning(f"[通知] 停止时仍在等待限流，丢弃{channel_name}通知: {job.title}")
+                return
+            if waited > 0:
+                self._count('rate_limited')
+            ok, retryable, detail = self._post(session, job)
+            if ok:
+                self._count('sent')
+                now = time.time()
+                for event_time in job.event_times:
+                    alert_lag_seconds.observe(now - event_time)
+                logger.info(f"成功发送{channel_name}通知。")
+                return
+            if not retryable or attempt == self.max_retries:
+                break
+            self._count('retried')
+            delay = self.retry_backoff * (2 ** attempt)
+            logger.warning(f"发送{channel_name}通知失败: {detail}，{delay:.0f}秒后重试")
+            if self._stop_event.wait(delay):
+                break
+        self._count('failed')
+        logger.error(f"发送{channel_name}通知失败: {detail}")
+
+    def get_stats(self):
+        with self._cond:
+            queue_depth = len(self._queue)
+        with self._stats_lock:
+            return {
+                'queue_depth': queue_depth,
+                'submitted': self.submitted,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'dropped': self.dropped,
+                'rejected': self.rejected,
+                'rate_limited': self.rate_limited,
+                'endpoints': len(self._sessions),
+            }
+
+
+class MatchAlert:
+    """
+    一次关键词命中的通知内容（title/message 为逐条发送时使用的完整格式）
+    """
+    __slots__ = ('keywords', 'group_name', 'sender', 'message_text', 'is_image', 'title', 'message', 'event_time')
+
+    def __init__(self, keywords, group_name, sender, message_text, is_image, title, message, event_time=None):
+        self.keywords = list(keywords)
+        self.group_name = group_name
+        self.sender = sender
+        self.message_text = message_text
+        self.is_image = is_image
+        self.title = title
+        self.message = message
+        self.event_time = event_time  # 原消息发送时间（Unix时间戳）
+
+
+def alert_event_times(alerts):
+    return tuple(alert.event_time for alert in alerts if alert.event_time is not None)
+
+
+class NotificationCoalescer:
+    """
+    通知汇总层
+    同一关键词（或同一群组）在时间窗口内的多次命中合并成一条markdown汇总，
+    减少webhook调用次数，避免触发机器人限流后丢失告警；紧急关键词仍立即发送
+    """
+
+    def __init__(self, dispatcher, top_n=DIGEST_TOP_N, excerpt_length=DIGEST_EXCERPT_LENGTH):
+        self.dispatcher = dispatcher
+        self.top_n = top_n
+        self.excerpt_length = excerpt_length
+        self._buckets = {}  # {(渠道, webhook, 密钥, 汇总方式, 汇总键): {'deadline', 'window', 'alerts'}}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+        self.immediate = 0
+        self.coalesced = 0
+        self.digests = 0
+
+    def add(self, channel, webhook_url, alert, secret=None, window=0, group_by='keyword', urgent=False):
+        """
+        提交一次命中；urgent 或 window<=0 时立即交给分发器
+        """
+        if urgent or not window or window <= 0:
+            with self._lock:
+                self.immediate += 1
+            return self.dispatcher.submit(channel, webhook_url, alert.title, alert.message, secret=secret,
+                                          event_times=alert_event_times([alert]))
+
+        key = alert.group_name if group_by == 'group' else alert.keywords[0]
+        bucket_key = (channel, webhook_url, secret, group_by, key)
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = {'deadline': time.monotonic() + window, 'window': window, 'alerts': []}
+                self._buckets[bucket_key] = bucket
+            bucket['alerts'].append(alert)
+            self.coalesced += 1
+        self._ensure_running()
+        return True
+
+    def _ensure_running(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="NotifierDigest", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(0.5):
+            self.flush()
+
+    def flush(self, force=False):
+        """
+        发送已到期的汇总（force=True 时发送全部）
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [k for k, b in self._buckets.items() if force or b['deadline'] <= now]
+            buckets = [(k, self._buckets.pop(k)) for k in due]
+        for bucket_key, bucket in buckets:
+            channel, webhook_url, secret, group_by, key = bucket_key
+            alerts = bucket['alerts']
+            if len(alerts) == 1:
+                title, message = alerts[0].title, alerts[0].message
+            else:
+                title, message = self._format_digest(group_by, key, bucket['window'], alerts)
+                with self._lock:
+                    self.digests += 1
+            self.dispatcher.submit(channel, webhook_url, title, message, secret=secret,
+                                   event_times=alert_event_times(alerts))
+
+    def stop(self):
+        """
+        停止定时线程，并立即发送所有未到期的汇总
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        self.flush(force=True)
+
+    def _format_digest(self, group_by, key, window, alerts):
+        if group_by == 'group':
+            title = f"群组 '{key}' 汇总: {len(alerts)} 条匹配"
+            header = f"> **群组**: {key}\n\n"
+            distribution = Counter(k for alert in alerts for k in alert.keywords)
+            distribution_label = '关键词分布'
+        else:
+            title = f"关键词 '{key}' 汇总: {len(alerts)} 条匹配"
+            header = f"> **关键词**: {key}\n\n"
+            distribution = Counter(alert.group_name for alert in alerts)
+            distribution_label = '群组分布'
+
+        lines = [
+            "#### **关键词监控汇总**\n\n",
+            header,
+            f"> **时间窗口**: {window} 秒内共 {len(alerts)} 条匹配\n\n",
+            f"> **{distribution_label}**: " + ", ".join(f"{name} × {count}" for name, count in distribution.most_common()) + "\n\n",
+            f"**消息摘录（前 {min(self.top_n, len(alerts))} 条）**:\n\n",
+        ]
+        for index, alert in enumerate(alerts[:self.top_n], start=1):
+            excerpt = ' '.join(alert.message_text.split())
+            if len(excerpt) > self.excerpt_length:
+                excerpt = excerpt[:self.excerpt_length] + '...'
+            image_tag = '[图片] ' if alert.is_image else ''
+            lines.append(f"{index}. {image_tag}[{alert.group_name}] {alert.sender or 'N/A'}: {excerpt}\n")
+        return title, ''.join(lines)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'pending_digests': len(self._buckets),
+                'pending_alerts': sum(len(b['alerts']) for b in self._buckets.values()),
+                'immediate': self.immediate,
+                'coalesced': self.coalesced,
+                'digests_sent': self.digests,
+            }
+
+
+notification_dispatcher = NotificationDispatcher()
+notification_coalescer = NotificationCoalescer(notification_dispatcher)
+
+
+# 监控指标: 抓取时读取分发器统计
+registry.callback(
+    'telscan_notifications_total', '通知发送结果计数',
+    lambda: {(name,): notification_dispatcher.get_stats()[name] for name in ('sent', 'failed', 'retried', 'dropped', 'rejected')},
+    labelnames=('result',), type_name='counter')
+registry.callback(
+    'telscan_notification_queue_depth', '待发送的通知数',
+    lambda: notification_dispatcher.get_stats()['queue_depth'])
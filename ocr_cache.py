@@ -0,0 +1,261 @@
+import io
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from database import instance_path
+from log_manager import get_logger
+
+logger = get_logger('ocr')
+
+# 缓存配置
+OCR_CACHE_SIZE = 20000  # 内存中最多缓存的图片识别结果数
+OCR_CACHE_DB_PATH = os.path.join(instance_path, 'ocr_cache.sqlite')  # 设为None则只缓存在内存中
+PRUNE_EVERY = 1000  # 每写入这么多条清理一次本地库，只保留最近的 OCR_CACHE_SIZE 条
+
+# 感知哈希（dHash）近似去重配置
+HASH_SIZE = 8  # 缩略图 (HASH_SIZE+1) x HASH_SIZE 灰度图，得到64位哈希
+PHASH_INDEX_SIZE = 5000  # 内存中保留的最近图片哈希数
+PHASH_THRESHOLD = 5  # 汉明距离不超过该值视为同一张图片（重新编码、缩放、轻微裁剪）
+PHASH_BANDS = 8  # 哈希按8位分段建索引；距离 < 段数时至少有一段完全相同，只需比较这些候选
+PHASH_MIN_BITS = 8  # 置位数过少/过多的哈希（纯色、几乎空白的图片）不参与去重，避免误判
+
+
+class OcrResultCache:
+    """
+    按 Telegram photo.id 缓存OCR识别结果（LRU）
+    性能优化: 同一张推广图片会被转发到大量群组，命中缓存时跳过下载和tesseract，直接匹配关键词；
+    可选写入本地SQLite，重启后预热到内存，查询始终只访问内存
+    """
+
+    def __init__(self, max_size=OCR_CACHE_SIZE, db_path=OCR_CACHE_DB_PATH):
+        self.max_size = max_size
+        self.db_path = db_path
+        self._entries = OrderedDict()  # {photo_id: 识别文本}
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.loaded = 0
+
+    def open(self):
+        """
+        打开本地库并把最近的识别结果加载到内存（启动时调用一次）
+        """
+        if not self.db_path or self._db is not None:
+            return
+        try:
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS ocr_result (photo_id INTEGER PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS ix_ocr_result_created_at ON ocr_result (created_at)")
+            db.commit()
+            rows = db.execute(
+                "SELECT photo_id, text FROM ocr_result ORDER BY created_at DESC LIMIT ?", (self.max_size,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"[OCR缓存] 打开本地缓存库失败，只使用内存缓存: {e}")
+            return
+        with self._lock:
+            # 按时间从旧到新放入，最近的结果位于LRU末尾
+            for photo_id, text in reversed(rows):
+                self._entries[photo_id] = text
+            self.loaded = len(rows)
+        self._db = db
+        logger.info(f"[OCR缓存] 已从本地库加载 {len(rows)} 条识别结果")
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get(self, photo_id):
+        """
+        返回缓存的识别文本（可能为空字符串），未命中返回None
+        """
+        with self._lock:
+            text = self._entries.get(photo_id)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(photo_id)
+            self.hits += 1
+            return text
+
+    def put(self, photo_id, text):
+        with self._lock:
+            self._entries[photo_id] = text
+            self._entries.move_to_end(photo_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self.stores += 1
+        self._persist(photo_id, text)
+
+    def _persist(self, photo_id, text):
+        # 在OCR线程中调用，不阻塞事件循环
+        if self._db is None:
+            return
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO ocr_result (photo_id, text, created_at) VALUES (?, ?, ?)",
+                    (photo_id, text, time.time()),
+                )
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= PRUNE_EVERY:
+                    self._writes_since_prune = 0
+                    self._db.execute(
+                        "DELETE FROM ocr_result WHERE created_at <= (SELECT created_at FROM ocr_result ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+                        (self.max_size,),
+                    )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"[OCR缓存] 写入本地缓存库失败: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.execute("DELETE FROM ocr_result")
+                self._db.commit()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'persistent': self._db is not None,
+                'loaded_from_disk': self.loaded,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+            }
+
+
+def compute_photo_hash(photo_bytes):
+    """
+    计算图片的64位 dHash（相邻像素亮度差），失败或图片过于单调时返回None
+    JPEG按缩小比例解码（draft），只需要完整解码的一小部分时间
+    """
+    from PIL import Image
+
+    try:
+        image = Image.open(io.BytesIO(photo_bytes))
+        image.draft('L', ((HASH_SIZE + 1) * 8, HASH_SIZE * 8))
+        # 'L' 模式每个像素一个字节，bytes 按索引即得到亮度值
+        pixels = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).tobytes()
+    except Exception as e:
+        logger.debug("[OCR缓存] 计算图片哈希失败: %s", e)
+        return None
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    bits = bin(value).count('1')
+    if bits < PHASH_MIN_BITS or bits > HASH_SIZE * HASH_SIZE - PHASH_MIN_BITS:
+        return None
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class PerceptualHashIndex:
+    """
+    最近识别过的图片哈希 → OCR文字，支持按汉明距离查找近似重复的图片
+    性能优化: 垃圾广告图片常被重新编码、缩放或轻微裁剪后再发，photo.id 不同但哈希相近，
+    命中时直接复用识别文字，跳过 tesseract
+    """
+
+    def __init__(self, max_size=PHASH_INDEX_SIZE, threshold=PHASH_THRESHOLD, bands=PHASH_BANDS):
+        if threshold >= bands:
+            raise ValueError("threshold 必须小于分段数，否则分段索引可能漏查")
+        self.max_size = max_size
+        self.threshold = threshold
+        self.bands = bands
+        self.band_bits = HASH_SIZE * HASH_SIZE // bands
+        self._band_mask = (1 << self.band_bits) - 1
+        self._entries = OrderedDict()  # {哈希: 识别文本}
+        self._buckets = [{} for _ in range(bands)]  # 每段: {段值: {哈希, ...}}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _band_values(self, value):
+        return [(value >> (i * self.band_bits)) & self._band_mask for i in range(self.bands)]
+
+    def find(self, value):
+        """
+        返回距离最近（且不超过阈值）的图片的识别文本，未找到返回None
+        """
+        with self._lock:
+            best, best_distance = None, self.threshold + 1
+            if value in self._entries:
+                best = value
+            else:
+                seen = set()
+                for band, band_value in enumerate(self._band_values(value)):
+                    for candidate in self._buckets[band].get(band_value, ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        distance = hamming_distance(value, candidate)
+                        if distance < best_distance:
+                            best, best_distance = candidate, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best]
+
+    def add(self, value, text):
+        with self._lock:
+            if value in self._entries:
+                self._entries[value] = text
+                self._entries.move_to_end(value)
+                return
+            self._entries[value] = text
+            for band, band_value in enumerate(self._band_values(value)):
+                self._buckets[band].setdefault(band_value, set()).add(value)
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                for band, band_value in enumerate(self._band_values(evicted)):
+                    bucket = self._buckets[band][band_value]
+                    bucket.discard(evicted)
+                    if not bucket:
+                        del self._buckets[band][band_value]
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+
+ocr_cache = OcrResultCache()
+ocr_phash_index = PerceptualHashIndex()
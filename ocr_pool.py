@@ -0,0 +1,243 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from log_manager import get_logger
+from metrics import LAG_BUCKETS, registry
+from ocr_worker import init_worker, recognize_image
+
+logger = get_logger('ocr')
+
+# OCR工作池配置（可用环境变量覆盖）
+OCR_WORKERS = int(os.environ.get('TELSCAN_OCR_WORKERS') or max(1, (os.cpu_count() or 2) - 1))  # 工作进程数，默认 CPU核数-1
+OCR_MAX_QUEUE_SIZE = int(os.environ.get('TELSCAN_OCR_QUEUE_SIZE') or 200)  # 等待OCR的图片数上限
+OCR_JOB_DEADLINE = float(os.environ.get('TELSCAN_OCR_DEADLINE') or 120)  # 秒，图片入队后超过这么久还没开始识别就跳过（告警已没有时效）
+
+# 队列溢出策略: drop_oldest 丢弃最早的待识别图片, drop_newest 丢弃新提交的图片
+OCR_OVERFLOW_POLICY = 'drop_oldest'
+
+# 工作进程启动方式: 不使用 fork（监控进程中已有事件循环、写入、日志等多个线程，fork 出的子进程可能继承被其他线程持有的锁而死锁）
+# forkserver 的服务进程只预加载 ocr_worker，工作进程从这个单线程的服务进程 fork 出来；不支持时使用 spawn
+# 注意: 两种方式的工作进程都会以 __mp_main__ 重新导入启动脚本（app.py），启动脚本的建表/迁移等逻辑须放在 __main__ 块中
+OCR_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+OCR_WORKER_PRELOAD = ['ocr_worker']
+
+ocr_queue_wait_seconds = registry.histogram(
+    'telscan_ocr_queue_wait_seconds', '图片从入队到开始识别的等待时间（秒）', buckets=LAG_BUCKETS)
+
+
+class OcrJob:
+    __slots__ = ('fn', 'args', 'callback', 'submitted_at', 'deadline')
+
+    def __init__(self, fn, args, callback, deadline):
+        self.fn = fn
+        self.args = args
+        self.callback = callback
+        self.submitted_at = time.monotonic()
+        self.deadline = self.submitted_at + deadline
+
+
+class OcrWorkerPool:
+    """
+    OCR工作池
+    性能优化: 图片先进入有界队列，每个工作进程对应一个分发线程；分发线程取出任务后在本进程做
+    轻量的前置处理（如感知哈希去重），需要识别时交给工作进程，PIL解码不再与监控线程争抢GIL。
+    队列满时按溢出策略丢弃，等待超过期限的图片直接跳过，图片洪峰不会拖慢文字消息匹配
+
+    submit(fn, args, callback): fn(*args) 在分发线程中运行，返回 (识别文本, 错误)，
+    结果交给 callback(识别文本, 错误)；被丢弃或过期的任务也会回调（文本为None），便于调用方释放资源
+    """
+
+    def __init__(self, workers=OCR_WORKERS, max_queue_size=OCR_MAX_QUEUE_SIZE, deadline=OCR_JOB_DEADLINE,
+                 overflow_policy=OCR_OVERFLOW_POLICY, start_method=OCR_START_METHOD):
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.deadline = deadline
+        self.overflow_policy = overflow_policy
+        self.start_method = start_method
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.expired = 0
+        self.no_text = 0
+        self.restarts = 0
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def start(self):
+        with self._cond:
+            if any(t.is_alive() for t in self._threads):
+                return
+            self._stop_event.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"OCR-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+        # 提交一个空任务，让工作进程在启动阶段就创建好，第一张图片不必等待进程启动
+        self._get_executor().submit(os.getpid)
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"[OCR异步] OCR工作池已启动: {self.workers} 个工作进程（{self.start_method}），队列上限 {self.max_queue_size}")
+
+    def stop(self, timeout=10):
+        """
+        停止分发线程和工作进程；队列中尚未开始的任务以"已停止"回调
+        """
+        self._stop_event.set()
+        with self._cond:
+            pending = list(self._queue)
+            self._queue.clear()
+            self._cond.notify_all()
+        for job in pending:
+            self._finish(job, None, "OCR工作池已停止")
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        self._threads = []
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver':
+                    # 默认会预加载 __main__（app.py），服务进程随之启动日志等线程，再从它 fork 又回到多线程 fork 的问题
+                    context.set_forkserver_preload(OCR_WORKER_PRELOAD)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=init_worker,
+                )
+            return self._executor
+
+    def _reset_executor(self, broken):
+        with self._executor_lock:
+            if self._executor is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._count('restarts')
+
+    def submit(self, fn, args, callback):
+        """
+        提交一张图片（立即返回）
+
+        Returns:
+            bool: 是否已进入队列（drop_newest 策略下队列已满时返回False，并以"已丢弃"回调）
+        """
+        if not any(t.is_alive() for t in self._threads):
+            self.start()
+        job = OcrJob(fn, args, callback, self.deadline)
+        dropped = None
+        with self._cond:
+            if len(self._queue) >= self.max_queue_size:
+                if self.overflow_policy == 'drop_newest':
+                    dropped = job
+                else:
+                    dropped = self._queue.popleft()
+                    self._queue.append(job)
+            else:
+                self._queue.append(job)
+            self._cond.notify()
+        self._count('submitted')
+        if dropped is not None:
+            self._count('dropped')
+            logger.warning("[OCR异步] OCR队列已满，丢弃" + ("新提交的图片" if dropped is job else "最早的待识别图片"))
+            self._finish(dropped, None, "OCR队列已满，已丢弃")
+        return dropped is not job
+
+    def recognize(self, photo_bytes):
+        """
+        在工作进程中识别图片（由分发线程调用，阻塞到识别完成），返回识别文本
+        """
+        executor = self._get_executor()
+        try:
+            ocr_text, no_text = executor.submit(recognize_image, photo_bytes).result()
+        except BrokenProcessPool:
+            # 工作进程异常退出（如被OOM杀掉）: 重建进程池后重试一次
+            logger.warning("[OCR异步] OCR工作进程异常退出，重建进程池")
+            self._reset_executor(executor)
+            ocr_text, no_text = self._get_executor().submit(recognize_image, photo_bytes).result()
+        if no_text:
+            self._count('no_text')
+        return ocr_text
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop_event.is_set():
+                    self._cond.wait()
+                if self._stop_event.is_set():
+                    return
+                job = self._queue.popleft()
+            now = time.monotonic()
+            ocr_queue_wait_seconds.observe(now - job.submitted_at)
+            if now > job.deadline:
+                self._count('expired')
+                self._finish(job, None, f"图片等待 {now - job.submitted_at:.0f} 秒未识别，已过期跳过")
+                continue
+            try:
+                ocr_text, error = job.fn(*job.args)
+            except Exception as e:
+                ocr_text, error = None, str(e)
+            self._count('failed' if error else 'completed')
+            self._finish(job, ocr_text, error)
+
+    def _finish(self, job, ocr_text, error):
+        try:
+            job.callback(ocr_text, error)
+        except Exception as e:
+            logger.error(f"[OCR异步] 回调处理失败: {e}")
+
+    def oldest_job_age(self):
+        with self._cond:
+            oldest = self._queue[0].submitted_at if self._queue else None
+        return time.monotonic() - oldest if oldest is not None else 0.0
+
+    def get_stats(self):
+        with self._cond:
+            queue_depth = len(self._queue)
+        oldest_age = self.oldest_job_age()
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'start_method': self.start_method,
+                'running': any(t.is_alive() for t in self._threads),
+                'queue_depth': queue_depth,
+                'max_queue_size': self.max_queue_size,
+                'oldest_job_age': round(oldest_age, 3),
+                'deadline': self.deadline,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'expired': self.expired,
+                'no_text': self.no_text,
+                'restarts': self.restarts,
+            }
+
+
+ocr_pool = OcrWorkerPool()
+
+# 监控指标: 抓取时读取
+registry.callback('telscan_ocr_pool_queue_depth', '等待OCR的图片数', lambda: ocr_pool.get_stats()['queue_depth'])
+registry.callback('telscan_ocr_pool_oldest_job_age_seconds', '队列中最早一张图片已等待的时间（秒）', ocr_pool.oldest_job_age)
@@ -0,0 +1,72 @@
+import io
+import os
+
+# OCR工作进程中运行的代码: 只依赖标准库和 PIL/pytesseract，不导入 app、database 等模块，
+# 工作进程（forkserver/spawn 启动）反序列化任务时只需导入本模块
+
+OCR_TIMEOUT = 30  # 秒，单张图片 tesseract 的最长运行时间
+OCR_LANG = 'chi_sim+eng'
+
+# 识别前预处理: 转灰度、长边缩小到 OCR_MAX_SIDE；边缘密度低于阈值的图片（纯色、模糊照片等）视为没有文字，跳过 tesseract
+OCR_MAX_SIDE = int(os.environ.get('TELSCAN_OCR_MAX_SIDE') or 1600)  # 像素，0 表示不缩放
+# 默认阈值较保守: 只跳过几乎没有清晰边缘的图片（大图角落里的一行小字约为 0.0003），可用 benchmarks/bench_ocr_preprocess.py 在真实图片上调整
+OCR_MIN_EDGE_DENSITY = float(os.environ.get('TELSCAN_OCR_MIN_EDGE_DENSITY') or 0.0001)  # 0 表示不做文字检测
+TEXT_CHECK_SIDE = 256  # 文字检测使用的缩略图长边
+EDGE_LEVEL = 64  # 边缘强度（0-255）超过该值才计为强边缘
+
+
+def init_worker():
+    # 多个 tesseract 并行时限制各自的 OpenMP 线程数，避免互相抢占CPU
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+
+def preprocess_image(image, max_side=OCR_MAX_SIDE):
+    """
+    转灰度，长边超过 max_side 时按比例缩小（文字仍有足够像素，tesseract 耗时随像素数下降）
+    """
+    from PIL import Image
+
+    if max_side:
+        # JPEG 直接按接近目标的比例解码，不必先解码完整分辨率
+        image.draft('L', (max_side, max_side))
+    gray = image.convert('L')
+    if max_side and max(gray.size) > max_side:
+        gray.thumbnail((max_side, max_side), Image.LANCZOS)
+    return gray
+
+
+def text_edge_density(gray):
+    """
+    文字检测: 缩略图中强边缘像素所占比例；文字笔画带来大量高对比度边缘，纯色/模糊/大面积平滑的图片接近0
+    """
+    from PIL import ImageFilter
+
+    thumb = gray.copy()
+    thumb.thumbnail((TEXT_CHECK_SIDE, TEXT_CHECK_SIDE))
+    edges = thumb.filter(ImageFilter.FIND_EDGES)
+    # 去掉1像素边框（卷积在图片边缘会产生假边缘）
+    if edges.width > 2 and edges.height > 2:
+        edges = edges.crop((1, 1, edges.width - 1, edges.height - 1))
+    histogram = edges.histogram()
+    return sum(histogram[EDGE_LEVEL:]) / float(edges.width * edges.height)
+
+
+def recognize_image(photo_bytes, lang=OCR_LANG, timeout=OCR_TIMEOUT, preprocess=True,
+                    max_side=OCR_MAX_SIDE, min_edge_density=OCR_MIN_EDGE_DENSITY):
+    """
+    在工作进程中运行: 解码、预处理图片并调用 tesseract
+    返回: (识别文本, 是否因没有文字而跳过)
+    """
+    from PIL import Image
+    import pytesseract
+
+    try:
+        image = Image.open(io.BytesIO(photo_bytes))
+        if preprocess:
+            image = preprocess_image(image, max_side)
+            if min_edge_density and text_edge_density(image) < min_edge_density:
+                return "", True
+        return pytesseract.image_to_string(image, lang=lang, timeout=timeout), False
+    except Exception as e:
+        # 部分 pytesseract 异常无法在父进程反序列化（会被当作进程池损坏），统一转换为 RuntimeError
+        raise RuntimeError(str(e)) from None
@@ -1,25 +1,32 @@
 import asyncio
+import os
 import threading
 from datetime import datetime
 import requests
 import time
-import hmac
-import hashlib
-import base64
-import urllib.parse
 from urllib.parse import urlparse
-from telethon import TelegramClient, events
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-<<<<<<< Updated upstream
+from telethon import TelegramClient, events, types, utils
 import telegram_utils
-=======
-import ahocorasick
-from concurrent.futures import ThreadPoolExecutor
-import os
->>>>>>> Stashed changes
+import json
+
+from database import MonitoredGroup, MatchedMessage, MatchedMessageKeyword, get_session
+from config_cache import config_cache
+from entity_cache import MISSING, chat_cache, sender_cache, make_chat_info, format_sender_name
+from keyword_matcher import keyword_matcher_store
+from text_normalizer import normalize_message
+from message_writer import message_writer
+from ocr_cache import compute_photo_hash, ocr_cache, ocr_phash_index
+from ocr_pool import ocr_pool
+from log_manager import debug_sampled, get_logger
+from metrics import messages_matched, messages_seen, registry, stage_seconds
+from notifier import MatchAlert, notification_coalescer, notification_dispatcher, sign_dingtalk_url
 
-from database import Config, MonitoredGroup, Keyword, MatchedMessage, DB_URI
+logger = get_logger('monitor')
+message_logger = get_logger('message')
+filter_logger = get_logger('event_filter')
+ocr_logger = get_logger('ocr')
+notify_logger = get_logger('notify')
+websocket_logger = get_logger('websocket')
 
 client_instance = None
 client_thread = None
@@ -28,12 +35,36 @@ main_loop = None
 client_ready = threading.Event()
 stop_event = threading.Event() #  <-- 新增: 用于控制线程停止
 
-# 性能优化: AC自动机缓存
-keyword_automatons = {}  # {group_id: automaton} 缓存每个群组的AC自动机
-automatons_lock = threading.Lock()  # 线程安全锁
+# 性能优化: 监控群组内存索引，启动时加载一次，由 app.py 的路由增量更新
+groups_by_chat_id = {}  # {去掉-100前缀的群组ID: GroupRecord}
+groups_by_username = {}  # {小写用户名: GroupRecord}
+unresolved_usernames = set()  # 尚未得知群组ID的用户名，解析后其ID写入 groups_by_chat_id
+group_index_lock = threading.Lock()  # 写锁，读取端直接查字典
+
+# 事件过滤统计
+events_processed = 0  # 通过过滤进入处理器的消息数
+events_dropped = 0  # 在过滤器中直接丢弃的消息数
+
+# OCR异步处理: 图片提交到 ocr_pool（有界队列 + 工作进程池），见 ocr_pool.py
+# 图片直接下载到内存交给OCR工作池，不写临时文件；已下载未处理完的图片总大小受预算限制，图片洪峰时跳过超出预算的图片
+OCR_MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+# 下载尺寸: 选择长边不小于该值的最小图片尺寸（Telegram 同一张图片有 320/800/1280/2560 等多个尺寸），0 表示下载原图
+# 识别前图片会缩小到 ocr_worker.OCR_MAX_SIDE，设为接近的值可减少下载流量和解码时间
+OCR_DOWNLOAD_MIN_SIDE = int(os.environ.get('TELSCAN_OCR_DOWNLOAD_MIN_SIDE') or 0)
+ocr_pending = 0  # 已提交、尚未处理完的OCR任务数
+ocr_buffered_bytes = 0  # 已下载、尚未处理完的图片总字节数
+ocr_skipped = 0  # 超出内存预算而跳过的图片数
+ocr_inflight = {}  # {photo_id: [(event_data, group_record, matcher), ...]} 正在识别的图片及等待其结果的其他消息
+ocr_joined = 0  # 等待同一张图片识别结果、未重复下载的消息数
+ocr_lock = threading.Lock()
 
-# OCR异步处理: 线程池（最多2个OCR任务并发）
-ocr_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="OCR")
+# 相册（同一 grouped_id 的多张图片）: 各张图片作为独立消息到达，收集窗口内的全部图片后各自提交到OCR工作池并行识别，
+# 全部完成后合并文字只匹配一次，只保存一条匹配记录、发送一条通知
+ALBUM_WINDOW = 1.0  # 秒，第一张图片到达后等待其余图片的时间
+ALBUM_MAX_PARTS = 10  # Telegram 相册最多10张，收齐后立即提交
+album_batches = {}  # {(chat_id, grouped_id): AlbumBatch}，只在事件循环中访问
+albums_submitted = 0  # 已合并识别的相册数
+album_photos = 0  # 相册中的图片数
 
 # WebSocket消息推送回调函数（由 app.py 设置）
 websocket_broadcast_callback = None
@@ -42,48 +73,349 @@ logo_update_thread = None
 logo_updater_running = False
 
 def get_db_session():
-    engine = create_engine(DB_URI)
-    Session = sessionmaker(bind=engine)
-    return Session()
+    # 性能优化: 使用 database 模块中全局共享的连接池，不再每次创建引擎
+    return get_session()
+
+class GroupRecord:
+    """
+    监控群组的轻量级内存记录（与数据库会话无关，可跨线程使用）
+    """
+    __slots__ = ('id', 'identifier', 'name')
+
+    def __init__(self, id, identifier, name):
+        self.id = id
+        self.identifier = identifier
+        self.name = name
+
+def normalize_chat_id(identifier):
+    """
+    统一群组ID格式: 去掉超级群组/频道的 -100 前缀
+    """
+    identifier = str(identifier)
+    if identifier.startswith('-100'):
+        return identifier[4:]
+    return identifier
+
+def _make_group_record(group):
+    return GroupRecord(
+        group.id,
+        group.group_identifier,
+        group.group_name
+    )
+
+def _index_record(record):
+    # 调用方需持有 group_index_lock
+    identifier = record.identifier
+    normalized = normalize_chat_id(identifier)
+    if normalized.lstrip('-').isdigit():
+        groups_by_chat_id[normalized] = record
+    else:
+        username = identifier.lower()
+        groups_by_username[username] = record
+        unresolved_usernames.add(username)
+
+def _unindex_group_id(group_id):
+    # 调用方需持有 group_index_lock
+    for index in (groups_by_chat_id, groups_by_username):
+        for key in [k for k, r in index.items() if r.id == group_id]:
+            del index[key]
+    unresolved_usernames.intersection_update(groups_by_username)
+
+def _bind_chat_id(username, chat_id):
+    """
+    记录用户名群组对应的群组ID，之后该群组的消息可直接按ID通过事件过滤
+    """
+    with group_index_lock:
+        record = groups_by_username.get(username)
+        if record is not None:
+            groups_by_chat_id[normalize_chat_id(chat_id)] = record
+            unresolved_usernames.discard(username)
+
+def load_group_index(session=None):
+    """
+    从数据库一次性加载全部监控群组到内存索引
+    """
+    own_session = session is None
+    if own_session:
+        session = get_db_session()
+    try:
+        records = [_make_group_record(g) for g in session.query(MonitoredGroup).all()]
+    finally:
+        if own_session:
+            session.close()
+
+    with group_index_lock:
+        groups_by_chat_id.clear()
+        groups_by_username.clear()
+        unresolved_usernames.clear()
+        for record in records:
+            _index_record(record)
+    logger.info(f"[性能优化] 已加载 {len(records)} 个监控群组到内存索引")
+
+def register_group(group):
+    """
+    新增或更新索引中的群组（group 为已提交的 MonitoredGroup 对象）
+    """
+    record = _make_group_record(group)
+    with group_index_lock:
+        _unindex_group_id(record.id)
+        _index_record(record)
+    if unresolved_usernames:
+        schedule_username_resolution()
+
+def unregister_group(group_id):
+    """
+    从索引中移除群组
+    """
+    with group_index_lock:
+        _unindex_group_id(group_id)
+
+def invalidate_keyword_matcher():
+    """
+    关键词或群组关联变更后通知后台线程重建全局匹配器（一次重建即服务所有群组）
+    """
+    keyword_matcher_store.request_rebuild()
+
+def find_monitored_group(chat):
+    """
+    根据Telegram chat对象查找监控群组，未监控时返回None（仅查字典，不访问数据库）
+    """
+    record = groups_by_chat_id.get(normalize_chat_id(chat.id))
+    if record is None:
+        username = getattr(chat, 'username', None)
+        if username:
+            record = groups_by_username.get(username.lower())
+            if record is not None:
+                _bind_chat_id(username.lower(), chat.id)
+    return record
+
+def accept_chat_event(event):
+    """
+    NewMessage 事件过滤器（在 Telethon 分发事件时调用，早于处理器）
+    性能优化: 只按 chat_id 查内存字典，未监控的对话和私聊在进入处理器前直接丢弃，
+    不调用 get_chat()；仍有未解析ID的用户名群组时，非私聊消息交给处理器按用户名匹配
+    """
+    global events_processed, events_dropped
+    chat_id = event.chat_id
+    if chat_id is not None:
+        raw_id = str(utils.resolve_id(chat_id)[0])
+        if raw_id in groups_by_chat_id or (unresolved_usernames and not event.is_private):
+            events_processed += 1
+            return True
+    events_dropped += 1
+    return False
+
+async def resolve_pending_usernames(client):
+    """
+    解析用户名群组的ID，解析完成后未监控群组的消息可以全部在过滤器中丢弃
+    """
+    for username in list(unresolved_usernames):
+        try:
+            chat_id = await client.get_peer_id(username)
+        except Exception as e:
+            filter_logger.warning(f"[事件过滤] 解析群组用户名 '{username}' 失败: {e}")
+            continue
+        _bind_chat_id(username, utils.resolve_id(chat_id)[0])
+        filter_logger.info(f"[事件过滤] 群组用户名 '{username}' 已解析为ID {chat_id}")
+
+def schedule_username_resolution():
+    """
+    从其他线程（如 app.py 路由）提交用户名解析任务到监控事件循环
+    """
+    if client_instance and is_running and main_loop:
+        asyncio.run_coroutine_threadsafe(resolve_pending_usernames(client_instance), main_loop)
+
+def get_event_filter_stats():
+    total = events_processed + events_dropped
+    return {
+        'processed': events_processed,
+        'dropped': events_dropped,
+        'drop_ratio': round(events_dropped / total, 4) if total else 0.0,
+        'monitored_chat_ids': len(groups_by_chat_id),
+        'unresolved_usernames': len(unresolved_usernames),
+    }
+
+def reserve_ocr_bytes(size):
+    """
+    为即将下载的图片预留内存预算，超出预算返回False
+    没有待处理图片时总是放行，避免单张超大图片永远无法处理
+    """
+    global ocr_buffered_bytes, ocr_skipped
+    with ocr_lock:
+        if ocr_buffered_bytes and ocr_buffered_bytes + size > OCR_MAX_BUFFERED_BYTES:
+            ocr_skipped += 1
+            return False
+        ocr_buffered_bytes += size
+        return True
+
+def select_ocr_photo_size(photo, min_side=None):
+    """
+    选择用于OCR的图片尺寸: 长边不小于 min_side 的最小尺寸
+    返回: (PhotoSize, 字节数)；没有合适尺寸或未开启时返回 (None, None)，表示下载原图
+    """
+    min_side = OCR_DOWNLOAD_MIN_SIDE if min_side is None else min_side
+    if not min_side:
+        return None, None
+    best, best_size = None, None
+    for size in getattr(photo, 'sizes', None) or ():
+        if isinstance(size, types.PhotoSize):
+            byte_size = size.size
+        elif isinstance(size, types.PhotoSizeProgressive):
+            byte_size = max(size.sizes) if size.sizes else 0
+        else:
+            continue  # 内嵌缩略图、矢量轮廓等不适合识别
+        if max(size.w, size.h) < min_side:
+            continue
+        if best is None or size.w * size.h < best.w * best.h:
+            best, best_size = size, byte_size
+    return best, best_size
+
+def release_ocr_bytes(size):
+    global ocr_buffered_bytes
+    with ocr_lock:
+        ocr_buffered_bytes -= size
+
+def abandon_ocr(photo_id):
+    """
+    图片未能提交OCR（超出预算或下载失败）: 取消登记，等待它的消息一并放弃
+    """
+    with ocr_lock:
+        waiters = ocr_inflight.pop(photo_id, [])
+    if waiters:
+        ocr_logger.warning(f"[OCR异步] 图片未能识别，{len(waiters)} 条引用同一图片的消息一并跳过")
+
+def get_ocr_pending():
+    return ocr_pending
+
+def get_ocr_stats():
+    with ocr_lock:
+        stats = {
+            'pending': ocr_pending,
+            'inflight_photos': len(ocr_inflight),
+            'joined': ocr_joined,
+            'buffered_bytes': ocr_buffered_bytes,
+            'max_buffered_bytes': OCR_MAX_BUFFERED_BYTES,
+            'skipped': ocr_skipped,
+            'albums_collecting': len(album_batches),
+            'albums_submitted': albums_submitted,
+            'album_photos': album_photos,
+        }
+    stats['pool'] = ocr_pool.get_stats()
+    stats['cache'] = ocr_cache.get_stats()
+    stats['phash'] = ocr_phash_index.get_stats()
+    return stats
+
+
+# 监控指标: 抓取时读取，消息处理热路径不额外计数
+registry.callback(
+    'telscan_chat_events_total', '群组事件过滤结果计数',
+    lambda: {('processed',): events_processed, ('dropped',): events_dropped},
+    labelnames=('result',), type_name='counter')
+registry.callback('telscan_ocr_queue_depth', '已提交、尚未处理完的OCR任务数', get_ocr_pending)
+registry.callback('telscan_ocr_buffered_bytes', '已下载、尚未处理完的图片总字节数', lambda: ocr_buffered_bytes)
+registry.callback(
+    'telscan_ocr_skipped_total', '未进行OCR而跳过的图片数（no_text: 预处理判定为没有文字）',
+    lambda: {
+        ('memory_budget',): ocr_skipped,
+        ('queue_full',): ocr_pool.dropped,
+        ('expired',): ocr_pool.expired,
+        ('no_text',): ocr_pool.no_text,
+    },
+    labelnames=('reason',), type_name='counter')
+registry.callback(
+    'telscan_ocr_cache_lookups_total', 'OCR结果缓存查询次数（photo_id: 按图片ID精确查找; phash: 按感知哈希查找近似图片）',
+    lambda: {
+        ('photo_id', 'hit'): ocr_cache.hits, ('photo_id', 'miss'): ocr_cache.misses,
+        ('phash', 'hit'): ocr_phash_index.hits, ('phash', 'miss'): ocr_phash_index.misses,
+    },
+    labelnames=('cache', 'result'), type_name='counter')
+
+def get_keyword_matcher():
+    """
+    获取当前发布的全局关键词匹配器（无锁读取，不会在此处构建）
+    """
+    return keyword_matcher_store.matcher
+
+def make_matched_message(group_name, message_text, sender, matches, generation=None):
+    """
+    构建一条匹配消息记录，命中的每个关键词写入关联表（消息内容只存一份）
 
-def process_ocr_sync(photo_path):
+    Args:
+        matches: KeywordMatcher.find_all() 的返回值 {关键词: [(开始, 结束), ...]}
+        generation: 命中时使用的匹配器代数（KeywordMatcher.generation）
     """
-    同步OCR处理函数（在线程池中运行）
+    return MatchedMessage(
+        group_name=group_name,
+        message_content=message_text,
+        sender=sender,
+        message_date=datetime.now(),
+        matched_keyword=next(iter(matches))[:100],
+        keyword_generation=generation,
+        keywords=[
+            MatchedMessageKeyword(keyword=keyword_text, positions=json.dumps(positions))
+            for keyword_text, positions in matches.items()
+        ]
+    )
+
+def process_ocr_sync(photo_bytes):
+    """
+    同步OCR处理函数（在OCR工作池的分发线程中运行），photo_bytes 为内存中的图片数据
+    感知哈希在本进程计算和查找，只有需要识别的图片才交给工作进程
     返回: (ocr_text, error)
     """
     try:
-        from PIL import Image
-        import pytesseract
-        
-        image = Image.open(photo_path)
-        ocr_text = pytesseract.image_to_string(image, lang='chi_sim+eng')
-        print(f"[OCR异步] 识别完成: {ocr_text[:100]}...")
-        
-        # 删除临时文件
-        if os.path.exists(photo_path):
-            os.remove(photo_path)
-        
+        # 性能优化: 先用缩略图计算感知哈希，近似重复的图片（重新编码、缩放、轻微裁剪）直接复用识别结果
+        start = time.perf_counter()
+        photo_hash = compute_photo_hash(photo_bytes)
+        stage_seconds.observe(time.perf_counter() - start, 'ocr_phash')
+        if photo_hash is not None:
+            cached_text = ocr_phash_index.find(photo_hash)
+            if cached_text is not None:
+                ocr_logger.debug("[OCR异步] 图片与已识别图片近似（哈希 %016x），复用识别结果", photo_hash)
+                return (cached_text, None)
+
+        start = time.perf_counter()
+        ocr_text = ocr_pool.recognize(photo_bytes)
+        stage_seconds.observe(time.perf_counter() - start, 'ocr')
+        ocr_logger.debug("[OCR异步] 识别完成: %.100s...", ocr_text)
+        if photo_hash is not None:
+            ocr_phash_index.add(photo_hash, ocr_text)
         return (ocr_text, None)
     except ImportError as e:
-        print(f"[OCR异步] 警告: 未安装 pytesseract 或 Pillow - {e}")
+        ocr_logger.warning(f"[OCR异步] 未安装 pytesseract 或 Pillow - {e}")
         return (None, "未安装OCR依赖")
     except Exception as e:
-        print(f"[OCR异步] 识别失败: {e}")
+        ocr_logger.error(f"[OCR异步] 识别失败: {e}")
         return (None, str(e))
 
-def handle_ocr_result(future, event_data, group_obj, automaton):
+def handle_ocr_result(ocr_text, error, event_data, group_record, matcher):
+    """
+    OCR结果回调函数（OCR工作池处理完成、丢弃或过期时调用）
+    识别结果写入缓存；识别期间引用同一图片的其他消息在这里一并匹配
+    """
+    global ocr_pending
+    with ocr_lock:
+        ocr_pending -= 1
+        waiters = ocr_inflight.pop(event_data['photo_id'], [])
+    release_ocr_bytes(event_data['photo_size'])
+
+    if error:
+        skipped = f"，{len(waiters)} 条引用同一图片的消息一并跳过" if waiters else ""
+        ocr_logger.warning(f"[OCR异步] 处理失败，跳过: {error}{skipped}")
+        return
+
+    ocr_cache.put(event_data['photo_id'], ocr_text or "")
+    match_ocr_text(ocr_text, event_data, group_record, matcher)
+    for waiter in waiters:
+        match_ocr_text(ocr_text, *waiter)
+
+def match_ocr_text(ocr_text, event_data, group_record, matcher):
     """
-    OCR结果回调函数（在线程池完成后调用）
+    用图片识别出的文字匹配关键词（OCR完成或命中OCR缓存时调用）
     """
     try:
-        ocr_text, error = future.result()
-        
-        if error:
-            print(f"[OCR异步] 处理失败，跳过: {error}")
-            return
-        
         if not ocr_text or not ocr_text.strip():
-            print(f"[OCR异步] 未识别到文字")
+            ocr_logger.debug("[OCR异步] 未识别到文字")
             return
         
         # 组合消息文本
@@ -93,93 +425,219 @@ def handle_ocr_result(future, event_data, group_obj, automaton):
         else:
             message_text = f"[图片文字]: {ocr_text}".strip()
         
-        # 使用AC自动机匹配关键词
-        message_lower = message_text.lower()
-        matched_keyword_text = None
+        # 使用AC自动机匹配关键词（收集全部命中的关键词），与文本消息共用同一归一化流程
+        start = time.perf_counter()
+        normalized = normalize_message(message_text)
+        matches = matcher.find_all(normalized, group_record.id)
+        stage_seconds.observe(time.perf_counter() - start, 'ocr_match')
         
-        for end_index, keyword_text in automaton.iter(message_lower):
-            # automaton 现在返回字符串，不是对象
-            matched_keyword_text = keyword_text
-            break
-        
-        if matched_keyword_text:
-            print(f"[OCR异步] 在图片文字中找到关键词 '{matched_keyword_text}'")
+        if matches:
+            messages_matched.inc(1, 'ocr')
+            matched_keyword_text = ', '.join(matches)
+            ocr_logger.info(f"[OCR异步] 在图片文字中找到关键词 '{matched_keyword_text}'")
             
-            # 保存匹配结果
-            session = get_db_session()
-            try:
-                new_message = MatchedMessage(
-                    group_name=event_data['group_name'],
-                    message_content=message_text,
-                    sender=event_data['sender'],
-                    message_date=datetime.now(),
-                    matched_keyword=matched_keyword_text
+            # 保存匹配结果（交给后台批量写入线程）
+            message_writer.enqueue(make_matched_message(event_data['group_name'], message_text, event_data['sender'], matches, matcher.generation))
+            ocr_logger.debug("[OCR异步] 已提交保存: 群组 '%s' 关键词 '%s'", event_data['group_name'], matched_keyword_text)
+            
+            # WebSocket 实时推送
+            if websocket_broadcast_callback:
+                try:
+                    websocket_broadcast_callback({
+                        'group_name': event_data['group_name'],
+                        'sender': event_data['sender'] or 'N/A',
+                        'matched_keyword': matched_keyword_text,
+                        'message_content': message_text[:200] + '...' if len(message_text) > 200 else message_text,
+                        'message_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        'is_image': True,
+                        'keyword_generation': matcher.generation
+                    })
+                except Exception as e:
+                    websocket_logger.warning(f"[OCR异步] WebSocket推送失败: {e}")
+            
+            # 发送通知（使用缓存的配置快照，不查询数据库）
+            config = config_cache.get()
+            if config:
+                title = f"关键词 '{matched_keyword_text}' 触发"
+                notification_message = (
+                    f"#### **关键词监控提醒（图片识别）**\n\n"
+                    f"> **群组**: {event_data['group_name']}\n\n"
+                    f"> **发送人**: {event_data['sender'] or 'N/A'}\n\n"
+                    f"> **关键词**: {matched_keyword_text}\n\n"
+                    f"> **消息内容**: {message_text}\n"
                 )
-                session.add(new_message)
-                session.commit()
-                print(f"[OCR异步] 保存成功: 群组 '{event_data['group_name']}' 关键词 '{matched_keyword_text}'")
                 
-                # WebSocket 实时推送
-                if websocket_broadcast_callback:
-                    try:
-                        websocket_broadcast_callback({
-                            'group_name': event_data['group_name'],
-                            'sender': event_data['sender'] or 'N/A',
-                            'matched_keyword': matched_keyword_text,
-                            'message_content': message_text[:200] + '...' if len(message_text) > 200 else message_text,
-                            'message_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            'is_image': True
-                        })
-                    except Exception as e:
-                        print(f"[OCR异步] WebSocket推送失败: {e}")
-                
-                # 发送通知
-                config = session.query(Config).first()
-                if config:
-                    title = f"关键词 '{matched_keyword_text}' 触发"
-                    notification_message = (
-                        f"#### **关键词监控提醒（图片识别）**\n\n"
-                        f"> **群组**: {event_data['group_name']}\n\n"
-                        f"> **发送人**: {event_data['sender'] or 'N/A'}\n\n"
-                        f"> **关键词**: {matched_keyword_text}\n\n"
-                        f"> **消息内容**: {message_text}\n"
-                    )
-                    
-                    # 根据配置发送到不同的通知渠道
-                    if config.notification_type == 'dingtalk' and config.dingtalk_webhook:
-                        send_to_dingtalk(config.dingtalk_webhook, config.dingtalk_secret, title, notification_message)
-                    elif config.notification_type == 'wecom' and config.wecom_webhook:
-                        send_to_wecom(config.wecom_webhook, title, notification_message)
-            finally:
-                session.close()
+                alert = MatchAlert(matches, event_data['group_name'], event_data['sender'], message_text, True, title, notification_message,
+                                   event_data['event_time'])
+                dispatch_notification(config, alert, matcher.is_urgent(matches))
         else:
-            print(f"[OCR异步] 图片文字中未找到关键词")
+            ocr_logger.debug("[OCR异步] 图片文字中未找到关键词")
             
     except Exception as e:
-        print(f"[OCR异步] 回调处理失败: {e}")
+        ocr_logger.error(f"[OCR异步] 回调处理失败: {e}")
 
-def build_keyword_automaton(keywords):
+async def download_ocr_photo(message):
     """
-    为一组关键词构建Aho-Corasick自动机
-    性能优化: 将多个关键词编译成状态机,实现O(n)时间复杂度的多模式匹配
-    
-    Args:
-        keywords: 关键词对象列表
-    
-    Returns:
-        automaton: 构建好的AC自动机
+    按内存预算把图片下载到内存；超出预算或下载失败返回None
+    成功时已按实际大小占用预算，识别完成后由调用方释放
     """
-    automaton = ahocorasick.Automaton()
-    
-    for keyword in keywords:
-        # 将关键词的小写形式和文本字符串关联（不存储对象，避免会话分离）
-        keyword_text = keyword.text  # 立即提取字符串
-        automaton.add_word(keyword_text.lower(), keyword_text)
-    
-    # 构建失败指针,完成自动机
-    automaton.make_automaton()
-    
-    return automaton
+    # 按Telegram给出的图片大小预留内存预算，下载后按实际大小修正
+    thumb, thumb_size = select_ocr_photo_size(message.photo)
+    reserved = thumb_size or message.file.size or 0
+    if not reserve_ocr_bytes(reserved):
+        ocr_logger.warning(f"[OCR异步] 待处理图片已占用 {ocr_buffered_bytes} 字节，超出内存预算，跳过本张图片")
+        return None
+
+    photo_bytes = None
+    try:
+        stage_start = time.perf_counter()
+        photo_bytes = await message.download_media(file=bytes, thumb=thumb)
+        stage_seconds.observe(time.perf_counter() - stage_start, 'ocr_download')
+    except Exception as e:
+        ocr_logger.warning(f"[OCR异步] 下载图片失败: {e}")
+    release_ocr_bytes(reserved - len(photo_bytes or b''))
+    return photo_bytes or None
+
+class AlbumBatch:
+    """
+    正在收集的相册: 第一张图片的事件数据（说明文字合并各张图片的文字）及各张图片消息
+    """
+    __slots__ = ('event_data', 'group_record', 'matcher', 'messages', 'handle')
+
+    def __init__(self, event_data, group_record, matcher):
+        self.event_data = event_data
+        self.group_record = group_record
+        self.matcher = matcher
+        self.messages = []
+        self.handle = None
+
+class AlbumOcr:
+    """
+    正在识别的相册: 各张图片的识别文本（按相册顺序）及尚未完成的图片数，最后一张完成时合并匹配
+    """
+    __slots__ = ('batch', 'texts', 'owned', 'remaining')
+
+    def __init__(self, batch, texts, owned, remaining):
+        self.batch = batch
+        self.texts = texts
+        self.owned = owned  # 由本相册登记在 ocr_inflight 中的 photo_id
+        self.remaining = remaining  # 受 ocr_lock 保护
+
+def add_album_part(key, message, event_data, group_record, matcher):
+    """
+    相册中的一张图片到达（在事件循环中调用）: 第一张图片启动收集窗口，收满 ALBUM_MAX_PARTS 张立即提交
+    """
+    batch = album_batches.get(key)
+    if batch is None:
+        batch = album_batches[key] = AlbumBatch(event_data, group_record, matcher)
+        batch.handle = asyncio.get_running_loop().call_later(
+            ALBUM_WINDOW, lambda: asyncio.ensure_future(flush_album(key)))
+    else:
+        # 相册说明文字通常只在其中一张图片上
+        caption = event_data['original_text']
+        if caption and caption not in batch.event_data['original_text']:
+            batch.event_data['original_text'] = '\n'.join(filter(None, (batch.event_data['original_text'], caption)))
+        if event_data['event_time'] is not None:
+            batch.event_data['event_time'] = min(filter(None, (batch.event_data['event_time'], event_data['event_time'])))
+    batch.messages.append(message)
+    if len(batch.messages) >= ALBUM_MAX_PARTS:
+        batch.handle.cancel()
+        asyncio.ensure_future(flush_album(key))
+
+async def flush_album(key):
+    """
+    收集窗口结束: 命中识别缓存的图片直接取文字，其余图片并发下载后各自提交到OCR工作池
+    """
+    global ocr_pending, albums_submitted, album_photos
+    batch = album_batches.pop(key, None)
+    if batch is None:
+        return
+    messages = sorted(batch.messages, key=lambda m: m.id)
+    texts = [ocr_cache.get(message.photo.id) for message in messages]
+    pending = [i for i, text in enumerate(texts) if text is None]
+
+    # 登记正在识别的图片，识别期间引用同一图片的单张消息等待结果，不重复下载
+    owned = set()
+    with ocr_lock:
+        albums_submitted += 1
+        album_photos += len(messages)
+        for i in pending:
+            photo_id = messages[i].photo.id
+            if photo_id not in ocr_inflight:
+                ocr_inflight[photo_id] = []
+                owned.add(photo_id)
+
+    downloads = await asyncio.gather(*(download_ocr_photo(messages[i]) for i in pending))
+    parts = []  # [(相册中的序号, photo_id, 图片数据)]
+    for i, photo_bytes in zip(pending, downloads):
+        photo_id = messages[i].photo.id
+        if not photo_bytes:
+            if photo_id in owned:
+                owned.discard(photo_id)
+                abandon_ocr(photo_id)
+            continue
+        parts.append((i, photo_id, photo_bytes))
+
+    ocr_logger.debug("[OCR异步] 相册 %s 共 %d 张图片，%d 张命中识别缓存，提交 %d 张",
+                     key[1], len(messages), len(messages) - len(pending), len(parts))
+    if not parts:
+        match_album_text(texts, batch)
+        return
+    # 性能优化: 每张图片是独立的OCR任务，由多个分发线程并行识别，不让一个线程逐张处理整个相册
+    album = AlbumOcr(batch, texts, owned, len(parts))
+    with ocr_lock:
+        ocr_pending += len(parts)
+    for i, photo_id, photo_bytes in parts:
+        ocr_pool.submit(
+            process_ocr_sync, (photo_bytes,),
+            lambda ocr_text, error, part=(i, photo_id, len(photo_bytes)): handle_album_part_result(ocr_text, error, part, album)
+        )
+
+def handle_album_part_result(ocr_text, error, part, album):
+    """
+    相册中一张图片的OCR结果回调: 文字写入缓存（并交给等待它的单张消息），最后一张完成时合并匹配一次
+    """
+    global ocr_pending
+    i, photo_id, size = part
+    release_ocr_bytes(size)
+    if error:
+        with ocr_lock:
+            waiters = ocr_inflight.pop(photo_id, []) if photo_id in album.owned else []
+        skipped = f"，{len(waiters)} 条引用同一图片的消息一并跳过" if waiters else ""
+        ocr_logger.warning(f"[OCR异步] 相册图片处理失败，跳过: {error}{skipped}")
+    else:
+        # 先写入文本再计数，保证最后一张完成时其余图片的文字都已就绪
+        album.texts[i] = ocr_text
+        ocr_cache.put(photo_id, ocr_text or "")
+        with ocr_lock:
+            waiters = ocr_inflight.pop(photo_id, []) if photo_id in album.owned else []
+        for waiter in waiters:
+            match_ocr_text(ocr_text, *waiter)
+
+    with ocr_lock:
+        ocr_pending -= 1
+        album.remaining -= 1
+        done = album.remaining == 0
+    if done:
+        match_album_text(album.texts, album.batch)
+
+def match_album_text(texts, batch):
+    ocr_text = '\n'.join(text.strip() for text in texts if text and text.strip())
+    match_ocr_text(ocr_text, batch.event_data, batch.group_record, batch.matcher)
+
+def dispatch_notification(config, alert, urgent=False):
+    """
+    根据配置发送通知（不阻塞调用方）
+    配置了汇总窗口时，非紧急关键词的命中先合并，窗口结束后发送一条汇总
+    """
+    window = config.notification_digest_window or 0
+    group_by = config.notification_digest_group_by or 'keyword'
+    if config.notification_type == 'dingtalk' and config.dingtalk_webhook:
+        notification_coalescer.add('dingtalk', config.dingtalk_webhook, alert, secret=config.dingtalk_secret,
+                                   window=window, group_by=group_by, urgent=urgent)
+    elif config.notification_type == 'wecom' and config.wecom_webhook:
+        notification_coalescer.add('wecom', config.wecom_webhook, alert,
+                                   window=window, group_by=group_by, urgent=urgent)
 
 def is_safe_url(url):
     try:
@@ -197,23 +655,16 @@ def is_safe_url(url):
 def send_to_dingtalk(webhook_url, secret, title, message, is_test=False):
     if not webhook_url:
         if is_test: return "钉钉Webhook未配置。"
-        print("钉钉Webhook未配置，跳过发送。")
+        notify_logger.warning("钉钉Webhook未配置，跳过发送。")
         return
     
     if not is_safe_url(webhook_url):
         error_msg = f"检测到不安全的Webhook URL: {webhook_url}"
-        print(error_msg)
+        notify_logger.warning(error_msg)
         if is_test: return error_msg
         return
 
-    if secret:
-        timestamp = str(round(time.time() * 1000))
-        secret_enc = secret.encode('utf-8')
-        string_to_sign = '{}\n{}'.format(timestamp, secret)
-        string_to_sign_enc = string_to_sign.encode('utf-8')
-        hmac_code = hmac.new(secret_enc, string_to_sign_enc, digestmod=hashlib.sha256).digest()
-        sign = urllib.parse.quote_plus(base64.b64encode(hmac_code))
-        webhook_url = f"{webhook_url}&timestamp={timestamp}&sign={sign}"
+    webhook_url = sign_dingtalk_url(webhook_url, secret)
 
     headers = {'Content-Type': 'application/json;charset=utf-8'}
     data = {
@@ -224,15 +675,15 @@ def send_to_dingtalk(webhook_url, secret, title, message, is_test=False):
         }
     }
     try:
-        response = requests.post(webhook_url, headers=headers, json=data)
+        response = requests.post(webhook_url, headers=headers, json=data, timeout=5)
         if response.status_code == 200 and response.json().get("errcode") == 0:
-            print("成功发送钉钉通知。" )
+            notify_logger.info("成功发送钉钉通知。")
             if is_test: return "测试消息发送成功！"
         else:
-            print(f"发送钉钉通知失败: {response.text}")
+            notify_logger.error(f"发送钉钉通知失败: {response.text}")
             if is_test: return f"发送失败: {response.text}"
     except Exception as e:
-        print(f"发送钉钉通知时发生异常: {e}")
+        notify_logger.error(f"发送钉钉通知时发生异常: {e}")
         if is_test: return f"发生异常: {e}"
 
 def send_to_wecom(webhook_url, title, message, is_test=False):
@@ -251,7 +702,7 @@ def send_to_wecom(webhook_url, title, message, is_test=False):
     if not webhook_url:
         if is_test:
             return "企业微信Webhook未配置。"
-        print("企业微信Webhook未配置，跳过发送。" )
+        notify_logger.warning("企业微信Webhook未配置，跳过发送。")
         return
     
     # 安全检查：验证URL格式
@@ -259,7 +710,7 @@ def send_to_wecom(webhook_url, title, message, is_test=False):
         parsed_url = urlparse(webhook_url)
         if parsed_url.scheme not in ['http', 'https']:
             error_msg = "企业微信Webhook URL协议不正确（必须是http/https）"
-            print(error_msg)
+            notify_logger.warning(error_msg)
             if is_test:
                 return error_msg
             return
@@ -267,13 +718,13 @@ def send_to_wecom(webhook_url, title, message, is_test=False):
         allowed_domains = ['qyapi.weixin.qq.com']
         if parsed_url.netloc not in allowed_domains:
             error_msg = f"检测到不安全的Webhook URL: {webhook_url}"
-            print(error_msg)
+            notify_logger.warning(error_msg)
             if is_test:
                 return error_msg
             return
     except Exception as e:
         error_msg = f"Webhook URL格式错误: {e}"
-        print(error_msg)
+        notify_logger.warning(error_msg)
         if is_test:
             return error_msg
         return
@@ -292,21 +743,21 @@ def send_to_wecom(webhook_url, title, message, is_test=False):
         if response.status_code == 200:
             result = response.json()
             if result.get("errcode") == 0:
-                print("成功发送企业微信通知。" )
+                notify_logger.info("成功发送企业微信通知。")
                 if is_test:
                     return "测试消息发送成功！"
             else:
                 error_msg = f"发送失败: {result.get('errmsg', '未知错误')}"
-                print(f"发送企业微信通知失败: {error_msg}")
+                notify_logger.error(f"发送企业微信通知失败: {error_msg}")
                 if is_test:
                     return error_msg
         else:
             error_msg = f"HTTP状态码: {response.status_code}"
-            print(f"发送企业微信通知失败: {error_msg}")
+            notify_logger.error(f"发送企业微信通知失败: {error_msg}")
             if is_test:
                 return f"发送失败: {error_msg}"
     except Exception as e:
-        print(f"发送企业微信通知时发生异常: {e}")
+        notify_logger.error(f"发送企业微信通知时发生异常: {e}")
         if is_test:
             return f"发生异常: {e}"
 
@@ -316,161 +767,175 @@ async def start_client_async(api_id, api_hash, phone_number):
     client = TelegramClient('telegram_session', api_id, api_hash, system_version="4.16.30-vxCUSTOM")
     client_instance = client
         
-    @client.on(events.NewMessage)
+    # 性能优化: 注册时带上过滤器，按当前监控群组集合过滤（群组增删实时生效）
+    @client.on(events.NewMessage(func=accept_chat_event))
     async def handler(event):
-        chat = await event.get_chat()
-        print(f"[调试] 收到新消息, 来自群组: '{getattr(chat, 'title', '未知群组')}' (ID: {chat.id})")
+        global ocr_pending, ocr_joined
+        # 监控指标: 各阶段用 perf_counter 手动计时（每条消息开销在几微秒以内）
+        messages_seen.inc()
+        stage_start = time.perf_counter()
+        # 性能优化: 先查实体缓存，命中时不再调用 get_chat()
+        chat = chat_cache.get(event.chat_id)
+        if chat is MISSING:
+            chat = make_chat_info(await event.get_chat())
+            chat_cache.put(event.chat_id, chat)
+        stage_end = time.perf_counter()
+        stage_seconds.observe(stage_end - stage_start, 'get_chat')
+        # 逐条消息的调试日志使用 % 参数延迟格式化，未开启DEBUG时几乎没有开销
+        debug_sampled(message_logger, 'message_received', "[调试] 收到新消息, 来自群组: '%s' (ID: %s)", chat.title or '未知群组', chat.id)
 
-        session_handler = get_db_session() 
-        try:
-            sender = await event.get_sender()
-
-            group_name = getattr(chat, 'title', '未知群组')
-            sender_name = None 
-            if sender:
-                sender_name = getattr(sender, 'username', None)
-                if not sender_name: 
-                    first_name = getattr(sender, 'first_name', '') or ''
-                    last_name = getattr(sender, 'last_name', '') or ''
-                    sender_name = f"{first_name} {last_name}".strip()
-            
-            if sender_name is None and hasattr(chat, 'title'):
-                sender_name = chat.title
+        # 性能优化: 查内存索引判断是否为监控群组，未监控的群组不访问数据库
+        current_group = find_monitored_group(chat)
+        if current_group is None:
+            message_logger.debug("[调试] 群组 '%s' (ID: %s) 不在监控列表中，已忽略。", chat.title or '未知', chat.id)
+            return
 
-            standard_chat_id = str(chat.id)
-            if standard_chat_id.startswith('-100'):
-                standard_chat_id = standard_chat_id[4:]
-            
-            all_monitored_ids = [g.group_identifier for g in session_handler.query(MonitoredGroup).all()]
-            
-            standard_monitored_ids = []
-            for mid in all_monitored_ids:
-                if mid.startswith('-100'):
-                    standard_monitored_ids.append(mid[4:])
-                else:
-                    standard_monitored_ids.append(mid)
+        group_name = chat.title or '未知群组'
+        stage_start = time.perf_counter()
+        sender_name = sender_cache.get(event.sender_id) if event.sender_id is not None else MISSING
+        if sender_name is MISSING:
+            sender_name = format_sender_name(await event.get_sender())
+            if event.sender_id is not None:
+                sender_cache.put(event.sender_id, sender_name)
+        stage_end = time.perf_counter()
+        stage_seconds.observe(stage_end - stage_start, 'get_sender')
+        
+        if sender_name is None and chat.title is not None:
+            sender_name = chat.title
+
+        # 性能优化: 使用全局AC自动机进行高效匹配，按群组关键词位图过滤
+        matcher = get_keyword_matcher()
+        keyword_count = matcher.group_keyword_count(current_group.id) if matcher else 0
+        if not keyword_count:
+            message_logger.debug("[调试] 注意: 群组 '%s' 没有配置任何关键词。", group_name)
+            return
+
+        message_logger.debug("[调试] 群组 '%s' 在监控列表中，配置了 %d 个关键词，开始检查...", group_name, keyword_count)
 
-            current_group_obj = None
+        # 获取要匹配的文本内容
+        message_text = event.message.message or ""
+        event_time = event.message.date.timestamp() if event.message.date else None
+        
+        # 先处理文本消息（不阻塞），归一化一次后一次扫描收集全部命中的关键词
+        # 命中位置换算回原文，用于高亮
+        stage_start = time.perf_counter()
+        normalized = normalize_message(message_text)
+        matches = matcher.find_all(normalized, current_group.id)
+        stage_end = time.perf_counter()
+        stage_seconds.observe(stage_end - stage_start, 'match')
+        
+        if matches:
+            messages_matched.inc(1, 'text')
+            matched_keyword_text = ', '.join(matches)
+            # 性能优化: 只入队，由后台线程批量写入数据库
+            stage_start = time.perf_counter()
+            message_writer.enqueue(make_matched_message(group_name, message_text, sender_name, matches, matcher.generation))
+            stage_seconds.observe(time.perf_counter() - stage_start, 'enqueue')
+            message_logger.info(f"在群组 '{group_name}' 中匹配到关键词 '{matched_keyword_text}'（匹配器第 {matcher.generation} 代）")
             
-            if standard_chat_id in standard_monitored_ids:
-                original_id = None
-                for mid in all_monitored_ids:
-                    if mid.endswith(standard_chat_id):
-                        original_id = mid
-                        break
-                if original_id:
-                    current_group_obj = session_handler.query(MonitoredGroup).filter_by(group_identifier=original_id).first()
-
-            if not current_group_obj and hasattr(chat, 'username') and chat.username in all_monitored_ids:
-                current_group_obj = session_handler.query(MonitoredGroup).filter_by(group_identifier=chat.username).first()
-
-
-            if current_group_obj:
-                print(f"[调试] 群组 '{getattr(chat, 'title', '未知')}' 在监控列表中。开始检查关键词...")
-                keywords_to_check = current_group_obj.keywords
+            # WebSocket 实时推送
+            if websocket_broadcast_callback:
+                try:
+                    websocket_broadcast_callback({
+                        'group_name': group_name,
+                        'sender': sender_name or 'N/A',
+                        'matched_keyword': matched_keyword_text,
+                        'message_content': message_text[:200] + '...' if len(message_text) > 200 else message_text,
+                        'message_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        'is_image': False,
+                        'keyword_generation': matcher.generation
+                    })
+                except Exception as e:
+                    websocket_logger.warning(f"[WebSocket] 推送失败: {e}")
+
+            # 性能优化: 使用缓存的配置快照，不再每次匹配都查询 Config 表
+            stage_start = time.perf_counter()
+            config = config_cache.get()
+            if config:
+                title = f"关键词 '{matched_keyword_text}' 触发"
+                notification_message = (
+                    f"#### **关键词监控提醒**\n\n"
+                    f"> **群组**: {group_name}\n\n"
+                    f"> **发送人**: {sender_name or 'N/A'}\n\n"
+                    f"> **关键词**: {matched_keyword_text}\n\n"
+                    f"> **消息内容**: {message_text}\n"
+                )
                 
-                if not keywords_to_check:
-                    print(f"[调试] 注意: 群组 '{getattr(chat, 'title', '未知')}' 没有配置任何关键词。" )
+                alert = MatchAlert(matches, group_name, sender_name, message_text, False, title, notification_message, event_time)
+                dispatch_notification(config, alert, matcher.is_urgent(matches))
+            stage_seconds.observe(time.perf_counter() - stage_start, 'notify')
+        else:
+            debug_sampled(message_logger, 'message_unmatched', "[调试] 群组 '%s' 的消息未命中关键词", group_name)
+        
+        # OCR异步处理: 如果消息包含图片，提交到OCR工作池处理（不阻塞）
+        if event.message.photo:
+            photo_id = event.message.photo.id
+            # 准备事件数据
+            event_data = {
+                'group_name': group_name,
+                'sender': sender_name,
+                'original_text': message_text,
+                'event_time': event_time,
+                'photo_id': photo_id,
+                'photo_size': 0
+            }
+
+            # 相册: 收集同一 grouped_id 的图片后合并识别、只匹配一次
+            if event.message.grouped_id:
+                add_album_part((event.chat_id, event.message.grouped_id), event.message, event_data, current_group, matcher)
+                return
+
+            # 性能优化: 同一张图片已识别过（被转发到多个群组）时直接匹配缓存的文字，不再下载和OCR
+            cached_text = ocr_cache.get(photo_id)
+            if cached_text is not None:
+                ocr_logger.debug("[OCR异步] 图片 %s 命中识别缓存", photo_id)
+                match_ocr_text(cached_text, event_data, current_group, matcher)
+                return
+
+            # 同一张图片正在识别中: 等识别完成后一并匹配，不重复下载
+            with ocr_lock:
+                waiters = ocr_inflight.get(photo_id)
+                if waiters is None:
+                    ocr_inflight[photo_id] = []
                 else:
-                    keyword_texts = [k.text for k in keywords_to_check]
-                    print(f"[调试] 为该群组配置的关键词: {keyword_texts}")
-
-                    # 获取要匹配的文本内容
-                    message_text = event.message.message or ""
-                    
-                    # 性能优化: 使用AC自动机进行高效匹配
-                    # 获取或构建该群组的自动机（带缓存）
-                    with automatons_lock:
-                        if current_group_obj.id not in keyword_automatons:
-                            print(f"[性能优化] 首次为群组 '{group_name}' 构建AC自动机...")
-                            keyword_automatons[current_group_obj.id] = build_keyword_automaton(keywords_to_check)
-                        
-                        automaton = keyword_automatons[current_group_obj.id]
-                    
-                    # 先处理文本消息（不阻塞）
-                    message_lower = message_text.lower()
-                    matched_keyword_text = None
-                    
-                    for end_index, keyword_text in automaton.iter(message_lower):
-                        # automaton 现在返回字符串，不是对象
-                        matched_keyword_text = keyword_text
-                        break
-                    
-                    if matched_keyword_text:
-                        print(f"[调试] 成功! 在消息中找到关键词 '{matched_keyword_text}'。" )
-                        new_message = MatchedMessage(
-                            group_name=group_name,
-                            message_content=message_text,
-                            sender=sender_name,
-                            message_date=datetime.now(),
-                            matched_keyword=matched_keyword_text
-                        )
-                        session_handler.add(new_message)
-                        session_handler.commit()
-                        print(f"在群组 '{group_name}' 中匹配到关键词 '{matched_keyword_text}'")
-                        
-                        # WebSocket 实时推送
-                        if websocket_broadcast_callback:
-                            try:
-                                websocket_broadcast_callback({
-                                    'group_name': group_name,
-                                    'sender': sender_name or 'N/A',
-                                    'matched_keyword': matched_keyword_text,
-                                    'message_content': message_text[:200] + '...' if len(message_text) > 200 else message_text,
-                                    'message_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                                    'is_image': False
-                                })
-                            except Exception as e:
-                                print(f"[WebSocket] 推送失败: {e}")
-
-                        config = session_handler.query(Config).first()
-                        if config:
-                            title = f"关键词 '{matched_keyword_text}' 触发"
-                            notification_message = (
-                                f"#### **关键词监控提醒**\n\n"
-                                f"> **群组**: {group_name}\n\n"
-                                f"> **发送人**: {sender_name or 'N/A'}\n\n"
-                                f"> **关键词**: {matched_keyword_text}\n\n"
-                                f"> **消息内容**: {message_text}\n"
-                            )
-                            
-                            # 根据配置发送到不同的通知渠道
-                            if config.notification_type == 'dingtalk' and config.dingtalk_webhook:
-                                send_to_dingtalk(config.dingtalk_webhook, config.dingtalk_secret, title, notification_message)
-                            elif config.notification_type == 'wecom' and config.wecom_webhook:
-                                send_to_wecom(config.wecom_webhook, title, notification_message)
-                    
-                    # OCR异步处理: 如果消息包含图片，提交到线程池处理（不阻塞）
-                    if event.message.photo:
-                        print(f"[OCR异步] 检测到图片消息，提交到线程池处理...")
-                        try:
-                            # 下载图片（这是异步操作，但下载必须在这里完成）
-                            photo_path = await event.message.download_media()
-                            if photo_path:
-                                # 准备事件数据
-                                event_data = {
-                                    'group_name': group_name,
-                                    'sender': sender_name,
-                                    'original_text': message_text
-                                }
-                                
-                                # 提交到线程池进行OCR处理（不阻塞主流程）
-                                future = ocr_executor.submit(process_ocr_sync, photo_path)
-                                # 添加回调函数
-                                future.add_done_callback(
-                                    lambda f: handle_ocr_result(f, event_data, current_group_obj, automaton)
-                                )
-                                print(f"[OCR异步] 图片已提交到线程池，继续处理下一条消息...")
-                        except Exception as e:
-                            print(f"[OCR异步] 下载图片失败: {e}")
+                    waiters.append((event_data, current_group, matcher))
+                    ocr_joined += 1
+            if waiters is not None:
+                ocr_logger.debug("[OCR异步] 图片 %s 正在识别中，完成后一并匹配", photo_id)
+                return
+
+            ocr_logger.debug("[OCR异步] 检测到图片消息，下载后提交到OCR工作池...")
+            # 下载图片到内存（这是异步操作，但下载必须在这里完成）
+            photo_bytes = await download_ocr_photo(event.message)
+            if not photo_bytes:
+                abandon_ocr(photo_id)
             else:
-                print(f"[调试] 群组 '{getattr(chat, 'title', '未知')}' (ID: {chat.id}) 不在监控列表中，已忽略。" )
-        finally:
-            session_handler.close() 
+                event_data['photo_size'] = len(photo_bytes)
+                # 提交到OCR工作池（有界队列，立即返回，不阻塞主流程）
+                with ocr_lock:
+                    ocr_pending += 1
+                ocr_pool.submit(
+                    process_ocr_sync, (photo_bytes,),
+                    lambda ocr_text, error: handle_ocr_result(ocr_text, error, event_data, current_group, matcher)
+                )
+                ocr_logger.debug("[OCR异步] 图片已提交到OCR工作池，继续处理下一条消息...")
+
+    # 实体缓存失效: 发送人改名/改用户名、群组改标题或频道信息变更时丢弃对应缓存
+    @client.on(events.Raw(types=types.UpdateUserName))
+    async def user_name_handler(update):
+        sender_cache.invalidate(update.user_id)
+
+    @client.on(events.Raw(types=types.UpdateChannel))
+    async def channel_update_handler(update):
+        chat_cache.invalidate(utils.get_peer_id(types.PeerChannel(update.channel_id)))
+
+    @client.on(events.ChatAction(func=lambda e: e.new_title is not None))
+    async def chat_title_handler(event):
+        chat_cache.invalidate(event.chat_id)
 
     while not stop_event.is_set():
         try:
-            print("正在尝试连接到Telegram...")
+            logger.info("正在尝试连接到Telegram...")
             await client.connect()
             if not await client.is_user_authorized():
                 await client.send_code_request(phone_number)
@@ -480,28 +945,30 @@ async def start_client_async(api_id, api_hash, phone_number):
                     await client.sign_in(password=input('请输入两步验证密码: '))
 
             is_running = True
-            print("Telegram客户端已成功连接并开始监听...")
+            logger.info("Telegram客户端已成功连接并开始监听...")
             client_ready.set()
+            if unresolved_usernames:
+                asyncio.ensure_future(resolve_pending_usernames(client))
             
             await client.run_until_disconnected()
 
         except ConnectionError:
-            print("与Telegram的连接丢失。将在60秒后尝试重新连接...")
+            logger.warning("与Telegram的连接丢失。将在60秒后尝试重新连接...")
         
         except Exception as e:
-            print(f"监控时发生未知错误: {e}。将在60秒后尝试重新连接...")
+            logger.error(f"监控时发生未知错误: {e}。将在60秒后尝试重新连接...")
 
         finally:
             is_running = False
             client_ready.clear()
             if client.is_connected():
                 await client.disconnect()
-            print("客户端连接已断开。" )
+            logger.info("客户端连接已断开。")
 
             if not stop_event.is_set():
                 await asyncio.sleep(60)
     
-    print("监控线程已正常停止。" )
+    logger.info("监控线程已正常停止。")
 
 def run_in_thread(loop, coro):
     global main_loop
@@ -509,46 +976,52 @@ def run_in_thread(loop, coro):
     asyncio.set_event_loop(loop)
     loop.run_until_complete(coro)
 
-<<<<<<< Updated upstream
 def logo_update_scheduler():
     global logo_updater_running
-    print("Logo update scheduler started.")
+    logger.info("Logo update scheduler started.")
     while logo_updater_running:
         client_ready.wait(timeout=60) 
         if not logo_updater_running:
             break
         
         if client_instance and is_running:
-            print("Running logo update...")
+            logger.info("Running logo update...")
             coro = telegram_utils.update_group_logos_async()
             future = asyncio.run_coroutine_threadsafe(coro, main_loop)
             try:
                 future.result(timeout=300) # 5 minutes timeout
             except Exception as e:
-                print(f"An error occurred during logo update: {e}")
+                logger.error(f"An error occurred during logo update: {e}")
         else:
-            print("Client not ready, skipping logo update cycle.")
+            logger.info("Client not ready, skipping logo update cycle.")
         
         time.sleep(3600) # 1 hour
-    print("Logo update scheduler stopped.")
+    logger.info("Logo update scheduler stopped.")
 
-=======
->>>>>>> Stashed changes
 def start_monitoring():
     global client_thread, is_running, main_loop, logo_update_thread, logo_updater_running
     
     if client_thread and client_thread.is_alive():
-        print("监控已经在运行中。" )
+        logger.info("监控已经在运行中。")
         return
     
     stop_event.clear() #  <-- 新增: 重置停止事件
     client_ready.clear() 
-    session = get_db_session()
-    config = session.query(Config).first()
-    session.close()
+    # 启动时强制重新加载配置
+    config = config_cache.reload()
 
     if not (config and config.api_id and config.api_hash and config.phone_number):
         return
+
+    # 性能优化: 启动时一次性加载监控群组索引
+    load_group_index()
+    ocr_cache.open()
+    ocr_pool.start()
+    # 启动阶段构建（或沿用已发布的）匹配器，之后关键词变更由后台线程重建
+    keyword_matcher_store.start()
+    config_cache.start()
+    message_writer.start()
+    notification_dispatcher.start()
     
     loop = asyncio.new_event_loop()
     main_loop = loop
@@ -569,14 +1042,11 @@ def stop_monitoring():
     if not (client_thread and client_thread.is_alive()):
         return
 
-<<<<<<< Updated upstream
     logo_updater_running = False
     if logo_update_thread and logo_update_thread.is_alive():
         logo_update_thread.join(timeout=5)
     logo_update_thread = None
-=======
     stop_event.set() #  <-- 新增: 设置停止事件
->>>>>>> Stashed changes
 
     if main_loop and main_loop.is_running():
         main_loop.call_soon_threadsafe(
@@ -584,6 +1054,16 @@ def stop_monitoring():
         )
     
     client_thread.join(timeout=5)
+
+    # 先停止OCR工作池（正在识别的图片处理完），再把批量写入队列中尚未落库的匹配消息全部写入，并尽量发完待发通知
+    ocr_pool.stop()
+    keyword_matcher_store.stop()
+    config_cache.stop()
+    message_writer.stop()
+    notification_coalescer.stop()
+    notification_dispatcher.stop()
+    ocr_cache.close()
+    album_batches.clear()
     
     is_running = False
     main_loop = None
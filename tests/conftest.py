@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 与 benchmarks 相同: 直接从仓库根目录导入各模块
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import telegram_monitor as monitor
+from ocr_cache import OcrResultCache
+
+
+class FakePool:
+    """
+    记录提交的OCR任务，由测试决定各任务的完成顺序和结果
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, args, callback):
+        self.jobs.append((args[0], callback))
+        return True
+
+
+def make_photo(photo_id, message_id):
+    return SimpleNamespace(id=message_id, photo=SimpleNamespace(id=photo_id))
+
+
+@pytest.fixture
+def album(monkeypatch):
+    pool = FakePool()
+    matched = []
+    cache = OcrResultCache(db_path=None)
+
+    async def download(message):
+        return f"image-{message.photo.id}".encode()
+
+    monkeypatch.setattr(monitor, 'ocr_pool', pool)
+    monkeypatch.setattr(monitor, 'ocr_cache', cache)
+    monkeypatch.setattr(monitor, 'download_ocr_photo', download)
+    monkeypatch.setattr(monitor, 'release_ocr_bytes', lambda size: None)
+    monkeypatch.setattr(monitor, 'match_ocr_text', lambda text, event_data, *_: matched.append(text))
+
+    def flush(*messages):
+        batch = monitor.AlbumBatch({'original_text': ''}, None, None)
+        batch.messages.extend(messages)
+        monitor.album_batches['album'] = batch
+        asyncio.run(monitor.flush_album('album'))
+
+    return SimpleNamespace(pool=pool, matched=matched, cache=cache, flush=flush)
+
+
+def test_album_parts_are_separate_jobs_matched_once(album):
+    album.flush(make_photo(101, 3), make_photo(102, 1), make_photo(103, 2))
+    assert len(album.pool.jobs) == 3
+
+    # 各分发线程并行完成，完成顺序与相册顺序无关
+    results = {b'image-101': '第三张', b'image-102': '第一张', b'image-103': '第二张'}
+    threads = [threading.Thread(target=callback, args=(results[photo_bytes], None))
+               for photo_bytes, callback in reversed(album.pool.jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert album.matched == ['第一张\n第二张\n第三张']
+    assert album.cache.get(102) == '第一张'
+    assert monitor.ocr_pending == 0
+
+
+def test_album_skips_cached_and_failed_parts(album):
+    album.cache.put(201, '缓存')
+    album.flush(make_photo(201, 1), make_photo(202, 2), make_photo(203, 3))
+    assert [photo_bytes for photo_bytes, _ in album.pool.jobs] == [b'image-202', b'image-203']
+
+    (_, first), (_, second) = album.pool.jobs
+    first(None, '识别超时')
+    assert album.matched == []
+    second('识别', None)
+    assert album.matched == ['缓存\n识别']
+    assert monitor.ocr_pending == 0
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import config_cache as config_module
+from config_cache import ConfigCache
+from database import Config
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'config.db'}")
+    Config.__table__.create(engine)
+    factory = sessionmaker(bind=engine)
+    calls = []
+
+    def get_session():
+        calls.append(time.monotonic())
+        return factory()
+
+    monkeypatch.setattr(config_module, 'get_session', get_session)
+    session = factory()
+    session.add(Config(id=1, notification_type='dingtalk', version=1))
+    session.commit()
+    session.close()
+    return factory, calls
+
+
+def test_get_reads_memory_after_first_load(sessions):
+    _, calls = sessions
+    cache = ConfigCache(check_interval=0)
+    assert cache.get().notification_type == 'dingtalk'
+    for _ in range(100):
+        cache.get()
+    assert len(calls) == 1
+
+
+def test_poller_picks_up_other_process_changes(sessions):
+    factory, _ = sessions
+    cache = ConfigCache(check_interval=0.05)
+    cache.get()
+    cache.start()
+    try:
+        session = factory()
+        config = session.query(Config).first()
+        config.notification_type, config.version = 'wecom', 2
+        session.commit()
+        session.close()
+
+        deadline = time.monotonic() + 5
+        while cache.get().notification_type != 'wecom' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert cache.get().version == 2
+    finally:
+        cache.stop()
+    assert not cache.get_stats()['running']
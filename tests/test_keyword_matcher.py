@@ -0,0 +1,125 @@
+from keyword_matcher import KeywordMatcher, extract_anchor
+from text_normalizer import normalize_message
+
+GROUP_ID = 1
+
+
+def make_matcher(*keywords):
+    """
+    keywords: (文本, 类型) 或 文本（普通关键词），全部关联到 GROUP_ID
+    """
+    rows, pattern_keywords = [], {}
+    for keyword_id, keyword in enumerate(keywords):
+        text, match_type = keyword if isinstance(keyword, tuple) else (keyword, 'literal')
+        rows.append((keyword_id, text))
+        if match_type != 'literal':
+            pattern_keywords[keyword_id] = (match_type, None)
+    pairs = [(GROUP_ID, keyword_id) for keyword_id, _ in rows]
+    return KeywordMatcher(rows, pairs, (), pattern_keywords)
+
+
+def find(matcher, text):
+    return matcher.find_all(normalize_message(text), GROUP_ID)
+
+
+def highlighted(text, matches):
+    return {keyword: [text[start:end] for start, end in spans] for keyword, spans in matches.items()}
+
+
+def test_literal_keyword_survives_obfuscation():
+    matcher = make_matcher('USDT')
+    text = '出 Ｕ.S D\u200bT 了'
+    assert highlighted(text, find(matcher, text)) == {'USDT': ['Ｕ.S D\u200bT']}
+
+
+def test_regex_with_decimal_point_matches_original_text():
+    matcher = make_matcher((r'\d+\.\d+', 'regex'))
+    text = '价格 3.14 元'
+    assert highlighted(text, find(matcher, text)) == {r'\d+\.\d+': ['3.14']}
+
+
+def test_regex_with_at_sign_matches_original_text():
+    matcher = make_matcher((r'@\w+', 'regex'))
+    text = '联系 @bob'
+    assert highlighted(text, find(matcher, text)) == {r'@\w+': ['@bob']}
+
+
+def test_regex_with_hyphen_uses_anchor_and_ignores_case():
+    matcher = make_matcher((r'USDT-\d+', 'regex'))
+    text = '收 usdt-100 个'
+    assert highlighted(text, find(matcher, text)) == {r'USDT-\d+': ['usdt-100']}
+    assert find(matcher, '收 usdt 100 个') == {}
+
+
+def test_wildcard_still_matches_normalized_text():
+    matcher = make_matcher(('兼职*日结', 'wildcard'))
+    text = '兼 职，今天日 结'
+    assert highlighted(text, find(matcher, text)) == {'兼职*日结': ['兼 职，今天日 结']}
+
+
+def test_overlapping_literal_and_regex_prefers_leftmost_longest():
+    matcher = make_matcher('代理', (r'招.{0,3}代理', 'regex'))
+    text = '招聘代理'
+    assert highlighted(text, find(matcher, text)) == {r'招.{0,3}代理': ['招聘代理']}
+
+
+def test_punctuation_keyword_matches_exactly():
+    matcher = make_matcher('C++')
+    assert find(matcher, 'visit http://x.com/abc') == {}
+    assert find(matcher, '加微信 abc') == {}
+    text = '招聘 c++ 工程师'
+    assert highlighted(text, find(matcher, text)) == {'C++': ['c++']}
+
+
+def test_keyword_normalizing_to_empty_still_matches():
+    matcher = make_matcher('!!!')
+    assert find(matcher, '重要!!!') == {'!!!': [(2, 5)]}
+    assert find(matcher, '重要!') == {}
+
+
+def test_extract_anchor_uses_longest_required_literal():
+    assert extract_anchor(r'USDT\s*\d+', 'regex') == 'usdt'
+    assert extract_anchor(r'(foo|bar)baz', 'regex') == 'baz'
+    assert extract_anchor(r'a?bc', 'regex') == 'bc'
+    assert extract_anchor(r'x{0}abc', 'regex') == 'abc'
+    assert extract_anchor(r'(?:ab)+c', 'regex') == 'ab'
+    assert extract_anchor('Ｕ*代理', 'wildcard') == '代理'
+
+
+def test_regex_without_anchor_runs_on_every_message():
+    assert extract_anchor(r'\d{6}', 'regex') == ''
+    matcher = make_matcher((r'\d{6}', 'regex'))
+    text = '验证码 123456'
+    assert highlighted(text, find(matcher, text)) == {r'\d{6}': ['123456']}
+
+
+def test_snapshot_rejected_when_normalizer_changes(tmp_path, monkeypatch):
+    import keyword_matcher
+
+    path = str(tmp_path / 'matcher.pkl')
+    keyword_matcher.save_matcher_snapshot(make_matcher('USDT'), path)
+    assert keyword_matcher.load_matcher_snapshot(path) is not None
+    monkeypatch.setattr(keyword_matcher, 'NORMALIZER_FINGERPRINT', 'changed')
+    assert keyword_matcher.load_matcher_snapshot(path) is None
+
+
+def test_keyword_set_hash_includes_normalizer(monkeypatch):
+    import keyword_matcher
+
+    rows, pairs = [(1, 'USDT', False, 'literal', None)], [(GROUP_ID, 1)]
+    before = keyword_matcher.keyword_set_hash(rows, pairs)
+    monkeypatch.setattr(keyword_matcher, 'NORMALIZER_FINGERPRINT', 'changed')
+    assert keyword_matcher.keyword_set_hash(rows, pairs) != before
+
+
+def test_punctuation_keyword_tolerates_spacing_and_folding():
+    matcher = make_matcher('C++')
+    for text, expected in (('学 Ｃ ＋＋ 编程', 'Ｃ ＋＋'), ('c\u200b++', 'c\u200b++')):
+        assert highlighted(text, find(matcher, text)) == {'C++': [expected]}
+    assert find(matcher, 'c-+') == {}
+
+
+def test_punctuation_keyword_folds_traditional_chinese():
+    matcher = make_matcher('臺灣.ok')
+    text = '来台灣.OK吗'
+    assert highlighted(text, find(matcher, text)) == {'臺灣.ok': ['台灣.OK']}
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import message_queries
+from database import MatchedMessage, MatchedMessageKeyword
+from migrations import route_queries
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    MatchedMessage.__table__.create(engine)
+    MatchedMessageKeyword.__table__.create(engine)
+    with Session(engine) as session:
+        for group_name, content, day in [('甲群', '出U 价格', 1), ('乙群', '收u', 2), ('甲群', '闲聊', 3)]:
+            session.add(MatchedMessage(group_name=group_name, message_content=content, sender='bob',
+                                       message_date=datetime(2026, 1, day), matched_keyword='U'))
+        session.commit()
+        yield session
+
+
+def test_messages_query_filters_and_orders(session):
+    contents = [m.message_content for m in message_queries.messages_query(session, keyword='U')]
+    assert contents == ['收u', '出U 价格']
+    rows = message_queries.messages_query(session, '甲群', datetime(2026, 1, 2), datetime(2026, 1, 3)).all()
+    assert [m.message_content for m in rows] == ['闲聊']
+    assert message_queries.count_messages_query(session, datetime(2026, 1, 2)).scalar() == 2
+
+
+def test_route_queries_compile_for_mysql():
+    routes = route_queries(datetime(2026, 1, 14, 12))
+    assert {route for route, *_ in routes} >= {'/api/dashboard/stats', '/messages', '/messages/export'}
+    for route, description, sql, params in routes:
+        assert sql.startswith('SELECT') and 'matched_message' in sql
+        # PyMySQL 按 %s 逐个代入参数
+        assert sql.count('%s') == len(params), (route, description)
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+
+import message_writer as writer_module
+from database import MatchedMessage, MatchedMessageKeyword
+from message_writer import MatchedMessageWriter
+
+
+class FlakySession(Session):
+    """
+    前 failures 次 commit 抛出连接类错误，模拟 MySQL 重启
+    """
+    failures = 0
+
+    def commit(self):
+        if FlakySession.failures:
+            FlakySession.failures -= 1
+            raise OperationalError('COMMIT', {}, Exception('MySQL server has gone away'))
+        super().commit()
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine('sqlite://')
+    MatchedMessage.__table__.create(engine)
+    MatchedMessageKeyword.__table__.create(engine)
+    factory = sessionmaker(bind=engine, class_=FlakySession)
+    FlakySession.failures = 0
+    monkeypatch.setattr(writer_module, 'get_session', factory)
+    monkeypatch.setattr(writer_module, 'RETRY_BACKOFF_INITIAL', 0.01)
+    return factory
+
+
+def make_message(content='出U'):
+    return MatchedMessage(group_name='测试群', message_content=content, sender='bob',
+                          message_date=datetime(2026, 1, 1), matched_keyword='U')
+
+
+def stored_count(factory):
+    session = factory()
+    try:
+        return session.query(MatchedMessage).count()
+    finally:
+        session.close()
+
+
+def test_transient_error_retries_whole_batch(session_factory):
+    writer = MatchedMessageWriter()
+    FlakySession.failures = 2
+    writer._flush([make_message() for _ in range(3)])
+    stats = writer.get_stats()
+    assert (stats['written'], stats['failed'], stats['retries']) == (3, 0, 2)
+    assert stored_count(session_factory) == 3
+
+
+def test_data_error_drops_only_bad_row(session_factory):
+    writer = MatchedMessageWriter()
+    writer._flush([make_message(), make_message(content=None), make_message()])
+    stats = writer.get_stats()
+    assert (stats['written'], stats['failed'], stats['retries']) == (2, 1, 0)
+    assert stored_count(session_factory) == 2
+
+
+def test_transient_error_without_retry_drops_batch(session_factory):
+    writer = MatchedMessageWriter()
+    FlakySession.failures = 1
+    writer._flush([make_message(), make_message()], retry=False)
+    stats = writer.get_stats()
+    assert (stats['written'], stats['failed']) == (0, 2)
+    assert stored_count(session_factory) == 0
+
+
+def test_enqueue_drops_when_queue_stays_full(session_factory):
+    writer = MatchedMessageWriter(max_queue_size=1)
+    writer._accepting = True  # 模拟后台线程卡在慢数据库上，不消费队列
+    writer.enqueue(make_message())
+    writer.enqueue(make_message())
+    stats = writer.get_stats()
+    assert (stats['enqueued'], stats['queue_full_waits'], stats['dropped']) == (1, 1, 1)
+    assert stats['queue_depth'] == 1
@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from notifier import NotificationDispatcher
+
+
+class WebhookStandIn(ThreadingHTTPServer):
+    """
+    本地机器人webhook替身: 按 responses 依次返回 (HTTP状态码, errcode)，用完后一直返回成功
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), WebhookHandler)
+        self.responses = []
+        self.requests = []  # [(收到请求的时间, 请求内容)]
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/robot/send?access_token=test"
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests.append((time.monotonic(), body))
+            status, errcode = self.server.responses.pop(0) if self.server.responses else (200, 0)
+        payload = json.dumps({'errcode': errcode, 'errmsg': 'ok' if errcode == 0 else 'error'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def webhook():
+    server = WebhookStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_dispatcher(**kwargs):
+    options = dict(worker_count=1, retry_backoff=0.05, timeout=2, url_validator=lambda channel, url: True)
+    options.update(kwargs)
+    return NotificationDispatcher(**options)
+
+
+def sent_titles(webhook):
+    return [body['markdown']['title'] for _, body in webhook.requests]
+
+
+def test_stop_keeps_rate_limit_and_drops_remainder(webhook):
+    dispatcher = make_dispatcher(rate_limit_count=2, rate_limit_period=60)
+    for i in range(5):
+        dispatcher.submit('dingtalk', webhook.url, f"告警{i}", '内容')
+    start = time.monotonic()
+    dispatcher.stop(timeout=0.5)
+
+    # 限流名额只有2个: 停止时剩余的通知不会绕过限流集中发出
+    assert time.monotonic() - start < 5
+    assert sent_titles(webhook) == ['告警0', '告警1']
+    stats = dispatcher.get_stats()
+    assert (stats['sent'], stats['dropped'], stats['queue_depth']) == (2, 3, 0)
+
+
+def test_retries_server_errors_until_sent(webhook):
+    webhook.responses = [(503, 0), (200, 130101)]
+    dispatcher = make_dispatcher()
+    dispatcher.submit('dingtalk', webhook.url, '告警', '内容')
+    dispatcher.stop(timeout=5)
+    assert sent_titles(webhook) == ['告警'] * 3
+    stats = dispatcher.get_stats()
+    assert (stats['sent'], stats['retried'], stats['failed']) == (1, 2, 0)
+
+
+def test_client_error_is_not_retried(webhook):
+    webhook.responses = [(400, 0)]
+    dispatcher = make_dispatcher()
+    dispatcher.submit('wecom', webhook.url, '告警', '内容')
+    dispatcher.stop(timeout=5)
+    assert len(webhook.requests) == 1
+    stats = dispatcher.get_stats()
+    assert (stats['sent'], stats['retried'], stats['failed']) == (0, 0, 1)
+
+
+def test_gives_up_after_max_retries(webhook):
+    webhook.responses = [(500, 0)] * 10
+    dispatcher = make_dispatcher(max_retries=2)
+    dispatcher.submit('dingtalk', webhook.url, '告警', '内容')
+    dispatcher.stop(timeout=5)
+    assert len(webhook.requests) == 3
+    assert dispatcher.get_stats()['failed'] == 1
+
+
+def test_rate_limit_spaces_requests(webhook):
+    dispatcher = make_dispatcher(worker_count=2, rate_limit_count=2, rate_limit_period=0.4)
+    for i in range(4):
+        dispatcher.submit('dingtalk', webhook.url, f"告警{i}", '内容')
+    dispatcher.stop(timeout=5)
+
+    times = sorted(received for received, _ in webhook.requests)
+    assert len(times) == 4
+    # 任意 0.4 秒窗口内最多2个请求
+    assert times[2] - times[0] >= 0.35
+    assert times[3] - times[1] >= 0.35
+    stats = dispatcher.get_stats()
+    assert stats['sent'] == 4 and stats['rate_limited'] >= 2
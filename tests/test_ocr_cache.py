@@ -0,0 +1,60 @@
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from ocr_cache import PerceptualHashIndex, compute_photo_hash, hamming_distance
+
+
+def test_find_returns_text_within_threshold():
+    index = PerceptualHashIndex(threshold=5)
+    value = 0x0123456789abcdef
+    index.add(value, '广告文字')
+    assert index.find(value) == '广告文字'
+    assert index.find(value ^ 0b10101) == '广告文字'  # 距离3
+    assert index.find(value ^ 0b111111) is None  # 距离6
+
+
+def test_find_prefers_nearest_candidate():
+    index = PerceptualHashIndex(threshold=5)
+    value = 0x0f0f0f0f0f0f0f0f
+    index.add(value ^ 0b1111, '远')
+    index.add(value ^ 0b1, '近')
+    assert index.find(value) == '近'
+
+
+def test_eviction_removes_band_entries():
+    index = PerceptualHashIndex(max_size=2)
+    first, second, third = 0x1111111111111111, 0x2222222222222222, 0x4444444444444444
+    for value, text in ((first, 'a'), (second, 'b'), (third, 'c')):
+        index.add(value, text)
+    assert index.find(first) is None
+    assert index.find(third) == 'c'
+    assert all(first not in bucket for buckets in index._buckets for bucket in buckets.values())
+
+
+def test_threshold_must_be_below_band_count():
+    with pytest.raises(ValueError):
+        PerceptualHashIndex(threshold=8, bands=8)
+
+
+def encode(image, size, quality):
+    output = io.BytesIO()
+    image.resize(size).save(output, 'JPEG', quality=quality)
+    return output.getvalue()
+
+
+def test_reencoded_image_hashes_close():
+    rng = random.Random(1)
+    image = Image.new('L', (64, 48))
+    image.putdata([rng.randrange(256) for _ in range(64 * 48)])
+    image = image.resize((640, 480), Image.BILINEAR).convert('RGB')
+    original = compute_photo_hash(encode(image, (640, 480), 95))
+    resized = compute_photo_hash(encode(image, (320, 240), 60))
+    assert original is not None and resized is not None
+    assert hamming_distance(original, resized) <= 5
+
+
+def test_flat_image_has_no_hash():
+    assert compute_photo_hash(encode(Image.new('RGB', (200, 200), 'white'), (200, 200), 90)) is None
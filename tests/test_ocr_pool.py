@@ -0,0 +1,18 @@
+import io
+
+from PIL import Image
+
+from ocr_pool import OcrWorkerPool
+
+
+def test_worker_processes_skip_blank_image_without_fork():
+    pool = OcrWorkerPool(workers=1)
+    assert pool.start_method in ('forkserver', 'spawn')
+    try:
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), 'white').save(buffer, 'PNG')
+        # 纯色图片在工作进程中被文字检测跳过，不调用 tesseract
+        assert pool.recognize(buffer.getvalue()) == ''
+        assert pool.get_stats()['no_text'] == 1
+    finally:
+        pool.stop()
@@ -0,0 +1,24 @@
+from text_normalizer import normalize_message, normalize_text, removes_punctuation
+
+
+def test_normalize_text_folds_width_script_and_separators():
+    assert normalize_text('ＡＢＣ 臺 軟體\u200b！') == 'abc台软体'
+
+
+def test_map_span_skips_removed_characters():
+    normalized = normalize_message('加 微\u200b信：ab')
+    assert normalized.text == '加微信ab'
+    assert normalized.map_span(0, 3) == (0, 5)
+    assert normalized.map_span(3, 5) == (6, 8)
+    assert normalized.map_span(1, 1) == (2, 2)
+
+
+def test_map_span_is_identity_without_removed_characters():
+    normalized = normalize_message('usdt')
+    assert normalized.map_span(1, 3) == (1, 3)
+
+
+def test_removes_punctuation_ignores_whitespace():
+    assert removes_punctuation('C++')
+    assert removes_punctuation('!!!')
+    assert not removes_punctuation('加 微信')
@@ -0,0 +1,163 @@
+import hashlib
+import re
+import string
+from bisect import bisect_right
+
+# 文本归一化: 消息和关键词使用同一套规则，抵御全角字符、零宽字符、插入空格/标点、繁体字等变形
+# 全部通过 str.translate 的预编译映射表完成，每条消息只做一次C层面的整体替换
+
+# 全角ASCII（！到～）→ 半角
+_FULLWIDTH_MAP = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F)}
+
+# 零宽及不可见格式字符: 直接删除
+_ZERO_WIDTH_CHARS = '\u00ad\u180e\u200b\u200c\u200d\u200e\u200f\u2060\u2061\u2062\u2063\u2064\ufeff'
+
+# 空白与标点: 直接删除（关键词中同样删除，因此 "U S D T"、"U.S.D.T" 都能命中 "usdt"）
+_SEPARATOR_CHARS = (
+    string.whitespace + string.punctuation
+    + '\u00a0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+    + '，。、；：？！…—–·‧•“”‘’（）《》〈〉【】「」『』〔〕〖〗～￥｀＿'
+    + '！＂＃＄％＆＇（）＊＋，－．／'
+    + '：；＜＝＞？＠［＼］＾｀｛｜｝～'
+)
+
+# 常用繁体字 → 简体字（每项两个字符: 繁体在前，简体在后）
+# 未依赖 OpenCC，只覆盖常见字；需要更多字时直接追加到这里
+_TRADITIONAL_TO_SIMPLIFIED = """
+萬万 與与 專专 業业 東东 絲丝 兩两 嚴严 個个 豐丰 臨临 為为 麗丽 舉举 義义 烏乌 樂乐 喬乔 習习 鄉乡
+書书 買买 亂乱 爭争 於于 虧亏 雲云 亞亚 產产 畝亩 親亲 億亿 僅仅 從从 倉仓 儀仪 們们 價价 眾众 衆众
+優优 會会 傘伞 偉伟 傳传 傷伤 倫伦 偽伪 體体 餘余 俠侠 側侧 偵侦 債债 傾倾 僱雇 儲储 兒儿 兌兑 黨党
+蘭兰 關关 興兴 養养 獸兽 內内 岡冈 冊册 寫写 軍军 農农 馮冯 衝冲 決决 況况 凍冻 淨净 減减 湊凑 幾几
+鳳凤 憑凭 凱凯 擊击 劃划 劉刘 則则 剛刚 創创 刪删 別别 劑剂 劍剑 勸劝 辦办 務务 動动 勵励 勁劲 勞劳
+勢势 區区 醫医 華华 協协 單单 賣卖 盧卢 衛卫 卻却 廠厂 廳厅 歷历 厲厉 壓压 厭厌 參参 雙双 發发 變变
+敘叙 號号 嘆叹 嚇吓 嗎吗 啟启 吳吴 員员 聽听 嗚呜 問问 啞哑 喚唤 喪丧 圍围 園园 國国 圖图 圓圆 聖圣
+場场 壞坏 塊块 堅坚 壇坛 墳坟 墜坠 壘垒 墊垫 牆墙 壯壮 聲声 殼壳 壺壶 處处 備备 復复 夠够 頭头 誇夸
+夾夹 奪夺 奮奋 奧奥 婦妇 媽妈 嬰婴 學学 孫孙 寧宁 寶宝 實实 審审 憲宪 宮宫 寬宽 賓宾 對对 導导 壽寿
+將将 爾尔 塵尘 嘗尝 層层 屬属 歲岁 島岛 峽峡 嶺岭 幣币 師师 帳帐 帶带 幫帮 庫库 應应 廟庙 廢废 廣广
+開开 異异 棄弃 張张 彌弥 彎弯 彈弹 強强 歸归 當当 錄录 徹彻 徑径 後后 憶忆 憂忧 懷怀 態态 總总 戀恋
+惡恶 驚惊 慣惯 懶懒 願愿 戰战 戲戏 撲扑 執执 擴扩 掃扫 揚扬 擾扰 撫抚 搶抢 護护 報报 擔担 擬拟 擁拥
+擇择 掛挂 擋挡 揮挥 損损 撿捡 換换 據据 攜携 搖摇 攝摄 擺摆 數数 斂敛 斷断 時时 曠旷 晝昼 顯显 晉晋
+曬晒 曉晓 暫暂 術术 機机 殺杀 雜杂 權权 條条 來来 楊杨 極极 構构 槍枪 標标 棧栈 樹树 樣样 橋桥 檢检
+樓楼 欄栏 櫃柜 歡欢 歐欧 殘残 毀毁 氣气 漢汉 湯汤 溝沟 沒没 澤泽 潔洁 灑洒 濃浓 濤涛 滅灭 燈灯 災灾
+爐炉 點点 煉炼 爛烂 熱热 愛爱 牽牵 犧牺 狀状 猶犹 獨独 獄狱 獅狮 獎奖 環环 現现 瑪玛 電电 畫画 暢畅
+療疗 癢痒 盤盘 盡尽 監监 盜盗 確确 礦矿 碼码 禮礼 禍祸 離离 種种 積积 稱称 穩稳 窮穷 竊窃 競竞 筆笔
+節节 範范 築筑 簡简 類类 糧粮 緊紧 紅红 約约 級级 紀纪 納纳 紙纸 線线 練练 組组 細细 終终 經经 結结
+給给 絕绝 統统 網网 綠绿 維维 綜综 編编 緣缘 縣县 績绩 織织 繼继 續续 絡络 繫系 係系 罰罚 羅罗 聯联
+聰聪 職职 腦脑 膽胆 臉脸 膚肤 舊旧 艦舰 藝艺 藥药 莊庄 蘇苏 蘋苹 萊莱 蓋盖 虛虚 蟲虫 蠻蛮 補补 裝装
+襲袭 裡里 裏里 見见 規规 視视 覺觉 覽览 觀观 計计 訂订 認认 討讨 讓让 訓训 議议 記记 講讲 許许 論论
+設设 訪访 證证 評评 識识 詞词 試试 詩诗 話话 該该 詳详 語语 誤误 說说 請请 諸诸 讀读 課课 誰谁 調调
+談谈 謝谢 謀谋 謊谎 謹谨 詐诈 訊讯 豬猪 貝贝 負负 財财 責责 貨货 質质 販贩 貪贪 貧贫 購购 貫贯 貴贵
+費费 貿贸 資资 賺赚 賬账 賠赔 賭赌 贈赠 贏赢 贊赞 貸贷 賽赛 趕赶 趙赵 躍跃 車车 轉转 輪轮 軟软 較较
+載载 輕轻 輸输 辭辞 邊边 遼辽 達达 遷迁 過过 運运 還还 這这 進进 遠远 違违 連连 遲迟 適适 選选 遞递
+邏逻 遺遗 郵邮 鄭郑 鄰邻 醬酱 釋释 鑒鉴 針针 釘钉 鐘钟 鋼钢 錢钱 鐵铁 鈴铃 銀银 銷销 鎖锁 鍋锅 錯错
+鍵键 鏡镜 鏈链 長长 門门 閃闪 閉闭 間间 閑闲 閱阅 闆板 闊阔 隊队 陽阳 陰阴 陣阵 階阶 際际 陸陆 險险
+隨随 隱隐 雞鸡 難难 霧雾 靜静 靈灵 韓韩 響响 頁页 頂顶 項项 順顺 須须 預预 領领 頻频 題题 額额 顏颜
+風风 飛飞 飯饭 飲饮 餓饿 館馆 馬马 駕驾 驗验 騙骗 驅驱 髮发 鬥斗 魚鱼 鮮鲜 鳥鸟 鴨鸭 鵝鹅 鹽盐 麥麦
+黃黄 齊齐 齒齿 龍龙 龜龟 兇凶 臺台 檯台 颱台 鬆松 傭佣 薦荐 註注 週周 瀏浏 彙汇 匯汇 娛娱 隻只 麼么
+麽么 無无 獲获 測测 雖虽 觸触 擠挤 蝦虾 糾纠 紛纷 純纯 紐纽 紋纹 綁绑 縮缩
+"""
+
+# 折叠映射（全角、大小写、繁简），不删除任何字符
+_FOLD = {}
+_FOLD.update({code: chr(value) for code, value in _FULLWIDTH_MAP.items()})
+_FOLD.update({ord(char): chr(ord(char) + 32) for char in string.ascii_uppercase})
+_FOLD.update({ord(trad): simp for trad, simp in _TRADITIONAL_TO_SIMPLIFIED.split() if trad != simp})
+# 全角大写字母直接映射到半角小写
+_FOLD.update({code: chr(code - 0xFEE0 + 32) for code in range(0xFF21, 0xFF3B)})
+
+_TRANSLATION = dict(_FOLD)
+# 删除类字符最后写入，覆盖前面的映射（例如全角标点）
+_TRANSLATION.update({ord(char): None for char in _ZERO_WIDTH_CHARS + _SEPARATOR_CHARS})
+NORMALIZE_TABLE = str.maketrans(_TRANSLATION)
+
+# 归一化规则指纹: 映射表（全角、繁简、删除字符等）任何改动都会改变，用于使旧的匹配器快照失效
+NORMALIZER_FINGERPRINT = hashlib.sha256(repr(sorted(NORMALIZE_TABLE.items())).encode('utf-8')).hexdigest()
+
+# 匹配所有会被删除的字符，用于按需计算偏移映射
+_REMOVED_RE = re.compile('[' + re.escape(_ZERO_WIDTH_CHARS + _SEPARATOR_CHARS) + ']')
+# 会被删除的标点（不含空白）
+_PUNCTUATION_RE = re.compile('[' + re.escape(''.join(c for c in _SEPARATOR_CHARS if not c.isspace())) + ']')
+
+# 不删除任何字符的折叠映射（全角、繁简、大小写），供保留标点的关键词生成正则: {折叠后的字符: 所有折叠为它的字符}
+_FOLD_TABLE = str.maketrans(_FOLD)
+_FOLD_VARIANTS = {}
+for _code, _value in _FOLD.items():
+    _FOLD_VARIANTS.setdefault(_value.lower(), set()).add(chr(_code))
+# 保留标点的关键词中，相邻字符之间允许插入的空白和零宽字符
+_GAP_PATTERN = '[' + re.escape(_ZERO_WIDTH_CHARS) + r'\s]*'
+
+
+def normalize_text(text):
+    """
+    归一化文本（关键词构建自动机时使用）: 全角转半角、删除零宽字符/空白/标点、繁体转简体、转小写
+    每个字符要么被删除、要么替换为一个字符，因此可以映射回原文位置
+    """
+    normalized = text.translate(NORMALIZE_TABLE)
+    lowered = normalized.lower()
+    if len(lowered) != len(normalized):
+        # 极少数字符小写后变成多个字符（如 'İ'），保持原样以维持一一对应
+        lowered = ''.join(c.lower() if len(c.lower()) == 1 else c for c in normalized)
+    return lowered
+
+
+def removes_punctuation(text):
+    """
+    归一化是否会删除文本中的标点（空白除外）: 这类关键词（如 C++、!!!）归一化后会丢失含义，
+    只剩 "c" 或空字符串，需要按原文匹配
+    """
+    return _PUNCTUATION_RE.search(text) is not None
+
+
+def punctuation_keyword_pattern(text):
+    """
+    为含标点的关键词（如 C++）生成在消息原文上执行的正则: 标点按原样匹配，
+    同时识别全角/繁体/大小写变形，并允许字符之间插入空白和零宽字符（如 "Ｃ + +"）
+    """
+    parts = []
+    for char in text:
+        if char.isspace() or char in _ZERO_WIDTH_CHARS:
+            continue
+        folded = char.translate(_FOLD_TABLE).lower()
+        variants = _FOLD_VARIANTS.get(folded, set()) | {folded}
+        parts.append(re.escape(folded) if len(variants) == 1 else '[' + re.escape(''.join(sorted(variants))) + ']')
+    return _GAP_PATTERN.join(parts)
+
+
+class NormalizedText:
+    """
+    一条消息的归一化结果，保留到原文的偏移映射（仅在需要时计算）
+    """
+    __slots__ = ('original', 'text', '_removed')
+
+    def __init__(self, original):
+        self.original = original
+        self.text = normalize_text(original)
+        self._removed = None
+
+    def to_original(self, index):
+        """归一化文本中的位置 → 原文中的位置"""
+        if len(self.text) == len(self.original):
+            return index
+        if self._removed is None:
+            self._removed = [m.start() for m in _REMOVED_RE.finditer(self.original)]
+        # 原文位置 = 归一化位置 + 其之前被删除的字符数（迭代到不动点）
+        position = index
+        while True:
+            shifted = index + bisect_right(self._removed, position)
+            if shifted == position:
+                return position
+            position = shifted
+
+    def map_span(self, start, end):
+        """归一化文本中的区间 [start, end) → 原文中的区间"""
+        if end <= start:
+            original_start = self.to_original(start)
+            return original_start, original_start
+        return self.to_original(start), self.to_original(end - 1) + 1
+
+
+def normalize_message(text):
+    """
+    归一化一条消息（文本消息与OCR结果共用）
+    """
+    return NormalizedText(text or "")